@@ -0,0 +1,189 @@
+"""
+异步（ASGI）服务入口
+
+Flask（app.run(threaded=True) 或其它WSGI服务器）中，每个打开的SSE流在整个生成期间占用一个线程，
+同时进行的流式回复数受线程数限制，线程多了内存和切换开销也随之上升。这里在同一个进程中：
+- 流式接口（聊天回复及断线续传、故事推进+小说）用异步视图实现，模型通过异步客户端（astream）调用，
+  大量的流共享一个事件循环，等待模型输出时不占用线程
+- 其余接口原样挂载Flask应用，由 a2wsgi 在线程池中执行，行为不变
+- 读库等阻塞操作放到线程池中执行，写库仍交给单写线程（database.submit_write）
+
+请求参数、事件格式和写库逻辑与 app.py 中的同名接口共用（prepare_chat、load_story_novel_state、
+story_novel_persist），两种服务方式下客户端无需区分。
+
+启动（需要安装 starlette、uvicorn、a2wsgi）：
+    uvicorn asgi:app --host 0.0.0.0 --port 5099
+
+环境变量：
+    GAME_WSGI_THREADS=32       执行Flask同步接口的线程数
+    GAME_DRAIN_TIMEOUT=30      停止服务时等待生成中的聊天回复结束的时长（秒），超时后中断
+    GAME_RECOVER_JOBS=1        启动时恢复后台任务；serve.py 已在主进程中恢复时设为0
+"""
+
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import database
+import reply_streams
+import app as flask_module
+
+WSGI_THREADS = int(os.environ.get('GAME_WSGI_THREADS', '32'))
+DRAIN_TIMEOUT = float(os.environ.get('GAME_DRAIN_TIMEOUT', '30'))
+RECOVER_JOBS = os.environ.get('GAME_RECOVER_JOBS', '1') != '0'
+
+ai_engine = flask_module.ai_engine
+registry = flask_module.reply_streams_registry
+
+
+def _error(message, status):
+    return JSONResponse({'success': False, 'error': message}, status_code=status)
+
+
+def _sse(payload) -> str:
+    # 与 app.py 中的SSE接口格式一致
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def _reply_stream_response(stream, last_event_id=0):
+    return StreamingResponse(reply_streams.aevents(stream, last_event_id), media_type='text/event-stream',
+                             headers={
+                                 'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no',
+                                 'X-Stream-Id': stream.id
+                             })
+
+
+async def chat_stream(request):
+    """POST /api/chat-stream 的异步版本"""
+    try:
+        data = await request.json()
+        try:
+            # 可能需要读库组装历史对话
+            llm, messages, write_turn = await run_in_threadpool(flask_module.prepare_chat, data)
+        except flask_module.RequestError as e:
+            return _error(str(e), e.status)
+
+        async def produce(stream):
+            async for chunk in llm.astream(messages):
+                if stream.cancelled:
+                    break
+                content = getattr(chunk, 'content', None)
+                if content:
+                    stream.append(content)
+
+        async def on_finish(stream, error):
+            if write_turn:
+                await asyncio.wrap_future(database.submit_write(write_turn(stream.text())))
+
+        try:
+            stream = registry.start_async(produce, on_finish)
+        except reply_streams.StreamLimitReached as e:
+            return _error(str(e), 503)
+        return _reply_stream_response(stream)
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+async def resume_chat_stream(request):
+    """GET /api/chat-stream/<stream_id> 的异步版本"""
+    stream = registry.get(request.path_params['stream_id'], resumed=True)
+    if stream is None:
+        return _error('回复不存在或已过期', 404)
+    last_event_id = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id')
+    return _reply_stream_response(stream, reply_streams.parse_event_id(last_event_id))
+
+
+async def cancel_chat_stream(request):
+    """POST /api/chat-stream/<stream_id>/cancel 的异步版本"""
+    if registry.cancel(request.path_params['stream_id']) is None:
+        return _error('回复不存在或已过期', 404)
+    return JSONResponse({'success': True})
+
+
+async def generate_story_and_novel_stream(request):
+    """POST /api/saves/<save_id>/generate-story-novel 的异步版本"""
+    save_id = request.path_params['save_id']
+    data = await request.json()
+    story_guide = data.get('story_guide', '')
+    model_config_id = data.get('model_config_id')
+
+    async def generate():
+        try:
+            if not story_guide:
+                yield _sse({'type': 'error', 'error': '需要提供故事引导词'})
+                return
+
+            try:
+                save, factions, characters, regions = await run_in_threadpool(
+                    flask_module.load_story_novel_state, save_id, story_guide)
+            except flask_module.RequestError as e:
+                yield _sse({'type': 'error', 'error': str(e)})
+                return
+
+            full_data = None
+            async for stream_data in ai_engine.agenerate_story_and_novel_stream(
+                save_id=save_id,
+                story_guide=story_guide,
+                current_day=save[8],
+                world_background=save[4],
+                factions=factions,
+                characters=characters,
+                regions=regions,
+                model_config_id=model_config_id
+            ):
+                yield _sse(stream_data)
+                if stream_data.get('type') == 'complete':
+                    full_data = stream_data.get('full_data')
+
+            if full_data:
+                try:
+                    persist, saved_event = flask_module.story_novel_persist(save_id, save, story_guide, full_data,
+                                                                            factions, characters)
+                    novel_id = await asyncio.wrap_future(database.submit_write(persist))
+                    yield _sse(saved_event(novel_id))
+                except Exception as e:
+                    print(f"保存数据时出错: {str(e)}")
+                    yield _sse({'type': 'error', 'error': f'保存数据失败: {str(e)}'})
+
+            yield _sse({'type': 'final_complete'})
+
+        except Exception as e:
+            print(f"生成故事和小说时出错: {str(e)}")
+            yield _sse({'type': 'error', 'error': str(e)})
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': 'Content-Type'
+    })
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    await run_in_threadpool(flask_module.init_db, RECOVER_JOBS)
+    yield
+    # 停止服务时等待生成中的聊天回复结束并写库，超时的回复被中断（已生成的部分照常保存）
+    await registry.drain(DRAIN_TIMEOUT)
+    # 线程中生成的回复、后台任务和排队中的写入
+    await run_in_threadpool(flask_module.shutdown_services)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/chat-stream', chat_stream, methods=['POST']),
+        Route('/api/chat-stream/{stream_id}', resume_chat_stream, methods=['GET']),
+        Route('/api/chat-stream/{stream_id}/cancel', cancel_chat_stream, methods=['POST']),
+        Route('/api/saves/{save_id:int}/generate-story-novel', generate_story_and_novel_stream, methods=['POST']),
+        # 其余接口交给Flask
+        Mount('/', app=WSGIMiddleware(flask_module.app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,1550 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+AI沙盒游戏性能基准测试脚本
+
+用法：
+    python benchmark.py load --requests 500 --threads 4
+    python benchmark.py plans        # 检查热点查询是否走索引，出现全表扫描时返回非0
+    python benchmark.py apply --events 500
+    python benchmark.py template --characters 5000
+    python benchmark.py sections --include save,factions,characters
+    python benchmark.py stream --chars 10000      # 旧版逐块重扫是二次方的，--chars 50000 时约需90秒
+    python benchmark.py limiter --threads 16 --provider-concurrency 4
+    python benchmark.py context --characters 50,500,5000
+    python benchmark.py retrieval --characters 50,500,5000
+    python benchmark.py memory --chars 20000
+    python benchmark.py world --factions 6
+    python benchmark.py chat --turns 200
+    python benchmark.py resume --chunks 400 --drop-at 0.5
+    python benchmark.py asgi --streams 200,1000   # 需要 starlette、uvicorn、a2wsgi、httpx
+    python benchmark.py serve --workers 2         # 也可用 python serve.py --bench
+    python benchmark.py soak --rounds 20 --error-rate 0.05   # 完整流程，使用本地模拟模型（stub_llm.py）
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# 禁用Flask自动加载.env文件
+os.environ['FLASK_SKIP_DOTENV'] = '1'
+
+# 基准测试使用独立的临时数据库，避免污染game.db
+_BENCH_DIR = tempfile.mkdtemp(prefix='ai_sandbox_bench_')
+os.environ.setdefault('GAME_DB_PATH', os.path.join(_BENCH_DIR, 'bench.db'))
+
+
+def seed_save(conn, factions=6, characters=30, events_per_day=6, days=30):
+    """写入一个用于测试的存档，返回存档ID"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO saves (name, world_background, world_introduction, cultivation_system, map_data)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ('基准测试存档', '测试世界背景' * 20, '测试世界介绍', '练气、筑基、金丹', '{}'))
+    save_id = cursor.lastrowid
+
+    faction_ids = []
+    for i in range(factions):
+        cursor.execute('''
+            INSERT INTO factions (save_id, name, ideal, background, description, status, power_level, headquarters_location)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (save_id, f'势力{i}', '理想', '背景' * 10, '描述' * 10, '活跃', 50 + i, f'总部{i}'))
+        faction_ids.append(cursor.lastrowid)
+
+    for i in range(factions):
+        cursor.execute('''
+            INSERT INTO map_regions (save_id, name, type, parent_id, faction_id, description)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (save_id, f'地区{i}', '州', None, faction_ids[i], '地区描述'))
+
+    character_ids = []
+    for i in range(characters):
+        cursor.execute('''
+            INSERT INTO characters (save_id, faction_id, name, status, personality, birthday, age,
+                                  location, position, realm, lifespan, equipment, skills, experience, goals, relationships)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (save_id, faction_ids[i % factions], f'人物{i}', '活跃', '性格', '春月初三', 20 + i,
+              '某地', '弟子', '筑基期', 150, json.dumps(['长剑']), json.dumps(['御剑术']),
+              '经历' * 20, '目标', '关系'))
+        character_ids.append(cursor.lastrowid)
+
+    for day in range(1, days + 1):
+        for j in range(events_per_day):
+            cursor.execute('''
+                INSERT INTO world_events (save_id, day, time_period, faction_id, theme, event_title, event_description, region_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (save_id, day, '清晨', None, '主题', f'世界事件{day}-{j}', '事件描述' * 20, None))
+            cursor.execute('''
+                INSERT INTO faction_events (save_id, faction_id, day, time_period, theme, event_title, event_description)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (save_id, faction_ids[j % factions], day, '上午', '主题', f'势力事件{day}-{j}', '事件描述' * 20))
+            cursor.execute('''
+                INSERT INTO character_events (save_id, character_id, day, time_period, theme, event_title, event_description)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (save_id, character_ids[j % characters], day, '下午', '主题', f'人物事件{day}-{j}', '事件描述' * 20))
+
+    conn.commit()
+    return save_id
+
+
+def measure(func, requests, threads):
+    """并发执行func共requests次，返回(耗时秒数, 每秒请求数)"""
+    start = time.perf_counter()
+    if threads <= 1:
+        for _ in range(requests):
+            func()
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(lambda _: func(), range(requests)))
+    elapsed = time.perf_counter() - start
+    return elapsed, requests / elapsed if elapsed else float('inf')
+
+
+def bench_load(args):
+    """对比连接池开启/关闭时 /api/saves/<id>/load 的吞吐量"""
+    import database
+    from app import app, init_db
+
+    init_db()
+    conn = database.connect()
+    save_id = seed_save(conn, days=args.days)
+    conn.close()
+
+    client = app.test_client()
+    url = f'/api/saves/{save_id}/load'
+
+    def hit():
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+
+    results = []
+    for label, pool_size in (('before (无连接池)', 0), ('after (连接池)', database.POOL_SIZE or 8)):
+        database.configure(pool_size=pool_size)
+        hit()  # 预热
+        elapsed, rps = measure(hit, args.requests, args.threads)
+        results.append((label, elapsed, rps))
+
+    print(f"GET {url}  requests={args.requests} threads={args.threads}")
+    for label, elapsed, rps in results:
+        print(f"  {label:<20} {elapsed:8.3f}s  {rps:10.1f} req/s")
+    print(f"  连接池统计: {database.pool_stats()}")
+
+
+def bench_sections(args):
+    """对比完整加载与分段加载（模拟后刷新）的耗时和响应大小"""
+    import database
+    import migrations
+    import save_sections
+
+    conn = database.connect()
+    migrations.migrate(conn)
+    save_id = seed_save(conn, days=args.days)
+
+    include = save_sections.parse_include(args.include)
+    print(f"load save sections  days={args.days} include={args.include} rounds={args.rounds}")
+    for label, load in (('before (完整加载)', lambda: save_sections.load_save_sections(conn, save_id)),
+                        ('after (分段加载)', lambda: save_sections.load_save_sections(
+                            conn, save_id, include, character_detail=False, events_limit=50))):
+        timings = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            payload = json.dumps(load(), ensure_ascii=False)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f"  {label:<18} median {timings[len(timings) // 2] * 1000:8.2f}ms  "
+              f"payload {len(payload.encode('utf-8')) / 1024:10.1f}KB")
+    conn.close()
+
+
+# 热点查询（与app.py / ai_engine.py中的写法保持一致），全部应当走索引
+QUERY_PLAN_CHECKS = [
+    ('load_save: map_regions', 'SELECT * FROM map_regions WHERE save_id = ?'),
+    ('load_save: factions', 'SELECT * FROM factions WHERE save_id = ?'),
+    ('load_save: faction_relationships', '''
+        SELECT fr.*, f1.name as faction1_name, f2.name as faction2_name
+        FROM faction_relationships fr
+        JOIN factions f1 ON fr.faction1_id = f1.id
+        JOIN factions f2 ON fr.faction2_id = f2.id
+        WHERE fr.save_id = ?
+    '''),
+    ('load_save: characters', '''
+        SELECT c.*, f.name as faction_name
+        FROM characters c
+        LEFT JOIN factions f ON c.faction_id = f.id
+        WHERE c.save_id = ?
+    '''),
+    ('load_save: character_relationships', '''
+        SELECT cr.*, c1.name as character1_name, c2.name as character2_name
+        FROM character_relationships cr
+        JOIN characters c1 ON cr.character1_id = c1.id
+        JOIN characters c2 ON cr.character2_id = c2.id
+        WHERE cr.save_id = ?
+    '''),
+    ('load_save: world_events', '''
+        SELECT we.*, f.name as faction_name, mr.name as region_name
+        FROM world_events we
+        LEFT JOIN factions f ON we.faction_id = f.id
+        LEFT JOIN map_regions mr ON we.region_id = mr.id
+        WHERE we.save_id = ? ORDER BY we.day DESC
+    '''),
+    ('load_save: faction_events', '''
+        SELECT fe.*, f.name as faction_name
+        FROM faction_events fe
+        JOIN factions f ON fe.faction_id = f.id
+        WHERE fe.save_id = ? ORDER BY fe.day DESC
+    '''),
+    ('load_save: character_events', '''
+        SELECT ce.*, c.name as character_name
+        FROM character_events ce
+        JOIN characters c ON ce.character_id = c.id
+        WHERE ce.save_id = ? ORDER BY ce.day DESC
+    '''),
+    ('load_save: generation_logs',
+     'SELECT * FROM generation_logs WHERE save_id = ? ORDER BY created_at DESC LIMIT 10'),
+    ('generate_novel: recent events', '''
+        SELECT 'world' as type, day, time_period, event_title, event_description FROM world_events
+        WHERE save_id = ?
+        UNION ALL
+        SELECT 'faction' as type, day, time_period, event_title, event_description FROM faction_events
+        WHERE save_id = ?
+        UNION ALL
+        SELECT 'character' as type, day, time_period, event_title, event_description FROM character_events
+        WHERE save_id = ?
+        ORDER BY day DESC
+        LIMIT 10
+    '''),
+    ('generate_novel: recent novels',
+     'SELECT title, content FROM novels WHERE save_id = ? ORDER BY created_at DESC LIMIT 2'),
+    ('get_novels', '''
+        SELECT id, title, theme, style, content, day, characters_involved, factions_involved, created_at
+        FROM novels WHERE save_id = ? ORDER BY created_at DESC
+    '''),
+    ('get_chat_messages', 'SELECT * FROM chat_messages WHERE chat_id = ? ORDER BY id ASC'),
+    ('get_template: characters', '''
+        SELECT tc.*, tf.name as faction_name
+        FROM template_characters tc
+        LEFT JOIN template_factions tf ON tc.template_faction_id = tf.id
+        WHERE tc.template_id = ?
+    '''),
+    ('list_save_jobs', 'SELECT * FROM jobs WHERE save_id = ? AND status = ? ORDER BY created_at DESC LIMIT ?'),
+    ('recover_jobs', "SELECT id, kind, params FROM jobs WHERE status = 'queued' ORDER BY created_at"),
+    ('story_memory_days', 'SELECT day, summary FROM story_days WHERE save_id = ? ORDER BY day DESC LIMIT ?'),
+    ('story_memory_arc', 'SELECT summary FROM story_arcs WHERE save_id = ?'),
+    ('chat_context: unsummarized messages',
+     'SELECT id, role, content FROM chat_messages WHERE chat_id = ? AND id > ? ORDER BY id'),
+]
+
+
+def check_query_plans(conn):
+    """对热点查询执行EXPLAIN QUERY PLAN，返回 [(名称, 执行计划, 全表扫描的步骤)]"""
+    import timeline
+
+    checks = list(QUERY_PLAN_CHECKS)
+    checks.append(('get_timeline: first page', timeline.build_timeline_query(1)[0]))
+    checks.append(('get_timeline: next page', timeline.build_timeline_query(1, cursor=(1, '', 1, 'faction'))[0]))
+    checks.append(('get_timeline: filtered', timeline.build_timeline_query(1, ['character'], (1, '', 1, 'world'))[0]))
+
+    results = []
+    for name, sql in checks:
+        params = (1,) * sql.count('?')
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        scans = [detail for detail in plan if detail.startswith('SCAN ')]
+        results.append((name, plan, scans))
+    return results
+
+
+def bench_plans(args):
+    """检查热点查询的执行计划，出现全表扫描时返回1"""
+    import database
+    import migrations
+
+    conn = database.connect()
+    migrations.migrate(conn)
+    results = check_query_plans(conn)
+    conn.close()
+
+    failed = 0
+    for name, plan, scans in results:
+        status = 'FULL SCAN' if scans else 'ok'
+        print(f"[{status}] {name}")
+        if scans or args.verbose:
+            for detail in plan:
+                print(f"    {detail}")
+        failed += bool(scans)
+
+    print(f"{len(results) - failed}/{len(results)} 个查询走索引")
+    return 1 if failed else 0
+
+
+def make_simulation_result(events, faction_ids, character_ids, start_day=1):
+    """构造一个包含指定数量事件的模拟结果（三类事件各占约1/3，另附势力/人物更新）"""
+    result = {'world_events': [], 'faction_events': [], 'character_events': [],
+              'faction_updates': [], 'character_updates': [],
+              'new_time': f'第{start_day + 7}天，清晨', 'summary': '基准测试摘要'}
+    for i in range(events):
+        day = start_day + i % 7
+        kind = i % 3
+        if kind == 0:
+            result['world_events'].append({
+                'day': day, 'time_period': '清晨', 'faction_id': None, 'theme': '主题',
+                'title': f'世界事件{i}', 'description': '事件描述' * 30, 'region_id': None})
+        elif kind == 1:
+            result['faction_events'].append({
+                'faction_id': faction_ids[i % len(faction_ids)], 'day': day, 'time_period': '上午',
+                'theme': '主题', 'title': f'势力事件{i}', 'description': '事件描述' * 30})
+        else:
+            result['character_events'].append({
+                'character_id': character_ids[i % len(character_ids)], 'day': day, 'time_period': '下午',
+                'theme': '主题', 'title': f'人物事件{i}', 'description': '事件描述' * 30})
+    for faction_id in faction_ids:
+        result['faction_updates'].append({
+            'faction_id': faction_id, 'action': 'update', 'status': '扩张', 'power_level': 60,
+            'description': '势力变化', 'headquarters_location': '总部'})
+    for character_id in character_ids:
+        result['character_updates'].append({
+            'character_id': character_id, 'action': 'update', 'status': '闭关', 'age': 30,
+            'location': '洞府', 'position': '长老', 'realm': '金丹期', 'experience': '经历',
+            'goals': '目标', 'faction_id': faction_ids[0]})
+    for i in range(max(1, events // 50)):
+        result['character_updates'].append({
+            'action': 'create', 'name': f'新人物{i}', 'faction_id': faction_ids[0], 'skills': ['剑法']})
+    return result
+
+
+def _apply_row_by_row(conn, save_id, result, story_guide, new_day, new_time):
+    """旧版逐行写入逻辑（仅用于基准对比）"""
+    cursor = conn.cursor()
+    for event in result.get('world_events', []):
+        cursor.execute('''
+            INSERT INTO world_events (save_id, day, time_period, faction_id, theme, event_title, event_description, region_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (save_id, event['day'], event.get('time_period', ''), event.get('faction_id'),
+              event.get('theme', ''), event['title'], event['description'], event.get('region_id')))
+    for event in result.get('faction_events', []):
+        cursor.execute('''
+            INSERT INTO faction_events (save_id, faction_id, day, time_period, theme, event_title, event_description)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (save_id, event.get('faction_id'), event['day'], event.get('time_period', ''),
+              event.get('theme', ''), event['title'], event['description']))
+    for event in result.get('character_events', []):
+        cursor.execute('''
+            INSERT INTO character_events (save_id, character_id, day, time_period, theme, event_title, event_description)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (save_id, event.get('character_id'), event['day'], event.get('time_period', ''),
+              event.get('theme', ''), event['title'], event['description']))
+    for update in result.get('faction_updates', []):
+        if update.get('action') == 'update' and update.get('faction_id'):
+            cursor.execute('''
+                UPDATE factions SET status = ?, power_level = ?, description = ?, headquarters_location = ?
+                WHERE id = ? AND save_id = ?
+            ''', (update.get('status', ''), update.get('power_level', 50), update.get('description', ''),
+                  update.get('headquarters_location', ''), update.get('faction_id'), save_id))
+    for update in result.get('character_updates', []):
+        if update.get('action') == 'create':
+            cursor.execute('''
+                INSERT INTO characters (save_id, faction_id, name, status, personality, birthday, age,
+                                      location, position, realm, lifespan, equipment, skills, experience, goals, relationships)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (save_id, update.get('faction_id'), update['name'], update.get('status', '活跃'),
+                  update.get('personality', ''), update.get('birthday', ''), update.get('age', 25),
+                  update.get('location', ''), update.get('position', ''), update.get('realm', ''),
+                  update.get('lifespan', 100), json.dumps(update.get('equipment', [])),
+                  json.dumps(update.get('skills', [])), update.get('experience', ''),
+                  update.get('goals', ''), update.get('relationships', '')))
+        elif update.get('action') == 'update' and update.get('character_id'):
+            cursor.execute('''
+                UPDATE characters SET status = ?, age = ?, location = ?, position = ?, realm = ?,
+                    experience = ?, goals = ?, faction_id = ?
+                WHERE id = ? AND save_id = ?
+            ''', (update.get('status', ''), update.get('age', 0), update.get('location', ''),
+                  update.get('position', ''), update.get('realm', ''), update.get('experience', ''),
+                  update.get('goals', ''), update.get('faction_id'), update.get('character_id'), save_id))
+    cursor.execute('''
+        INSERT INTO generation_logs (save_id, guide_text, result_summary, world_refreshed, factions_refreshed, characters_refreshed)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (save_id, story_guide, result.get('summary', ''), True, True, True))
+    cursor.execute('UPDATE saves SET current_day = ?, current_time = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                   (new_day, new_time, save_id))
+
+
+def bench_apply(args):
+    """对比逐行写入与批量写入一次模拟结果的耗时"""
+    import database
+    import migrations
+    import persistence
+
+    conn = database.connect()
+    migrations.migrate(conn)
+    save_id = seed_save(conn, days=1)
+    faction_ids = [row[0] for row in conn.execute('SELECT id FROM factions WHERE save_id = ?', (save_id,))]
+    character_ids = [row[0] for row in conn.execute('SELECT id FROM characters WHERE save_id = ?', (save_id,))]
+    result = make_simulation_result(args.events, faction_ids, character_ids)
+
+    print(f"apply simulation result  events={args.events} rounds={args.rounds}")
+    for label, apply in (('before (逐行execute)', _apply_row_by_row),
+                         ('after (executemany)', persistence.apply_simulation_result)):
+        timings = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            apply(conn, save_id, result, '基准测试', 8, result['new_time'])
+            conn.commit()
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f"  {label:<22} median {timings[len(timings) // 2] * 1000:8.2f}ms  "
+              f"min {timings[0] * 1000:8.2f}ms")
+    conn.close()
+
+
+def seed_template(conn, factions=50, characters=5000, regions=200):
+    """写入一个大型世界模版，返回模版ID"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO world_templates (name, description, world_background, world_introduction, cultivation_system)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (f'基准模版{time.time_ns()}', '基准测试', '世界背景' * 50, '世界介绍' * 50, '修炼体系' * 50))
+    template_id = cursor.lastrowid
+
+    faction_ids = []
+    for i in range(factions):
+        cursor.execute('''
+            INSERT INTO template_factions (template_id, name, ideal, background, description, power_level, headquarters_location)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (template_id, f'势力{i}', '理念' * 10, '背景' * 20, '描述' * 20, 50 + i % 50, f'总部{i}'))
+        faction_ids.append(cursor.lastrowid)
+
+    region_ids = []
+    for i in range(regions):
+        parent_id = region_ids[(i - 1) // 4] if i else None
+        cursor.execute('''
+            INSERT INTO template_regions (template_id, name, type, parent_id, template_faction_id, description)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (template_id, f'地区{i}', '城市', parent_id, faction_ids[i % factions], '地区描述' * 10))
+        region_ids.append(cursor.lastrowid)
+
+    cursor.executemany('''
+        INSERT INTO template_characters (template_id, template_faction_id, name, personality, birthday, age,
+                                       location, position, realm, lifespan, equipment, skills, experience, goals, relationships)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(template_id, faction_ids[i % factions] if i % 7 else None, f'人物{i}', '性格' * 10, '1月1日',
+           20 + i % 60, f'地区{i % regions}', '弟子', '练气期', 100, json.dumps(['长剑']),
+           json.dumps(['剑法', '身法']), '经历' * 30, '目标' * 10, '关系' * 10)
+          for i in range(characters)])
+    conn.commit()
+    return template_id
+
+
+def _instantiate_via_json(conn, template_id, name):
+    """旧流程：读出整个模版序列化为JSON（前端往返），再作为世界数据写回（仅用于基准对比）"""
+    import persistence
+
+    cursor = conn.cursor()
+    cursor.execute('SELECT world_background, world_introduction, cultivation_system FROM world_templates WHERE id = ?',
+                   (template_id,))
+    template = cursor.fetchone()
+    cursor.execute('SELECT id, name, ideal, background, description, power_level, headquarters_location '
+                   'FROM template_factions WHERE template_id = ?', (template_id,))
+    factions = cursor.fetchall()
+    faction_names = {row[0]: row[1] for row in factions}
+    cursor.execute('SELECT id, name, type, parent_id, template_faction_id, description '
+                   'FROM template_regions WHERE template_id = ?', (template_id,))
+    regions = cursor.fetchall()
+    region_names = {row[0]: row[1] for row in regions}
+    cursor.execute('SELECT template_faction_id, name, personality, birthday, age, location, position, realm, lifespan, '
+                   'equipment, skills, experience, goals, relationships FROM template_characters WHERE template_id = ?',
+                   (template_id,))
+    characters = cursor.fetchall()
+
+    payload = json.dumps({
+        'name': name,
+        'world_background': template[0],
+        'world_introduction': template[1],
+        'cultivation_system': template[2],
+        'factions': [{'name': f[1], 'ideal': f[2], 'background': f[3], 'description': f[4],
+                      'power_level': f[5], 'headquarters_location': f[6]} for f in factions],
+        'regions': [{'name': r[1], 'type': r[2], 'parent_name': region_names.get(r[3]),
+                     'faction_name': faction_names.get(r[4]), 'description': r[5]} for r in regions],
+        'characters': [{'faction': faction_names.get(c[0]), 'name': c[1], 'personality': c[2], 'birthday': c[3],
+                        'age': c[4], 'location': c[5], 'position': c[6], 'realm': c[7], 'lifespan': c[8],
+                        'equipment': json.loads(c[9]), 'skills': json.loads(c[10]), 'experience': c[11],
+                        'goals': c[12], 'relationships': c[13]} for c in characters]
+    }, ensure_ascii=False)
+    return persistence.create_world(conn, json.loads(payload))
+
+
+def bench_template(args):
+    """对比经JSON往返创建存档与数据库内INSERT ... SELECT复制模版的耗时"""
+    import database
+    import migrations
+    import persistence
+
+    conn = database.connect()
+    migrations.migrate(conn)
+    template_id = seed_template(conn, factions=args.factions, characters=args.characters, regions=args.regions)
+
+    print(f"instantiate template  characters={args.characters} factions={args.factions} "
+          f"regions={args.regions} rounds={args.rounds}")
+    for label, instantiate in (('before (JSON往返)', _instantiate_via_json),
+                               ('after (INSERT SELECT)', persistence.instantiate_template)):
+        timings = []
+        for i in range(args.rounds):
+            start = time.perf_counter()
+            instantiate(conn, template_id, f'基准存档{i}')
+            conn.commit()
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f"  {label:<22} median {timings[len(timings) // 2] * 1000:8.2f}ms  "
+              f"min {timings[0] * 1000:8.2f}ms")
+    conn.close()
+
+
+def make_stream_response(chars=50000, chapters=1):
+    """构造一段约chars字符、带```json代码块的小说+故事推进响应（格式同流式生成接口）"""
+    per_chapter = max(1, chars // chapters)
+    sentence = '他推开"山门"，望向远方。\n'
+    data = {
+        'novel': {
+            'title': '基准小说',
+            'chapters': [{'title': f'第{i + 1}章', 'content': ''} for i in range(chapters)]
+        },
+        'story_progress': {
+            'world_events': [{'day': 1, 'time_period': '清晨', 'theme': '主题', 'title': f'事件{i}',
+                              'description': '事件描述' * 10} for i in range(20)],
+            'faction_updates': [], 'character_updates': [],
+            'new_time': '第2天，清晨', 'summary': '基准测试摘要'
+        }
+    }
+    content = (sentence * (per_chapter // len(sentence) + 1))[:per_chapter]
+    for chapter in data['novel']['chapters']:
+        chapter['content'] = content
+    return '```json\n' + json.dumps(data, ensure_ascii=False, indent=2) + '\n```'
+
+
+def _scan_stream_quadratic(chunks):
+    """旧版流式解析逻辑：每收到一块就从头查找并重新扫描已累积的内容（仅用于基准对比）"""
+    import re
+
+    events = []
+    accumulated_content = ""
+    current_state = "waiting"
+    novel_title_sent = False
+    chapter_title_sent = False
+    last_sent_length = 0
+    for chunk in chunks:
+        accumulated_content += chunk
+        if current_state == "waiting":
+            if '"novel"' in accumulated_content and '"title":' in accumulated_content:
+                novel_section = accumulated_content[accumulated_content.find('"novel"'):]
+                title_start = novel_section.find('"title":')
+                title_content = novel_section[title_start + 8:].strip()
+                if title_content.startswith('"'):
+                    current_pos = 1
+                    while current_pos < len(title_content):
+                        if title_content[current_pos] == '"' and title_content[current_pos - 1] != '\\':
+                            if not novel_title_sent:
+                                events.append({"type": "novel_title", "title": title_content[1:current_pos]})
+                                novel_title_sent = True
+                                current_state = "novel_content"
+                            break
+                        current_pos += 1
+        elif current_state == "novel_content":
+            if '"chapters"' in accumulated_content:
+                chapter_section = accumulated_content[accumulated_content.find('"chapters"'):]
+                if not chapter_title_sent:
+                    title_match = re.search(r'"title":\s*"([^"]*)"', chapter_section)
+                    if title_match:
+                        events.append({"type": "chapter_title", "chapter_index": 0,
+                                       "chapter_title": title_match.group(1)})
+                        chapter_title_sent = True
+                content_start = chapter_section.find('"content":')
+                if content_start != -1:
+                    content_section = chapter_section[content_start + 10:].strip()
+                    if content_section.startswith('"'):
+                        current_pos = 1
+                        extracted_content = ""
+                        in_escape = False
+                        while current_pos < len(content_section):
+                            char = content_section[current_pos]
+                            if in_escape:
+                                extracted_content += {'n': '\n', '"': '"', '\\': '\\'}.get(char, char)
+                                in_escape = False
+                                current_pos += 1
+                                continue
+                            if char == '\\':
+                                in_escape = True
+                                current_pos += 1
+                                continue
+                            if char == '"' and content_section[current_pos + 1:current_pos + 20].strip().startswith('}'):
+                                if len(extracted_content) > last_sent_length:
+                                    events.append({"type": "content_chunk",
+                                                   "content": extracted_content[last_sent_length:], "is_final": True})
+                                events.append({"type": "novel_complete"})
+                                current_state = "story_progress"
+                                break
+                            extracted_content += char
+                            current_pos += 1
+                            if len(extracted_content) - last_sent_length >= 10:
+                                events.append({"type": "content_chunk",
+                                               "content": extracted_content[last_sent_length:], "is_final": False})
+                                last_sent_length = len(extracted_content)
+        elif current_state == "story_progress":
+            json_start = accumulated_content.find('```json')
+            if json_start != -1:
+                json_content = accumulated_content[json_start + 7:]
+                json_end = json_content.find('```')
+                if json_end != -1:
+                    try:
+                        full_data = json.loads(json_content[:json_end].strip())
+                        events.append({"type": "story_progress", "data": full_data['story_progress']})
+                        events.append({"type": "complete", "full_data": full_data})
+                        return events
+                    except json.JSONDecodeError:
+                        pass
+    return events
+
+
+def _scan_stream_incremental(chunks):
+    """新版：增量解析器每块只处理一次"""
+    from stream_json import StreamingJSONParser
+
+    parser = StreamingJSONParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+        if parser.done:
+            events.append(('complete', (), parser.value))
+            break
+    return events
+
+
+def bench_stream(args):
+    """对比旧版逐块重扫与增量解析处理一段流式小说响应的耗时"""
+    response = make_stream_response(args.chars, args.chapters)
+    chunks = [response[i:i + args.chunk_size] for i in range(0, len(response), args.chunk_size)]
+
+    print(f"stream parse  novel_chars={args.chars} response_chars={len(response)} chunks={len(chunks)} chapters={args.chapters} rounds={args.rounds}")
+    for label, scan in (('before (逐块重扫)', _scan_stream_quadratic),
+                        ('after (增量解析)', _scan_stream_incremental)):
+        timings = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            scan(chunks)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f"  {label:<22} median {timings[len(timings) // 2] * 1000:8.2f}ms  "
+              f"min {timings[0] * 1000:8.2f}ms")
+
+    # 两种方式解析出的正文和最终数据应当一致
+    expected = json.loads(response[len('```json'):-3])
+    events = _scan_stream_incremental(chunks)
+    if events[-1][2] != expected:
+        print('  增量解析结果与json.loads不一致')
+        return 1
+    return 0
+
+
+class _ProviderError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+
+
+class _FakeProvider:
+    """模拟服务商：同时处理的请求超过concurrency时返回429"""
+
+    def __init__(self, concurrency, latency):
+        import threading
+
+        self.concurrency = concurrency
+        self.latency = latency
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, messages):
+        with self._lock:
+            if self.active >= self.concurrency:
+                self.rejected += 1
+                raise _ProviderError(429)
+            self.active += 1
+        try:
+            time.sleep(self.latency)
+            return None
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def bench_limiter(args):
+    """对比直接调用（429即退回默认数据）与按配置限流+退避重试时的成功数和吞吐量"""
+    import rate_limit
+    from llm_clients import LimitedChatModel
+
+    print(f"provider limiter  requests={args.requests} threads={args.threads} "
+          f"provider_concurrency={args.provider_concurrency} latency={args.latency * 1000:.0f}ms")
+    for label, limited in (('before (不限流)', False), ('after (限流+重试)', True)):
+        provider = _FakeProvider(args.provider_concurrency, args.latency)
+        model = provider
+        if limited:
+            model = LimitedChatModel(provider, rate_limit.ProviderLimiter(max_concurrency=args.provider_concurrency,
+                                                                          requests_per_minute=0, tokens_per_minute=0))
+
+        def call(_):
+            try:
+                model.invoke('基准测试')
+                return True
+            except Exception:
+                return False  # 引擎在这里退回默认数据
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            succeeded = sum(executor.map(call, range(args.requests)))
+        elapsed = time.perf_counter() - start
+        print(f"  {label:<18} ok {succeeded:5d}  fallback {args.requests - succeeded:5d}  "
+              f"429 {provider.rejected:5d}  {succeeded / elapsed:8.1f} ok/s")
+
+
+def make_world_rows(characters, factions=None, regions=None):
+    """在内存中构造与数据库行结构相同的势力/人物/地区元组（不写库）"""
+    factions = factions or max(5, characters // 50)
+    regions = regions or max(10, characters // 20)
+    faction_rows = [(i + 1, 1, f'势力{i}', '理念', '背景', f'势力{i}的描述' * 5, '稳定', 30 + i % 70, f'总部{i}')
+                    for i in range(factions)]
+    character_rows = [(i + 1, 1, i % factions + 1, f'人物{i}', '活跃', '沉稳果断，' * 3, '1月1日', 20 + i % 60,
+                       f'地区{i % regions}', '弟子', '练气期', 100, '[]', '[]', '经历', '目标', '')
+                      for i in range(characters)]
+    region_rows = [(i + 1, 1, f'地区{i}', '城市', None, i % factions + 1, f'地区{i}的描述' * 3)
+                   for i in range(regions)]
+    return faction_rows, character_rows, region_rows
+
+
+def _legacy_simulation_context(factions, characters, regions):
+    """旧版上下文：全部实体 json.dumps(indent=2)（仅用于基准对比）"""
+    factions_data = [{'id': f[0], 'name': f[2], 'status': f[6], 'description': f[5], 'power_level': f[7],
+                      'headquarters': f[8]} for f in factions]
+    characters_data = [{'id': c[0], 'name': c[3], 'status': c[4], 'faction_id': c[2],
+                        'faction_name': next((f[2] for f in factions if f[0] == c[2]), None),
+                        'personality': c[5], 'age': c[7], 'position': c[9], 'realm': c[10], 'location': c[8]}
+                       for c in characters]
+    regions_data = [{'id': r[0], 'name': r[2], 'type': r[3], 'description': r[4], 'faction_id': r[5]}
+                    for r in regions]
+    return f"""
+            ### 势力情况
+            {json.dumps(factions_data, ensure_ascii=False, indent=2)}
+            
+            ### 人物情况
+            {json.dumps(characters_data, ensure_ascii=False, indent=2)}
+            
+            ### 地区情况
+            {json.dumps(regions_data, ensure_ascii=False, indent=2)}
+            """
+
+
+def bench_context(args):
+    """对比不同世界规模下旧版全量上下文与按预算构建的上下文的token数和构建耗时"""
+    import prompt_context
+    from rate_limit import estimate_tokens
+
+    story_guide = '人物7与势力2的弟子在地区3争夺秘宝'
+    recent_events = [{'title': f'人物{i * 13}在地区{i}闭关', 'description': '闭关突破，引来势力1关注' * 3}
+                     for i in range(prompt_context.RECENT_EVENT_LIMIT)]
+    print(f"simulate context  budget={args.budget} tokens rounds={args.rounds}")
+    for size in [int(n) for n in args.characters.split(',')]:
+        factions, characters, regions = make_world_rows(size)
+        for label, build in (
+                ('before (indent=2全量)', lambda: (_legacy_simulation_context(factions, characters, regions), None)),
+                ('after (按预算)', lambda: prompt_context.build_simulation_context(
+                    factions, characters, regions, story_guide, recent_events, budget=args.budget))):
+            timings = []
+            for _ in range(args.rounds):
+                start = time.perf_counter()
+                context, report = build()
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            included = f"  人物 {report['included']['characters']}/{size}" if report else ''
+            print(f"  characters={size:<5} {label:<20} tokens {estimate_tokens(context):8d}  "
+                  f"median {timings[len(timings) // 2] * 1000:8.2f}ms{included}")
+
+
+def bench_retrieval(args):
+    """对比小说提示词中旧版“前8个人物/最近10条事件”与检索top-k对主题相关条目的命中数和查询耗时"""
+    import database
+    import migrations
+    import retrieval
+
+    theme = '青云门弟子前往上古剑冢寻剑'
+    conn = database.connect()
+    migrations.migrate(conn)
+    print(f"novel grounding  theme={theme} k={args.k} rounds={args.rounds}")
+    for size in [int(n) for n in args.characters.split(',')]:
+        save_id = seed_save(conn, characters=size, days=args.days)
+        rows = conn.execute('SELECT id FROM characters WHERE save_id = ? ORDER BY id', (save_id,)).fetchall()
+        # 均匀分布在存档中的相关人物，以及较早发生的相关事件
+        targets = {rows[i * size // args.k][0] for i in range(args.k)}
+        for character_id in targets:
+            conn.execute("UPDATE characters SET goals = '寻找上古剑冢' WHERE id = ?", (character_id,))
+        conn.execute('''
+            INSERT INTO world_events (save_id, day, time_period, theme, event_title, event_description)
+            VALUES (?, 1, '清晨', '异象', '上古剑冢现世', '青云门派弟子前往探查')
+        ''', (save_id,))
+        # 排在最后、名字只有两个字的主角，主题中点名时应当入选
+        protagonist = rows[-1][0]
+        conn.execute("UPDATE characters SET name = '萧炎' WHERE id = ?", (protagonist,))
+        conn.commit()
+
+        legacy = {row[0] for row in rows[:args.k]}
+        timings = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            ranked = retrieval.rank_ids(conn, save_id, theme, 'character', args.k)
+            events = retrieval.prompt_events(conn, save_id, theme)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        event_hit = any(event[3] == '上古剑冢现世' for event in events)
+        named_hit = protagonist in retrieval.rank_ids(conn, save_id, f'萧炎{theme}', 'character', args.k)
+        print(f"  characters={size:<5} before (前{args.k}个) 命中 {len(legacy & targets)}/{len(targets)}  "
+              f"after (检索) 命中 {len(set(ranked) & targets)}/{len(targets)}  "
+              f"相关事件 {'命中' if event_hit else '未命中'}  两字主角 {'命中' if named_hit else '未命中'}  "
+              f"median {timings[len(timings) // 2] * 1000:6.2f}ms")
+    conn.close()
+
+
+def _legacy_novel_summaries(conn, save_id):
+    """旧版小说概要：查询最近两部小说，解码整段JSON后截取每章前100字（仅用于基准对比）"""
+    rows = conn.execute('SELECT title, content FROM novels WHERE save_id = ? ORDER BY created_at DESC LIMIT 2',
+                        (save_id,)).fetchall()
+    text = ''
+    for title, content in rows:
+        novel_content = json.loads(content) if content else {}
+        text += f"- 《{novel_content.get('title', title)}》: "
+        text += '、'.join(f"{chapter.get('title', '')} - {chapter.get('content', '')[:100]}..."
+                         for chapter in novel_content.get('chapters', [])) + '\n'
+    return text
+
+
+def bench_memory(args):
+    """对比每次构建提示词时解码最近两部小说与读取预先维护的剧情记忆的耗时"""
+    import database
+    import migrations
+    import story_memory
+
+    conn = database.connect()
+    migrations.migrate(conn)
+    save_id = seed_save(conn, characters=10, days=1)
+    for day in range(1, args.novels + 1):
+        novel = {'title': f'第{day}部', 'chapters': [{'title': f'第{i + 1}章', 'content': '剑光如水。' * (args.chars // 5)}
+                                                    for i in range(args.chapters)]}
+        conn.execute('INSERT INTO novels (save_id, title, content, day) VALUES (?, ?, ?, ?)',
+                     (save_id, novel['title'], json.dumps(novel, ensure_ascii=False), day))
+        story_memory.record(conn, save_id, day, summary=f'第{day}天的剧情摘要。', novel=novel)
+    conn.commit()
+
+    print(f"story memory  novels={args.novels} chapters={args.chapters} chars/chapter={args.chars} "
+          f"rounds={args.rounds}")
+    for label, build in (('before (解码最近两部小说)', lambda: _legacy_novel_summaries(conn, save_id)),
+                         ('after (剧情记忆)', lambda: story_memory.prompt_memory(conn, save_id))):
+        timings = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            text = build()
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f"  {label:<22} median {timings[len(timings) // 2] * 1000:8.3f}ms  "
+              f"覆盖 {text.count('《')} 部小说  {len(text)} 字")
+    conn.close()
+
+
+class _FakeWorldModel:
+    """模拟世界生成：按提示词返回对应阶段的JSON，耗时与输出字数成正比（模拟逐token生成）"""
+
+    model_name = 'fake-world'
+    temperature = 0.7
+
+    def __init__(self, factions, characters_per_faction, seconds_per_char):
+        self.factions = factions
+        self.characters_per_faction = characters_per_faction
+        self.seconds_per_char = seconds_per_char
+
+    def _faction(self, i):
+        return {'name': f'势力{i}', 'ideal': '理想' * 10, 'background': '背景' * 30, 'description': '描述' * 30,
+                'power_level': 50, 'headquarters_location': f'总部{i}'}
+
+    def _character(self, faction, j):
+        return {'name': f'{faction}人物{j}', 'faction': faction, 'personality': '性格' * 10, 'age': 30,
+                'position': '长老', 'realm': '金丹', 'goals': '目标' * 15, 'experience': '经历' * 40}
+
+    def _region(self, i, detailed):
+        region = {'name': f'地区{i}', 'type': '州'}
+        if detailed:
+            region['description'] = '地区描述' * 20
+        return region
+
+    def invoke(self, messages):
+        from types import SimpleNamespace
+
+        text = messages[-1].content
+        head = {'enhanced_background': '背景' * 200, 'world_introduction': '介绍' * 200,
+                'cultivation_system': '体系' * 100}
+        if text == '__legacy__':
+            # 旧版：一次输出背景、地区、势力和全部人物
+            data = dict(head, regions=[self._region(i, True) for i in range(self.factions)],
+                        factions=[self._faction(i) for i in range(self.factions)],
+                        characters=[self._character(f'势力{i}', j) for i in range(self.factions)
+                                    for j in range(self.characters_per_faction)])
+        elif '请为势力“' in text:
+            faction = text.split('请为势力“')[1].split('”')[0]
+            data = {'characters': [self._character(faction, j) for j in range(self.characters_per_faction)]}
+        elif '补充详细描述' in text:
+            data = {'regions': [self._region(i, True) for i in range(self.factions)]}
+        else:
+            data = dict(head, regions=[self._region(i, False) for i in range(self.factions)],
+                        factions=[self._faction(i) for i in range(self.factions)])
+        content = json.dumps(data, ensure_ascii=False)
+        time.sleep(len(content) * self.seconds_per_char)
+        return SimpleNamespace(content=content)
+
+
+def bench_world(args):
+    """对比一次调用生成完整世界与分阶段并发生成的总耗时"""
+    from types import SimpleNamespace
+    from ai_engine import AIEngine
+
+    model = _FakeWorldModel(args.factions, args.characters, args.seconds_per_char)
+    engine = AIEngine()
+    engine.llm = model
+
+    print(f"generate complete world  factions={args.factions} characters/faction={args.characters} "
+          f"{args.seconds_per_char * 1000:.1f}ms/char")
+    start = time.perf_counter()
+    world = json.loads(model.invoke([SimpleNamespace(content='__legacy__')]).content)
+    legacy_seconds = time.perf_counter() - start
+    print(f"  before (一次调用)   total {legacy_seconds:7.2f}s  人物 {len(world['characters'])}")
+
+    world = engine.generate_complete_world('基准测试世界', use_cache=False)
+    timings = world['timings']
+    slowest = max([t for t in timings['characters'] if t is not None] + [timings['regions'] or 0])
+    print(f"  after (分阶段并发)  total {timings['total']:7.2f}s  人物 {len(world['characters'])}  "
+          f"outline {timings['outline']:.2f}s + 最慢分支 {slowest:.2f}s（依次执行需 {timings['sequential']:.2f}s）")
+
+
+def bench_chat(args):
+    """对比浏览器每次发回全部历史与服务端按预算组装上下文时，一次聊天请求的请求体和提示词大小"""
+    import database
+    import migrations
+    import chat_context
+    from rate_limit import estimate_tokens
+
+    conn = database.connect()
+    migrations.migrate(conn)
+    chat_id = conn.execute("INSERT INTO chats (title, system_prompt, context_count, created_at) "
+                           "VALUES ('基准测试', '你是一个助手', -1, '')").lastrowid
+    conn.commit()
+
+    reply = '这是一段回复内容，' * (args.chars // 9)
+    history = []
+    build_timings = []
+    for turn in range(args.turns):
+        message = f'第{turn + 1}个问题：' + '请继续讲述。' * (args.chars // 12)
+        start = time.perf_counter()
+        messages, state = chat_context.build_messages(conn, chat_id, message)
+        build_timings.append(time.perf_counter() - start)
+        chat_context.save_turn(conn, chat_id, message, reply, state)
+        conn.commit()
+        history += [{'role': 'user', 'content': message}, {'role': 'assistant', 'content': reply}]
+    conn.close()
+
+    # 最后一轮的请求：旧版请求体带上之前的全部消息，新版只有对话ID和本轮消息
+    legacy_body = json.dumps({'chat_id': chat_id, 'message': message, 'model_id': 1, 'system_prompt': '你是一个助手',
+                              'context_messages': history[:-2]}, ensure_ascii=False)
+    body = json.dumps({'chat_id': chat_id, 'message': message, 'model_id': 1, 'system_prompt': '你是一个助手',
+                       'context_count': -1}, ensure_ascii=False)
+    legacy_tokens = sum(estimate_tokens(m['content']) for m in history[:-1])
+    tokens = sum(estimate_tokens(m['content']) for m in messages)
+    build_timings.sort()
+
+    print(f"chat context  turns={args.turns} chars/message={args.chars} budget={chat_context.CONTEXT_TOKENS}")
+    print(f"  before (发回全部历史)  请求体 {len(legacy_body.encode()) / 1024:9.1f}KB  提示词 {legacy_tokens:7d} tokens  "
+          f"{len(history) - 1} 条消息")
+    print(f"  after (服务端组装)     请求体 {len(body.encode()) / 1024:9.1f}KB  提示词 {tokens:7d} tokens  "
+          f"{len(messages)} 条消息（最近 {state['history_messages']} 条 + 摘要）  "
+          f"组装 median {build_timings[len(build_timings) // 2] * 1000:.3f}ms")
+
+
+def bench_resume(args):
+    """客户端在回复中途断线重连：对比旧版重新提问（整段重新生成）与带 Last-Event-ID 续传的生成量和耗时"""
+    import reply_streams
+
+    generated = []
+
+    def produce(stream):
+        for i in range(args.chunks):
+            time.sleep(args.latency)
+            generated.append(1)
+            stream.append(f'片段{i}')
+
+    drop_at = int(args.chunks * args.drop_at)
+    print(f"reply resume  chunks={args.chunks} drop at {drop_at} latency={args.latency * 1000:.1f}ms/chunk")
+
+    # 旧版：断线后已生成的部分丢失，重新请求整段生成
+    start = time.perf_counter()
+    legacy_chunks = drop_at + args.chunks
+    time.sleep(legacy_chunks * args.latency)
+    print(f"  before (重新提问)  生成 {legacy_chunks:5d} 段  total {time.perf_counter() - start:6.2f}s")
+
+    registry = reply_streams.StreamRegistry(workers=1, max_pending=1)
+    start = time.perf_counter()
+    stream = registry.start(produce)
+    last_event_id = 0
+    received = 0
+    for chunk in reply_streams.events(stream, heartbeat=args.latency * 10):
+        if chunk.startswith('id: '):
+            last_event_id = int(chunk.split('\n', 1)[0][4:])
+            received += '"delta"' in chunk
+        if received >= drop_at:
+            break
+    # 断线后重新连接，从最后收到的事件之后继续
+    resumed = registry.get(stream.id, resumed=True)
+    for chunk in reply_streams.events(resumed, last_event_id, heartbeat=args.latency * 10):
+        received += '"delta"' in chunk
+    registry.shutdown()
+    print(f"  after (续传)       生成 {len(generated):5d} 段  total {time.perf_counter() - start:6.2f}s  "
+          f"客户端收到 {received} 段")
+
+
+def _fake_llm_app(chunks, interval, chunk_size=5):
+    """本地模拟的OpenAI兼容流式接口（见 stub_llm.py）：聊天回复约chunks块，每隔interval秒输出一块"""
+    import stub_llm
+
+    # 回复基本是汉字，每字约一个token
+    return stub_llm.create_app(stub_llm.StubSettings(latency=0, chunk_size=chunk_size, chat_chars=chunks * chunk_size,
+                                                     token_rate=chunk_size / interval if interval else 0))
+
+
+def _start_uvicorn_thread(asgi_app, port):
+    """在后台线程中运行uvicorn，返回server（设置 server.should_exit = True 停止）"""
+    import threading
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host='127.0.0.1', port=port, log_level='warning',
+                                           backlog=4096))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def _free_port():
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _process_stats(pid):
+    """(CPU秒数, 线程数, 常驻内存MB)，读取 /proc，非Linux返回None"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None
+    return ((int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK'), int(status['Threads']),
+            int(status['VmRSS'].split()[0]) / 1024)
+
+
+async def _run_streams(base_url, streams, on_tick=None):
+    """并发打开streams个聊天流并读到结束事件，返回 (完成数, 首块延迟列表, 耗时)"""
+    import asyncio
+    import httpx
+
+    first_chunk = []
+
+    async def one(client):
+        start = time.perf_counter()
+        try:
+            async with client.stream('POST', '/api/chat-stream', json={'message': '讲个故事', 'model_id': 1}) as response:
+                if response.status_code != 200:
+                    return False
+                waiting = True
+                async for line in response.aiter_lines():
+                    if waiting and '"delta"' in line:
+                        first_chunk.append(time.perf_counter() - start)
+                        waiting = False
+                    if '"done"' in line:
+                        return True
+                    if '"error"' in line:
+                        return False
+        except httpx.HTTPError:
+            pass
+        return False
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=httpx.Timeout(300, connect=60)) as client:
+        start = time.perf_counter()
+        tasks = [asyncio.ensure_future(one(client)) for _ in range(streams)]
+        while not all(task.done() for task in tasks):
+            if on_tick:
+                on_tick()
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - start
+    return sum(task.result() for task in tasks), first_chunk, elapsed
+
+
+def _wait_until_ready(url, timeout=30):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f'服务未能在{timeout}秒内启动: {url}')
+
+
+def bench_asgi(args):
+    """本地模拟LLM服务，分别用Flask多线程服务器和ASGI服务器承载大量并发聊天流：
+    对比完成数、首块延迟和服务进程的CPU/线程/内存，按CPU占用折算每个核心能承载的并发流数"""
+    import asyncio
+    import subprocess
+    import database
+    import migrations
+
+    streams_list = [int(n) for n in args.streams.split(',')]
+    llm_port = _free_port()
+    llm_server = _start_uvicorn_thread(_fake_llm_app(args.chunks, args.interval), llm_port)
+
+    conn = database.connect()
+    migrations.migrate(conn)
+    # 指向模拟服务且不限流，测量的是服务本身的承载能力
+    conn.execute('UPDATE ai_configs SET is_active = 0')
+    conn.execute('''
+        INSERT OR REPLACE INTO ai_configs (id, name, api_key, base_url, model, temperature, max_tokens, is_active,
+                                           max_concurrency, requests_per_minute, tokens_per_minute)
+        VALUES (1, 'bench', 'bench', ?, 'bench-model', 0.7, 2000, 1, 0, 0, 0)
+    ''', (f'http://127.0.0.1:{llm_port}/v1',))
+    conn.commit()
+    conn.close()
+
+    servers = {
+        'flask': ('before (Flask threaded)', [sys.executable, '-c',
+                  'import sys; from app import app, init_db; init_db(); '
+                  'app.run(host="127.0.0.1", port=int(sys.argv[1]), threaded=True)']),
+        'asgi': ('after (ASGI)', [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1',
+                 '--log-level', 'warning', '--backlog', '4096', '--port']),
+    }
+    most = max(streams_list)
+    env = dict(os.environ, AI_STREAM_WORKERS=str(most), AI_STREAM_MAX_PENDING=str(most),
+               AI_ASYNC_STREAM_MAX_PENDING=str(most))
+    generation = args.chunks * args.interval
+    print(f"concurrent chat streams  chunks={args.chunks} interval={args.interval * 1000:.0f}ms "
+          f"(每个回复约{generation:.1f}s)  cpu_count={os.cpu_count()}")
+
+    try:
+        for name in args.servers.split(','):
+            label, command = servers[name]
+            port = _free_port()
+            process = subprocess.Popen(command + [str(port)], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                _wait_until_ready(f'http://127.0.0.1:{port}/api/system/llm-stats')
+                for streams in streams_list:
+                    peak = {'threads': 0, 'rss': 0.0}
+
+                    def sample():
+                        stats = _process_stats(process.pid)
+                        if stats:
+                            peak['threads'] = max(peak['threads'], stats[1])
+                            peak['rss'] = max(peak['rss'], stats[2])
+
+                    before = _process_stats(process.pid)
+                    completed, first_chunk, elapsed = asyncio.run(
+                        _run_streams(f'http://127.0.0.1:{port}', streams, sample))
+                    after = _process_stats(process.pid)
+                    first_chunk.sort()
+                    p50 = first_chunk[len(first_chunk) // 2] * 1000 if first_chunk else float('nan')
+                    p99 = first_chunk[int(len(first_chunk) * 0.99)] * 1000 if first_chunk else float('nan')
+                    line = (f"  {label:<24} streams={streams:5d}  完成 {completed:5d}  "
+                            f"首块 p50 {p50:7.1f}ms p99 {p99:7.1f}ms  total {elapsed:6.2f}s")
+                    if before and after:
+                        # 平均同时进行的流数 / 平均占用的核心数
+                        cpu = after[0] - before[0]
+                        concurrent = completed * generation / elapsed
+                        per_core = concurrent / (cpu / elapsed) if cpu else float('inf')
+                        line += (f"  CPU {cpu:5.2f}s  线程峰值 {peak['threads']:5d}  内存峰值 {peak['rss']:6.1f}MB  "
+                                 f"每核心并发流 {per_core:6.0f}")
+                    print(line)
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        llm_server.should_exit = True
+
+
+def _hammer(port, paths, duration, concurrency):
+    """concurrency个长连接轮流请求paths，持续duration秒，返回 {路径: [耗时...]} 和错误数"""
+    import http.client
+    import threading
+
+    latencies = {path: [] for path in paths}
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = {path: [] for path in paths}
+        failed = 0
+        i = offset
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            local[path].append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            for path, values in local.items():
+                latencies[path].extend(values)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def bench_serve(args):
+    """对比原来的开发服务器（app.run(debug=True)）与 serve.py 生产启动方式下主要读接口的吞吐量"""
+    import subprocess
+    import database
+    import migrations
+
+    # 使用单独的临时数据库，不受 GAME_DB_PATH 影响
+    db_path = os.path.join(tempfile.mkdtemp(prefix='ai_sandbox_serve_'), 'bench.db')
+    database.configure(db_path=db_path)
+    conn = database.connect()
+    migrations.migrate(conn)
+    save_id = seed_save(conn, factions=10, characters=100, days=30)
+    template_id = seed_template(conn, factions=10, characters=200, regions=40)
+    chat_id = conn.execute("INSERT INTO chats (title, system_prompt, context_count, created_at) "
+                           "VALUES ('基准测试', '你是一个助手', 1, '')").lastrowid
+    conn.executemany('INSERT INTO chat_messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, ?)',
+                     [(chat_id, 'user' if i % 2 == 0 else 'assistant', '消息内容' * 50, '') for i in range(40)])
+    conn.commit()
+    conn.close()
+    database.shutdown()
+
+    paths = [
+        '/api/saves',
+        f'/api/saves/{save_id}/load',
+        f'/api/saves/{save_id}/load?include=save,factions,characters',
+        f'/api/saves/{save_id}/timeline',
+        '/api/templates',
+        f'/api/templates/{template_id}',
+        '/api/chats',
+        f'/api/chats/{chat_id}/messages',
+    ]
+    servers = {
+        'dev': ('before (app.run debug)', [sys.executable, '-c',
+                'import sys; from app import app, init_db; init_db(); '
+                'app.run(debug=True, host="127.0.0.1", port=int(sys.argv[1]), threaded=True, use_reloader=False)']),
+        'serve': (f'after (serve.py workers={args.workers} threads={args.threads})',
+                  [sys.executable, 'serve.py', '--host', '127.0.0.1', '--workers', str(args.workers),
+                   '--threads', str(args.threads), '--log-level', 'warning', '--port']),
+    }
+    env = dict(os.environ, GAME_DB_PATH=db_path)
+    print(f"read endpoints  concurrency={args.concurrency} duration={args.duration}s cpu_count={os.cpu_count()}")
+
+    results = []
+    for name in args.servers.split(','):
+        label, command = servers[name]
+        port = _free_port()
+        process = subprocess.Popen(command + [str(port)], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_until_ready(f'http://127.0.0.1:{port}/api/saves')
+            _hammer(port, paths, 1, args.concurrency)  # 预热
+            latencies, errors = _hammer(port, paths, args.duration, args.concurrency)
+        finally:
+            process.terminate()
+            process.wait()
+        results.append((label, latencies, errors))
+
+    for label, latencies, errors in results:
+        total = sum(len(values) for values in latencies.values())
+        print(f"  {label:<40} {total / args.duration:9.1f} req/s  errors {errors}")
+        for path, values in latencies.items():
+            values.sort()
+            if not values:
+                print(f"    {path:<60} 无成功请求")
+                continue
+            print(f"    {path:<60} {len(values) / args.duration:8.1f} req/s  "
+                  f"p50 {values[len(values) // 2] * 1000:7.2f}ms  p99 {values[int(len(values) * 0.99)] * 1000:7.2f}ms")
+
+
+_DEFAULT_GENERATORS = ['_generate_default_world', '_generate_default_factions', '_generate_default_characters',
+                       '_generate_default_events', '_generate_default_story_and_novel']
+
+
+def _sse_events(body):
+    return [json.loads(line[6:]) for line in body.split('\n') if line.startswith('data: ')]
+
+
+def _soak_round(client, model_id, index):
+    """一轮完整流程：生成世界 -> 创建存档 -> 模拟 -> 故事推进+小说 -> 聊天，返回 {步骤: (耗时, 是否成功)}"""
+    timings = {}
+
+    def step(name, func):
+        start = time.perf_counter()
+        try:
+            ok = func()
+        except Exception as e:
+            print(f"    {name} 出错: {e}")
+            ok = False
+        timings[name] = (time.perf_counter() - start, bool(ok))
+        return ok
+
+    world = {}
+
+    def generate_world():
+        response = client.post('/api/ai/generate-all', json={'background': f'压力测试世界{index}', 'reroll': True})
+        result = response.get_json() or {}
+        if response.status_code == 200 and result.get('characters'):
+            world.update(result)
+            return True
+        return False
+
+    def create_save():
+        response = client.post('/api/saves/world', json={**world, 'name': f'压力测试{index}',
+                                                         'world_background': world.get('enhanced_background', '')})
+        world['save_id'] = (response.get_json() or {}).get('save_id')
+        return world['save_id']
+
+    def simulate():
+        response = client.post(f"/api/saves/{world['save_id']}/simulate",
+                               json={'days': 2, 'story_guide': '秘境开启', 'model_config_id': model_id})
+        return response.status_code == 200
+
+    def story_novel():
+        response = client.post(f"/api/saves/{world['save_id']}/generate-story-novel",
+                               json={'story_guide': '秘境开启', 'model_config_id': model_id})
+        return any(event.get('type') == 'saved' or event.get('type') == 'complete'
+                   for event in _sse_events(response.get_data(as_text=True)))
+
+    def chat():
+        chat_id = client.post('/api/chats', json={'title': '压力测试', 'context_count': 2}).get_json()['chat_id']
+        response = client.post('/api/chat-stream', json={'chat_id': chat_id, 'message': '讲讲这个世界',
+                                                          'model_id': model_id})
+        return [event['type'] for event in _sse_events(response.get_data(as_text=True))][-1:] == ['done']
+
+    # 世界生成失败时用空世界创建存档，继续后面的步骤
+    step('generate-all', generate_world)
+    if step('saves/world', create_save):
+        step('simulate', simulate)
+        step('generate-story-novel', story_novel)
+    step('chat-stream', chat)
+    return timings
+
+
+def bench_soak(args):
+    """不连接真实服务商，按完整流程反复调用接口：
+    对比服务商不可用（原来能离线运行的唯一方式）与本地模拟模型下，结果中回退到默认数据的次数和各步骤耗时"""
+    import database
+    import migrations
+    import app as flask_module
+
+    conn = database.connect()
+    migrations.migrate(conn)
+    conn.commit()
+    conn.close()
+    flask_module.init_db()
+    engine = flask_module.ai_engine
+
+    # 统计回退到默认数据的次数
+    fallbacks = {}
+    for name in _DEFAULT_GENERATORS:
+        original = getattr(engine, name)
+
+        def counted(*a, _name=name, _original=original, **kw):
+            fallbacks[_name] = fallbacks.get(_name, 0) + 1
+            return _original(*a, **kw)
+
+        setattr(engine, name, counted)
+
+    stub_params = f'latency={args.latency}&token_rate={args.token_rate}&chunk_size={args.chunk_size}' \
+                  f'&error_rate={args.error_rate}&seed={args.seed}'
+    providers = {
+        'down': ('before (服务商不可用)', f'http://127.0.0.1:{_free_port()}/v1'),
+        'stub': (f'after (stub://local?{stub_params})', f'stub://local?{stub_params}'),
+    }
+    client = flask_module.app.test_client()
+    print(f"soak  rounds={args.rounds} threads={args.threads}")
+    for name in args.providers.split(','):
+        label, base_url = providers[name]
+        conn = database.connect()
+        conn.execute('UPDATE ai_configs SET is_active = 0')
+        conn.execute('''
+            INSERT OR REPLACE INTO ai_configs (id, name, api_key, base_url, model, temperature, max_tokens, is_active,
+                                               max_concurrency, requests_per_minute, tokens_per_minute)
+            VALUES (1, 'bench', 'bench', ?, 'bench-model', 0.7, 2000, 1, 0, 0, 0)
+        ''', (base_url,))
+        conn.commit()
+        conn.close()
+        engine.clients.invalidate()
+        engine.reload_config()
+        fallbacks.clear()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            rounds = list(executor.map(lambda i: _soak_round(client, 1, i), range(args.rounds)))
+        elapsed = time.perf_counter() - start
+
+        print(f"  {label}  total {elapsed:.2f}s  回退到默认数据 {sum(fallbacks.values())} 次 "
+              f"{json.dumps(fallbacks, ensure_ascii=False) if fallbacks else ''}")
+        for step in ['generate-all', 'saves/world', 'simulate', 'generate-story-novel', 'chat-stream']:
+            values = sorted(r[step][0] for r in rounds if step in r)
+            if not values:
+                continue
+            ok = sum(1 for r in rounds if step in r and r[step][1])
+            print(f"    {step:<22} ok {ok:3d}/{len(values):<3d}  p50 {values[len(values) // 2] * 1000:8.1f}ms  "
+                  f"max {values[-1] * 1000:8.1f}ms")
+    flask_module.shutdown_services()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI沙盒游戏性能基准测试')
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+
+    load_parser = subparsers.add_parser('load', help='存档加载接口吞吐量')
+    load_parser.add_argument('--requests', type=int, default=500)
+    load_parser.add_argument('--threads', type=int, default=4)
+    load_parser.add_argument('--days', type=int, default=30)
+    load_parser.set_defaults(func=bench_load)
+
+    sections_parser = subparsers.add_parser('sections', help='完整加载与分段加载对比')
+    sections_parser.add_argument('--days', type=int, default=365)
+    sections_parser.add_argument('--include', default='save,factions,characters,generation_logs')
+    sections_parser.add_argument('--rounds', type=int, default=10)
+    sections_parser.set_defaults(func=bench_sections)
+
+    plans_parser = subparsers.add_parser('plans', help='检查热点查询执行计划')
+    plans_parser.add_argument('--verbose', action='store_true', help='打印所有执行计划')
+    plans_parser.set_defaults(func=bench_plans)
+
+    apply_parser = subparsers.add_parser('apply', help='模拟结果批量写入耗时')
+    apply_parser.add_argument('--events', type=int, default=500)
+    apply_parser.add_argument('--rounds', type=int, default=20)
+    apply_parser.set_defaults(func=bench_apply)
+
+    template_parser = subparsers.add_parser('template', help='从模版创建存档耗时')
+    template_parser.add_argument('--characters', type=int, default=5000)
+    template_parser.add_argument('--factions', type=int, default=50)
+    template_parser.add_argument('--regions', type=int, default=200)
+    template_parser.add_argument('--rounds', type=int, default=5)
+    template_parser.set_defaults(func=bench_template)
+
+    stream_parser = subparsers.add_parser('stream', help='流式小说响应解析耗时')
+    stream_parser.add_argument('--chars', type=int, default=10000,
+                               help='小说字数；旧版逐块重扫10k字符约需3秒，50k字符约需90秒')
+    stream_parser.add_argument('--chapters', type=int, default=1)
+    stream_parser.add_argument('--chunk-size', type=int, default=8, help='每块字符数（近似每个token的长度）')
+    stream_parser.add_argument('--rounds', type=int, default=3)
+    stream_parser.set_defaults(func=bench_stream)
+
+    limiter_parser = subparsers.add_parser('limiter', help='服务商并发上限下的LLM调用成功率')
+    limiter_parser.add_argument('--requests', type=int, default=200)
+    limiter_parser.add_argument('--threads', type=int, default=16)
+    limiter_parser.add_argument('--provider-concurrency', type=int, default=4)
+    limiter_parser.add_argument('--latency', type=float, default=0.05, help='单次调用耗时（秒）')
+    limiter_parser.set_defaults(func=bench_limiter)
+
+    context_parser = subparsers.add_parser('context', help='模拟天数提示词上下文的token数与构建耗时')
+    context_parser.add_argument('--characters', default='50,500,5000', help='逗号分隔的世界人物数')
+    context_parser.add_argument('--budget', type=int, default=12000)
+    context_parser.add_argument('--rounds', type=int, default=5)
+    context_parser.set_defaults(func=bench_context)
+
+    retrieval_parser = subparsers.add_parser('retrieval', help='小说提示词中相关人物/事件的检索命中率')
+    retrieval_parser.add_argument('--characters', default='50,500,5000', help='逗号分隔的世界人物数')
+    retrieval_parser.add_argument('--days', type=int, default=30)
+    retrieval_parser.add_argument('--k', type=int, default=8)
+    retrieval_parser.add_argument('--rounds', type=int, default=20)
+    retrieval_parser.set_defaults(func=bench_retrieval)
+
+    memory_parser = subparsers.add_parser('memory', help='提示词中剧情回顾的构建耗时')
+    memory_parser.add_argument('--novels', type=int, default=30)
+    memory_parser.add_argument('--chapters', type=int, default=3)
+    memory_parser.add_argument('--chars', type=int, default=20000, help='每章字数')
+    memory_parser.add_argument('--rounds', type=int, default=20)
+    memory_parser.set_defaults(func=bench_memory)
+
+    world_parser = subparsers.add_parser('world', help='一次生成与分阶段并发生成完整世界的耗时')
+    world_parser.add_argument('--factions', type=int, default=6)
+    world_parser.add_argument('--characters', type=int, default=3, help='每个势力的人物数')
+    world_parser.add_argument('--seconds-per-char', type=float, default=0.0002,
+                              help='每输出一个字符的耗时（真实模型约0.03秒，默认按150倍加速）')
+    world_parser.set_defaults(func=bench_world)
+
+    chat_parser = subparsers.add_parser('chat', help='长对话中一次聊天请求的请求体与提示词大小')
+    chat_parser.add_argument('--turns', type=int, default=200)
+    chat_parser.add_argument('--chars', type=int, default=300, help='每条消息字数')
+    chat_parser.set_defaults(func=bench_chat)
+
+    resume_parser = subparsers.add_parser('resume', help='聊天回复中途断线重连的生成量')
+    resume_parser.add_argument('--chunks', type=int, default=400)
+    resume_parser.add_argument('--drop-at', type=float, default=0.5, help='在回复的哪个位置断线（0~1）')
+    resume_parser.add_argument('--latency', type=float, default=0.005, help='每段输出的耗时（秒）')
+    resume_parser.set_defaults(func=bench_resume)
+
+    asgi_parser = subparsers.add_parser('asgi', help='Flask多线程与ASGI服务下的并发聊天流承载能力')
+    asgi_parser.add_argument('--streams', default='200,1000', help='逗号分隔的并发流数')
+    asgi_parser.add_argument('--chunks', type=int, default=50, help='每个回复的块数')
+    asgi_parser.add_argument('--interval', type=float, default=0.1, help='模拟LLM输出每块的间隔（秒）')
+    asgi_parser.add_argument('--servers', default='flask,asgi')
+    asgi_parser.set_defaults(func=bench_asgi)
+
+    serve_parser = subparsers.add_parser('serve', help='开发服务器与 serve.py 启动方式下主要读接口的吞吐量')
+    serve_parser.add_argument('--duration', type=float, default=10, help='每个服务的压测时长（秒）')
+    serve_parser.add_argument('--concurrency', type=int, default=16, help='并发连接数')
+    serve_parser.add_argument('--workers', type=int, default=1)
+    serve_parser.add_argument('--threads', type=int, default=32)
+    serve_parser.add_argument('--servers', default='dev,serve')
+    serve_parser.set_defaults(func=bench_serve)
+
+    soak_parser = subparsers.add_parser('soak', help='服务商不可用与本地模拟模型下完整流程的回退次数和耗时')
+    soak_parser.add_argument('--rounds', type=int, default=20)
+    soak_parser.add_argument('--threads', type=int, default=4)
+    soak_parser.add_argument('--providers', default='down,stub')
+    soak_parser.add_argument('--latency', type=float, default=0.05, help='模拟模型的首字延迟（秒）')
+    soak_parser.add_argument('--token-rate', type=float, default=0, help='模拟模型每秒输出的token数，0为不限')
+    soak_parser.add_argument('--chunk-size', type=int, default=16)
+    soak_parser.add_argument('--error-rate', type=float, default=0.05, help='模拟模型返回错误的比例')
+    soak_parser.add_argument('--seed', type=int, default=0)
+    soak_parser.set_defaults(func=bench_soak)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
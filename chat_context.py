@@ -0,0 +1,141 @@
+"""
+服务端聊天上下文
+
+原来 /api/chat-stream 由浏览器每次把 context_messages 整段发回来，对话越长请求体和提示词越大，
+而这些历史早已存在 chat_messages 表中。现在服务端自己组装上下文：
+- 最近的若干轮对话按token预算放入（不超过本次请求的 context_count 轮，-1表示不限轮数）
+- 每个对话最多保留最近 HISTORY_ROUNDS 轮原文可供放入，更早的对话折叠进 chats.summary，
+  每轮一行“用户：…… / AI：……”的摘录，超出长度时丢弃最早的行；chats.summary_through 记录已折叠到的消息ID，
+  之后只读取比它新的消息，每次请求的读取量有上限。折叠与否和单次请求的轮数、预算无关，
+  之后调大 context_count 仍能放入原文
+- 请求的轮数中因预算放不下的部分只在本次提示词中以摘录代替，不写回；请求的历史都能放入时不带摘要
+- 用户消息和AI回复在流式输出结束后由服务端写入，浏览器不再单独保存
+
+环境变量：
+    AI_CHAT_CONTEXT_TOKENS=4000    历史对话（含摘要）的token预算
+    AI_CHAT_SUMMARY_CHARS=2000     早期对话摘要的最大字数
+    AI_CHAT_HISTORY_ROUNDS=50      保留原文的最近轮数，更早的折叠进摘要
+"""
+
+import os
+from datetime import datetime
+
+from rate_limit import estimate_tokens
+
+CONTEXT_TOKENS = int(os.environ.get('AI_CHAT_CONTEXT_TOKENS', '4000'))
+SUMMARY_CHARS = int(os.environ.get('AI_CHAT_SUMMARY_CHARS', '2000'))
+HISTORY_ROUNDS = int(os.environ.get('AI_CHAT_HISTORY_ROUNDS', '50'))
+
+# 摘要中每条消息保留的字数
+EXCERPT_CHARS = 80
+_ROLE_NAMES = {'user': '用户', 'assistant': 'AI'}
+
+
+def _excerpt(content: str) -> str:
+    content = ' '.join((content or '').split())
+    return content[:EXCERPT_CHARS] + '...' if len(content) > EXCERPT_CHARS else content
+
+
+def fold_summary(summary: str, messages) -> str:
+    """把较早的消息折叠进摘要：每条一行，超出长度时丢弃最早的行"""
+    lines = [line for line in (summary or '').split('\n') if line]
+    lines.extend(f"{_ROLE_NAMES.get(role, role)}：{_excerpt(content)}" for _, role, content in messages)
+    while len(lines) > 1 and sum(len(line) + 1 for line in lines) > SUMMARY_CHARS:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+def build_messages(conn, chat_id: int, message: str, system_prompt: str = None, context_count: int = None,
+                   budget: int = None):
+    """从数据库组装本次请求的消息列表
+
+    Args:
+        system_prompt: 为None时使用对话保存的系统提示词
+        context_count: 带上的历史轮数，为None时使用对话保存的设置
+        budget: 历史对话（含摘要）的token预算，None使用 CONTEXT_TOKENS；摘要不超过 SUMMARY_CHARS 字
+
+    Returns:
+        (messages, state)：messages 为发给模型的消息列表；state 记录需要写回的摘要，交给 save_turn()。
+        对话不存在时返回 (None, None)
+    """
+    budget = CONTEXT_TOKENS if budget is None else budget
+    chat = conn.execute('SELECT system_prompt, context_count, summary, summary_through FROM chats WHERE id = ?',
+                        (chat_id,)).fetchone()
+    if chat is None:
+        return None, None
+    saved_prompt, saved_count, summary, summary_through = chat
+    if system_prompt is None:
+        system_prompt = saved_prompt or ''
+    if context_count is None:
+        context_count = saved_count
+    context_count = 1 if context_count is None else int(context_count)
+    summary_through = summary_through or 0
+
+    # 只读取尚未折叠进摘要的消息；不带上下文时不需要读取历史
+    rows = []
+    if context_count != 0:
+        rows = conn.execute('''
+            SELECT id, role, content FROM chat_messages WHERE chat_id = ? AND id > ? ORDER BY id
+        ''', (chat_id, summary_through)).fetchall()
+
+    # 超出保留轮数的消息折叠进摘要并写回，与本次请求的轮数和预算无关
+    kept = rows[-HISTORY_ROUNDS * 2:] if HISTORY_ROUNDS > 0 else []
+    dropped = rows[:len(rows) - len(kept)]
+    if dropped:
+        summary = fold_summary(summary, dropped)
+        summary_through = dropped[-1][0]
+
+    # 本次请求的历史：最近 context_count 轮，请求的轮数超出保留的原文时，摘要也在请求范围内
+    requested = kept if context_count < 0 else kept[-context_count * 2:]
+    wants_summary = bool(summary) and (context_count < 0 or context_count * 2 > len(kept))
+    window = []
+    used = 0
+    available = budget - (estimate_tokens(summary) if wants_summary else 0)
+    for row in reversed(requested):
+        cost = estimate_tokens(row[2]) + 4
+        if used + cost > available:
+            break
+        used += cost
+        window.append(row)
+    window.reverse()
+
+    # 请求范围内因预算放不下的消息只在本次提示词中以摘录代替，摘录也计入预算
+    prompt_summary = summary if wants_summary else ''
+    excerpted = requested[:len(requested) - len(window)]
+    if excerpted:
+        prompt_summary = fold_summary(prompt_summary, excerpted)
+        while window and used + estimate_tokens(prompt_summary) > budget:
+            used -= estimate_tokens(window[0][2]) + 4
+            excerpted.append(window.pop(0))
+            prompt_summary = fold_summary(summary if wants_summary else '', excerpted)
+
+    messages = []
+    if system_prompt:
+        messages.append({'role': 'system', 'content': system_prompt})
+    if prompt_summary:
+        messages.append({'role': 'system', 'content': f'之前的对话摘要：\n{prompt_summary}'})
+    messages.extend({'role': role, 'content': content} for _, role, content in window)
+    messages.append({'role': 'user', 'content': message})
+
+    state = {
+        'summary': summary,
+        'summary_through': summary_through,
+        'changed': bool(dropped),
+        'history_messages': len(window),
+        'excerpted_messages': len(excerpted),
+        'summarized_messages': len(dropped)
+    }
+    return messages, state
+
+
+def save_turn(conn, chat_id: int, message: str, reply: str, state: dict = None):
+    """写入一轮对话（用户消息和AI回复），并写回折叠后的摘要；调用方提交事务"""
+    now = datetime.now().isoformat()
+    rows = [(chat_id, 'user', message, now)]
+    if reply:
+        rows.append((chat_id, 'assistant', reply, datetime.now().isoformat()))
+    conn.executemany('INSERT INTO chat_messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, ?)', rows)
+    if state and state.get('changed'):
+        # 同一对话的并发请求可能先后写回，只保留折叠得更靠后的摘要
+        conn.execute('UPDATE chats SET summary = ?, summary_through = ? WHERE id = ? AND summary_through < ?',
+                     (state['summary'], state['summary_through'], chat_id, state['summary_through']))
@@ -0,0 +1,297 @@
+import os
+import time
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+# 数据库文件路径，可通过环境变量覆盖（基准测试/多实例部署时使用）
+DB_PATH = os.environ.get('GAME_DB_PATH', 'game.db')
+
+# 连接池中最多保留的空闲连接数，设为0则每次都新建连接（等同于旧行为）
+POOL_SIZE = int(os.environ.get('GAME_DB_POOL_SIZE', '8'))
+
+# 每个新连接统一执行的PRAGMA
+# WAL模式下读写互不阻塞；synchronous=NORMAL在WAL下仍能保证数据库不损坏
+CONNECTION_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',  # 约16MB页缓存
+    'PRAGMA mmap_size = 268435456',  # 256MB内存映射
+    'PRAGMA temp_store = MEMORY',
+]
+
+
+def _open_connection(db_path: str) -> sqlite3.Connection:
+    """创建一个已应用统一PRAGMA的连接"""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class PooledConnection:
+    """连接池中借出的连接
+
+    接口与sqlite3.Connection一致，close()会把连接归还到连接池而不是真正关闭，
+    因此可以直接替换原来的 sqlite3.connect('game.db')。
+    作为上下文管理器使用时，正常退出自动提交，异常退出自动回滚，最后归还连接。
+    """
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+
+    def __getattr__(self, name):
+        conn = self._conn
+        if conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        # row_factory等属性直接设置到底层连接上，归还时会被重置
+        setattr(self._conn, name, value)
+
+    def close(self):
+        """归还连接到连接池"""
+        conn = self._conn
+        if conn is None:
+            return
+        object.__setattr__(self, '_conn', None)
+        self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if self._conn is not None:
+                if exc_type is None:
+                    self._conn.commit()
+                else:
+                    self._conn.rollback()
+        finally:
+            self.close()
+        return False
+
+    def __del__(self):
+        # 调用方忘记close时兜底归还，避免连接泄漏
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """SQLite连接池
+
+    按需创建连接，归还后最多保留 max_idle 个空闲连接供后续请求复用，
+    省去每个请求重复打开文件、解析schema的开销。
+    """
+
+    def __init__(self, db_path: str, max_idle: int = 8):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _create(self) -> sqlite3.Connection:
+        conn = _open_connection(self.db_path)
+        self.created += 1
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        """从连接池借出一个连接"""
+        conn = None
+        with self._lock:
+            if self._idle:
+                conn = self._idle.pop()
+                self.reused += 1
+        if conn is None:
+            conn = self._create()
+        return PooledConnection(self, conn)
+
+    def release(self, conn: sqlite3.Connection):
+        """归还连接，未提交的事务会被回滚"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+        except sqlite3.Error:
+            # 连接已损坏，直接丢弃
+            conn.close()
+            return
+
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = len(self._idle)
+        return {'created': self.created, 'reused': self.reused, 'idle': idle}
+
+
+class WriteQueue:
+    """单写线程队列
+
+    所有批量写入（模拟结果、小说保存等）都提交到这里，由一个专用线程按顺序执行，
+    每个任务一个短事务。写入之间不会互相争锁，配合WAL模式读请求也不会被阻塞。
+    """
+
+    _STOP = object()
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.total_exec = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, func) -> Future:
+        """提交写任务，func接收一个连接作为参数，返回值通过Future获取"""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((func, future, time.perf_counter()))
+        return future
+
+    def stop(self, timeout: float = None):
+        """处理完已排队的任务后停止写线程"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(self._STOP)
+            thread.join(timeout)
+
+    def _run(self):
+        conn = _open_connection(self.db_path)
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._STOP:
+                    break
+                func, future, enqueued_at = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                started_at = time.perf_counter()
+                try:
+                    result = func(conn)
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    self._record(enqueued_at, started_at, failed=True)
+                    future.set_exception(e)
+                else:
+                    self._record(enqueued_at, started_at, failed=False)
+                    future.set_result(result)
+        finally:
+            conn.close()
+
+    def _record(self, enqueued_at, started_at, failed):
+        finished_at = time.perf_counter()
+        latency = finished_at - enqueued_at
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self.total_wait += started_at - enqueued_at
+            self.total_exec += finished_at - started_at
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self.completed + self.failed
+            return {
+                'queue_depth': self._queue.qsize(),
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_ms': round(self.total_wait / done * 1000, 3) if done else 0.0,
+                'avg_exec_ms': round(self.total_exec / done * 1000, 3) if done else 0.0,
+                'last_latency_ms': round(self.last_latency * 1000, 3),
+                'max_latency_ms': round(self.max_latency * 1000, 3)
+            }
+
+
+_pool = ConnectionPool(DB_PATH, POOL_SIZE)
+_writer = WriteQueue(DB_PATH)
+
+
+def configure(db_path: str = None, pool_size: int = None):
+    """重新配置数据库路径或连接池大小（会关闭现有的空闲连接并重启写线程）"""
+    global _pool, _writer, DB_PATH
+    _pool.close_all()
+    _writer.stop()
+    if db_path is not None:
+        DB_PATH = db_path
+    _pool = ConnectionPool(DB_PATH, _pool.max_idle if pool_size is None else pool_size)
+    _writer = WriteQueue(DB_PATH)
+
+
+def connect() -> PooledConnection:
+    """获取数据库连接，用法与 sqlite3.connect('game.db') 相同，用完调用close()归还"""
+    return _pool.acquire()
+
+
+@contextmanager
+def transaction():
+    """事务上下文：正常结束提交，异常回滚，并保证连接归还
+
+    用法：
+        with database.transaction() as conn:
+            conn.execute(...)
+    """
+    conn = _pool.acquire()
+    with conn:
+        yield conn
+
+
+def submit_write(func) -> Future:
+    """异步提交写任务到单写线程"""
+    return _writer.submit(func)
+
+
+def run_write(func, timeout: float = None):
+    """提交写任务并等待完成，返回func的返回值（异常会原样抛出）"""
+    return _writer.submit(func).result(timeout)
+
+
+def pool_stats() -> dict:
+    """连接池统计信息"""
+    return _pool.stats()
+
+
+def writer_stats() -> dict:
+    """写队列统计信息（队列深度、写入延迟）"""
+    return _writer.stats()
+
+
+def shutdown(timeout: float = None):
+    """停止服务前调用：写完已排队的写入后停止写线程，关闭空闲连接（写线程是守护线程，不调用时退出会丢弃排队的写入）"""
+    _writer.stop(timeout)
+    _pool.close_all()
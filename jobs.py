@@ -0,0 +1,216 @@
+"""
+后台任务队列
+
+模拟天数、生成小说等接口一次LLM调用要30~90秒，同步处理时整段时间都占着一个Flask工作线程，
+几个用户同时操作就会把工作线程耗尽。改为提交任务：
+- submit() 写入 jobs 表后立即返回任务ID，接口返回202
+- 固定大小的工作线程池执行任务（LLM调用 + 写库），排队数量有上限，超出时抛出 JobQueueFull
+- 客户端轮询 get() 获取状态、进度和结果；结果保存在 jobs 表中，客户端断开也不会丢失
+- 服务重启时，排队中的任务重新执行，执行中的任务标记为失败
+
+任务处理函数签名为 handler(params, report)，report(progress, message) 上报0~1的进度，
+返回值需可JSON序列化。
+
+环境变量：
+    GAME_JOB_WORKERS=4            工作线程数
+    GAME_JOB_MAX_PENDING=64       排队+执行中任务数上限
+    GAME_JOB_RETENTION=604800     已结束任务的保留时间（秒）
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+JOB_WORKERS = int(os.environ.get('GAME_JOB_WORKERS', '4'))
+JOB_MAX_PENDING = int(os.environ.get('GAME_JOB_MAX_PENDING', '64'))
+JOB_RETENTION = float(os.environ.get('GAME_JOB_RETENTION', '604800'))
+
+STATUSES = ('queued', 'running', 'succeeded', 'failed')
+
+_COLUMNS = 'id, kind, save_id, status, progress, message, result, error, created_at, started_at, finished_at'
+
+
+class JobQueueFull(RuntimeError):
+    """排队任务已达上限"""
+
+
+def _job_dict(row):
+    return {
+        'id': row[0],
+        'kind': row[1],
+        'save_id': row[2],
+        'status': row[3],
+        'progress': row[4] or 0,
+        'message': row[5] or '',
+        'result': json.loads(row[6]) if row[6] else None,
+        'error': row[7],
+        'created_at': row[8],
+        'started_at': row[9],
+        'finished_at': row[10]
+    }
+
+
+class JobQueue:
+    """基于线程池的后台任务队列，任务状态持久化在jobs表中"""
+
+    def __init__(self, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._handlers = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def register(self, kind: str, handler):
+        """注册任务类型的处理函数"""
+        self._handlers[kind] = handler
+
+    def _reserve(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise JobQueueFull(f'排队任务已达上限（{self.max_pending}），请稍后再试')
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job-worker')
+            return self._executor
+
+    def submit(self, kind: str, params: dict, save_id: int = None) -> str:
+        """提交任务并立即返回任务ID"""
+        if kind not in self._handlers:
+            raise ValueError(f'未知的任务类型: {kind}')
+        executor = self._reserve()
+        job_id = uuid.uuid4().hex
+        try:
+            # 同步写入，返回任务ID后客户端马上就能查到
+            database.run_write(lambda conn: conn.execute('''
+                INSERT INTO jobs (id, kind, save_id, status, params, created_at) VALUES (?, ?, ?, 'queued', ?, ?)
+            ''', (job_id, kind, save_id, json.dumps(params, ensure_ascii=False), time.time())))
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        with self._lock:
+            self.submitted += 1
+        executor.submit(self._run, job_id, kind, params)
+        return job_id
+
+    def _run(self, job_id, kind, params):
+        database.submit_write(lambda conn: conn.execute(
+            "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id)))
+
+        def report(progress: float, message: str = ''):
+            database.submit_write(lambda conn: conn.execute(
+                'UPDATE jobs SET progress = ?, message = ? WHERE id = ?', (progress, message, job_id)))
+
+        try:
+            result = self._handlers[kind](params, report)
+            result_json = json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            print(f"任务 {kind}/{job_id} 执行失败: {e}")
+            traceback.print_exc()
+            self._finish(job_id, 'failed', error=str(e))
+            with self._lock:
+                self.failed += 1
+        else:
+            self._finish(job_id, 'succeeded', result=result_json)
+            with self._lock:
+                self.succeeded += 1
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _finish(self, job_id, status, result=None, error=None):
+        try:
+            database.run_write(lambda conn: conn.execute('''
+                UPDATE jobs SET status = ?, progress = CASE WHEN ? = 'succeeded' THEN 1 ELSE progress END,
+                    result = ?, error = ?, finished_at = ?
+                WHERE id = ?
+            ''', (status, status, result, error, time.time(), job_id)))
+        except Exception as e:
+            print(f"保存任务 {job_id} 状态失败: {e}")
+
+    def get(self, job_id: str):
+        """读取任务状态，不存在时返回None"""
+        conn = database.connect()
+        try:
+            row = conn.execute(f'SELECT {_COLUMNS} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return _job_dict(row) if row else None
+
+    def list_jobs(self, save_id: int, status: str = None, limit: int = 20):
+        """列出存档最近的任务（按提交时间倒序）"""
+        sql = f'SELECT {_COLUMNS} FROM jobs WHERE save_id = ?'
+        params = [save_id]
+        if status:
+            sql += ' AND status = ?'
+            params.append(status)
+        sql += ' ORDER BY created_at DESC LIMIT ?'
+        params.append(limit)
+        conn = database.connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        return [_job_dict(row) for row in rows]
+
+    def recover(self) -> int:
+        """启动时调用：清理过期任务，中断的任务标记为失败，排队中的任务重新执行
+
+        Returns:
+            int: 重新执行的任务数
+        """
+        now = time.time()
+
+        def cleanup(conn):
+            conn.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+                         (now - JOB_RETENTION,))
+            conn.execute('''
+                UPDATE jobs SET status = 'failed', error = '服务重启，任务中断', finished_at = ?
+                WHERE status = 'running'
+            ''', (now,))
+            return conn.execute("SELECT id, kind, params FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+
+        requeued = 0
+        for job_id, kind, params in database.run_write(cleanup):
+            if kind not in self._handlers:
+                self._finish(job_id, 'failed', error=f'未知的任务类型: {kind}')
+                continue
+            try:
+                executor = self._reserve()
+            except JobQueueFull:
+                self._finish(job_id, 'failed', error='服务重启后排队任务过多，任务被丢弃')
+                continue
+            executor.submit(self._run, job_id, kind, json.loads(params) if params else {})
+            requeued += 1
+        return requeued
+
+    def shutdown(self, wait: bool = True):
+        """停止接收新任务，wait为True时等待执行中的任务结束"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'submitted': self.submitted,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
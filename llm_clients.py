@@ -0,0 +1,303 @@
+"""
+LLM客户端注册表
+
+按 ai_configs.id 缓存 ChatOpenAI 实例。每个实例内部持有一个 OpenAI 客户端及其HTTP连接池，
+复用同一个实例就能复用 keep-alive 连接，省去每次请求重新建立连接和TLS握手的开销，
+也不用每次请求都重新查询 ai_configs 表。
+
+ai_configs 被创建或修改后调用 invalidate()，旧实例被丢弃，下次使用时按新配置重建。
+其它进程（多个工作进程、其它工具）的修改通过 ai_config_version 表的版本号发现：取客户端前检查版本号，
+变化时丢弃全部缓存。每个进程最多每 AI_CONFIG_SYNC_INTERVAL 秒（默认2秒）读一次，缓存命中时不访问数据库。
+
+返回的实例都包了一层 LimitedChatModel，按配置限制并发数和每分钟请求/token数，
+429/5xx按退避策略重试（见 rate_limit.py），同步的 stream() 和异步的 astream() 共用同一个限流器。限流器在重建客户端时保留，执行中的调用照常计数。
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+from langchain_openai import ChatOpenAI
+
+import database
+import rate_limit
+import stub_llm
+
+# 两次读取 ai_config_version 的最短间隔（秒），其它进程的修改最迟在这么久之后生效
+CONFIG_SYNC_INTERVAL = float(os.environ.get('AI_CONFIG_SYNC_INTERVAL', '2'))
+
+
+def build_chat_model(config) -> ChatOpenAI:
+    """根据 ai_configs 的一行创建ChatOpenAI实例；base_url 为 stub:// 时创建进程内的模拟模型（见 stub_llm.py）"""
+    if (config[3] or '').startswith(stub_llm.URL_SCHEME):
+        return stub_llm.StubChatModel.from_url(config[3], model_name=config[4])
+    return ChatOpenAI(
+        api_key=config[2],
+        base_url=config[3],
+        model=config[4],
+        temperature=config[5],
+        max_tokens=config[6] if config[6] else 2000,
+        # 重试由 LimitedChatModel 负责，SDK内部重试会绕过限流
+        max_retries=0
+    )
+
+
+def config_limits(config):
+    """ai_configs 一行中的限流设置 (并发数, 每分钟请求数, 每分钟token数)，未设置的为None"""
+    return tuple(config[9:12]) if len(config) >= 12 else (None, None, None)
+
+
+def _message_text(messages):
+    if isinstance(messages, str):
+        return messages
+    parts = []
+    for message in messages:
+        if isinstance(message, dict):
+            parts.append(str(message.get('content', '')))
+        elif isinstance(message, (tuple, list)):
+            parts.append(str(message[-1]))
+        else:
+            parts.append(str(getattr(message, 'content', message)))
+    return ''.join(parts)
+
+
+def _usage_tokens(message):
+    usage = getattr(message, 'usage_metadata', None)
+    return usage.get('total_tokens') if usage else None
+
+
+class LimitedChatModel:
+    """给聊天模型加上限流和重试的代理，其余属性和方法原样转发"""
+
+    def __init__(self, model, limiter: rate_limit.ProviderLimiter, max_tokens: int = 2000):
+        self._model = model
+        self._limiter = limiter
+        self._max_tokens = max_tokens
+
+    def _estimate(self, messages):
+        return rate_limit.estimate_tokens(_message_text(messages)) + self._max_tokens
+
+    def invoke(self, messages, *args, **kwargs):
+        return self._limiter.call(lambda: self._model.invoke(messages, *args, **kwargs),
+                                  self._estimate(messages), usage=_usage_tokens)
+
+    def stream(self, messages, *args, **kwargs):
+        """流式调用整个过程占用一个并发名额；只在收到第一块之前重试，已输出内容后出错直接抛出"""
+        with self._limiter.slot(self._estimate(messages)) as report_usage:
+            attempt = 0
+            while True:
+                chunks = iter(self._model.stream(messages, *args, **kwargs))
+                try:
+                    first = next(chunks, None)
+                except Exception as e:
+                    if attempt >= rate_limit.MAX_RETRIES or not rate_limit.is_retryable(e):
+                        raise
+                    self._limiter.before_retry(attempt, e)
+                    attempt += 1
+                    continue
+                break
+            if first is None:
+                return
+            usage = _usage_tokens(first)
+            yield first
+            for chunk in chunks:
+                usage = _usage_tokens(chunk) or usage
+                yield chunk
+            report_usage(usage)
+
+    async def astream(self, messages, *args, **kwargs):
+        """stream() 的异步版本，使用模型的异步客户端，等待名额和重试退避时不占用线程"""
+        async with self._limiter.aslot(self._estimate(messages)) as report_usage:
+            attempt = 0
+            while True:
+                chunks = self._model.astream(messages, *args, **kwargs).__aiter__()
+                try:
+                    first = await chunks.__anext__()
+                except StopAsyncIteration:
+                    return
+                except Exception as e:
+                    if attempt >= rate_limit.MAX_RETRIES or not rate_limit.is_retryable(e):
+                        raise
+                    await self._limiter.abefore_retry(attempt, e)
+                    attempt += 1
+                    continue
+                break
+            usage = _usage_tokens(first)
+            yield first
+            async for chunk in chunks:
+                usage = _usage_tokens(chunk) or usage
+                yield chunk
+            report_usage(usage)
+
+    def with_config(self, *args, **kwargs):
+        return LimitedChatModel(self._model.with_config(*args, **kwargs), self._limiter, self._max_tokens)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+class ClientRegistry:
+    """按配置ID缓存的LLM客户端，线程安全"""
+
+    def __init__(self, factory=build_chat_model, sync_interval: float = CONFIG_SYNC_INTERVAL):
+        self._factory = factory
+        self.sync_interval = sync_interval
+        self._clients = {}
+        # 配置ID -> 限流器（None为没有活跃配置时使用的默认模型）
+        self._limiters = {}
+        self._active_id = None
+        self._lock = threading.Lock()
+        # 丢弃缓存时递增：generation 对应全部配置，_generations 对应单个配置。
+        # 构建客户端前记下，构建完成时有变化说明期间配置被修改，按旧配置建的实例不放入缓存
+        self.generation = 0
+        self._generations = {}
+        # 最近一次读到的 ai_config_version（None表示尚未读取或刚在本进程内丢弃过缓存）
+        self._version = None
+        # 上次读取版本号的时间（time.monotonic()）
+        self._synced_at = None
+        self.hits = 0
+        self.builds = 0
+        self.syncs = 0
+        self.version_checks = 0
+
+    def _load_config(self, config_id):
+        conn = database.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM ai_configs WHERE id = ? LIMIT 1', (config_id,))
+            return cursor.fetchone()
+        finally:
+            conn.close()
+
+    def _read_version(self):
+        conn = database.connect()
+        try:
+            row = conn.execute('SELECT version FROM ai_config_version WHERE id = 1').fetchone()
+            return row[0] if row else None
+        except sqlite3.Error:
+            # 数据库尚未迁移
+            return None
+        finally:
+            conn.close()
+
+    def _stamp(self, config_id):
+        """调用方需持有锁"""
+        return self.generation, self._generations.get(config_id, 0)
+
+    def _drop(self, config_id=None):
+        """丢弃缓存的客户端；调用方需持有锁"""
+        if config_id is None:
+            self._clients.clear()
+            self.generation += 1
+        else:
+            self._clients.pop(config_id, None)
+            self._generations[config_id] = self._generations.get(config_id, 0) + 1
+        self._active_id = None
+
+    def sync(self, force: bool = False) -> bool:
+        """ai_configs 被其它进程（或其它工具）修改过时丢弃全部缓存，返回是否丢弃
+
+        invalidate() 只作用于本进程，多个工作进程（serve.py --workers）时靠这里发现别的进程的修改。
+        距上次读取不足 sync_interval 秒时直接返回（force为True时除外），一次请求中多次取客户端只读一次数据库。
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._synced_at is not None and now - self._synced_at < self.sync_interval:
+                return False
+            self._synced_at = now
+            self.version_checks += 1
+        version = self._read_version()
+        with self._lock:
+            known, self._version = self._version, version
+            if known is None or version is None or version == known:
+                return False
+            self._drop()
+            self.syncs += 1
+            return True
+
+    def get(self, config_id):
+        """获取指定配置的客户端，配置不存在时返回None"""
+        self.sync()
+        with self._lock:
+            client = self._clients.get(config_id)
+            if client is not None:
+                self.hits += 1
+                return client
+            stamp = self._stamp(config_id)
+
+        config = self._load_config(config_id)
+        if config is None:
+            return None
+        client = LimitedChatModel(self._factory(config), self.limiter(config_id, config_limits(config)),
+                                  config[6] or 2000)
+
+        with self._lock:
+            if self._stamp(config_id) != stamp:
+                # 读取配置后缓存被丢弃过，这个实例可能是按旧配置建的，只用于本次调用
+                return client
+            # 并发构建时保留先放入的实例，保证同一配置只有一个连接池
+            if config_id not in self._clients:
+                self._clients[config_id] = client
+                self.builds += 1
+            return self._clients[config_id]
+
+    def get_active(self):
+        """获取当前活跃配置的客户端，没有活跃配置时返回None"""
+        self.sync()
+        with self._lock:
+            active_id = self._active_id
+            generation = self.generation
+        if active_id is None:
+            conn = database.connect()
+            try:
+                row = conn.execute('SELECT id FROM ai_configs WHERE is_active = 1 LIMIT 1').fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                return None
+            active_id = row[0]
+            with self._lock:
+                if self.generation == generation:
+                    self._active_id = active_id
+        return self.get(active_id)
+
+    def limiter(self, config_id, limits=None):
+        """获取配置的限流器，传入limits时按其更新限额"""
+        with self._lock:
+            limiter = self._limiters.get(config_id)
+            if limiter is None:
+                limiter = self._limiters[config_id] = rate_limit.ProviderLimiter()
+        if limits is not None:
+            limiter.configure(*limits)
+        return limiter
+
+    def limited(self, model, config_id=None):
+        """给不在 ai_configs 中的模型（如内置默认配置）加上限流"""
+        return LimitedChatModel(model, self.limiter(config_id), getattr(model, 'max_tokens', None) or 2000)
+
+    @property
+    def active_id(self):
+        """最近一次解析出的活跃配置ID（未解析或已失效时为None）"""
+        with self._lock:
+            return self._active_id
+
+    def invalidate(self, config_id=None):
+        """丢弃指定配置（不指定则全部）的客户端，活跃配置也会重新查询"""
+        with self._lock:
+            self._drop(config_id)
+            # 本进程的修改已经处理，下次 sync() 只记录新的版本号
+            self._version = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'cached_clients': len(self._clients),
+                'active_config_id': self._active_id,
+                'hits': self.hits,
+                'builds': self.builds,
+                'syncs': self.syncs,
+                'version_checks': self.version_checks,
+                'config_version': self._version,
+                'limits': {str(config_id): limiter.stats() for config_id, limiter in self._limiters.items()}
+            }
@@ -0,0 +1,700 @@
+"""数据库版本迁移
+
+每个迁移用 @migration(版本号, 说明) 注册，按版本号顺序执行，执行过的版本记录在
+schema_version 表中。启动时若数据库已是最新版本，只需一次版本查询即可返回。
+
+新增索引、字段或表时，在文件末尾追加一个更大版本号的迁移即可，不要修改已发布的迁移。
+"""
+
+import re
+import json
+import sqlite3
+import database
+
+MIGRATIONS = []
+
+
+def migration(version: int, name: str):
+    """注册一个迁移，被装饰的函数接收cursor作为参数"""
+    def decorator(func):
+        MIGRATIONS.append((version, name, func))
+        return func
+    return decorator
+
+
+def latest_version() -> int:
+    return max(version for version, _, _ in MIGRATIONS)
+
+
+def current_version(conn) -> int:
+    """读取数据库当前的schema版本，未初始化的数据库返回0"""
+    try:
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def migrate(conn=None) -> int:
+    """把数据库升级到最新版本，返回本次执行的迁移数量"""
+    own_conn = conn is None
+    if own_conn:
+        conn = database.connect()
+
+    try:
+        # 快速路径：已是最新版本
+        if current_version(conn) >= latest_version():
+            return 0
+
+        # 加写锁后再检查一次，避免多个进程同时启动时重复迁移
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            version = current_version(conn)
+
+            applied = 0
+            for target, name, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+                if target <= version:
+                    continue
+                print(f"执行数据库迁移 v{target}: {name}")
+                func(cursor)
+                cursor.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (target, name))
+                applied += 1
+
+            conn.commit()
+            return applied
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        if own_conn:
+            conn.close()
+
+
+@migration(1, '初始表结构和默认数据')
+def _initial_schema(cursor):
+    # 旧版本的game.db已经包含这些表，这里全部使用IF NOT EXISTS / INSERT OR IGNORE，可直接纳入版本管理
+    
+    # 游戏存档表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS saves (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            world_background TEXT,
+            world_introduction TEXT,
+            cultivation_system TEXT,
+            map_data TEXT,
+            current_day INTEGER DEFAULT 1,
+            current_time TEXT DEFAULT '年初春日'
+        )
+    ''')
+    
+    # 世界模版表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS world_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            world_background TEXT,
+            world_introduction TEXT,
+            cultivation_system TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # 模版势力表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS template_factions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            template_id INTEGER,
+            name TEXT NOT NULL,
+            ideal TEXT,
+            background TEXT,
+            description TEXT,
+            power_level INTEGER DEFAULT 50,
+            headquarters_location TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (template_id) REFERENCES world_templates (id)
+        )
+    ''')
+    
+    # 模版人物表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS template_characters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            template_id INTEGER,
+            template_faction_id INTEGER,
+            name TEXT NOT NULL,
+            personality TEXT,
+            birthday TEXT,
+            age INTEGER,
+            location TEXT,
+            position TEXT,
+            realm TEXT,
+            lifespan INTEGER DEFAULT 100,
+            equipment TEXT,
+            skills TEXT,
+            experience TEXT,
+            goals TEXT,
+            relationships TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (template_id) REFERENCES world_templates (id),
+            FOREIGN KEY (template_faction_id) REFERENCES template_factions (id)
+        )
+    ''')
+    
+    # 模版地区表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS template_regions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            template_id INTEGER,
+            name TEXT NOT NULL,
+            type TEXT,
+            parent_id INTEGER,
+            template_faction_id INTEGER,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (template_id) REFERENCES world_templates (id),
+            FOREIGN KEY (template_faction_id) REFERENCES template_factions (id)
+        )
+    ''')
+    
+    # 世界地图表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS map_regions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            save_id INTEGER,
+            name TEXT NOT NULL,
+            type TEXT, -- 州/区域/城/山等
+            parent_id INTEGER, -- 父级区域ID
+            faction_id INTEGER, -- 控制势力
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (save_id) REFERENCES saves (id),
+            FOREIGN KEY (faction_id) REFERENCES factions (id)
+        )
+    ''')
+    
+    # 势力表（扩展）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS factions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            save_id INTEGER,
+            name TEXT NOT NULL,
+            ideal TEXT, -- 理想
+            background TEXT, -- 背景
+            description TEXT,
+            status TEXT,
+            power_level INTEGER DEFAULT 50,
+            headquarters_location TEXT, -- 总部位置
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (save_id) REFERENCES saves (id)
+        )
+    ''')
+    
+    # 势力关系表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS faction_relationships (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            save_id INTEGER,
+            faction1_id INTEGER,
+            faction2_id INTEGER,
+            relationship_type TEXT, -- 友好/敌对/中立/联盟等
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (save_id) REFERENCES saves (id),
+            FOREIGN KEY (faction1_id) REFERENCES factions (id),
+            FOREIGN KEY (faction2_id) REFERENCES factions (id)
+        )
+    ''')
+    
+    # 人物表（扩展）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS characters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            save_id INTEGER,
+            faction_id INTEGER,
+            name TEXT NOT NULL,
+            status TEXT, -- 状态
+            personality TEXT, -- 性格
+            birthday TEXT, -- 生日
+            age INTEGER, -- 年龄
+            location TEXT, -- 地点
+            position TEXT, -- 职位
+            realm TEXT, -- 境界
+            lifespan INTEGER, -- 寿命
+            equipment TEXT, -- 装备（JSON）
+            skills TEXT, -- 技能（JSON）
+            experience TEXT, -- 人物经历
+            goals TEXT,
+            relationships TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (save_id) REFERENCES saves (id),
+            FOREIGN KEY (faction_id) REFERENCES factions (id)
+        )
+    ''')
+    
+    # 人际关系表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS character_relationships (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            save_id INTEGER,
+            character1_id INTEGER,
+            character2_id INTEGER,
+            relationship_type TEXT, -- 师父/弟子/朋友/敌人等
+            notes TEXT, -- 备注
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (save_id) REFERENCES saves (id),
+            FOREIGN KEY (character1_id) REFERENCES characters (id),
+            FOREIGN KEY (character2_id) REFERENCES characters (id)
+        )
+    ''')
+    
+    # AI对话相关表
+    # 创建chats表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        system_prompt TEXT,
+        context_count INTEGER DEFAULT 1,
+        created_at TEXT NOT NULL
+    )
+    ''')
+    
+    # 创建chat_messages表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chat_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        FOREIGN KEY (chat_id) REFERENCES chats (id)
+    )
+    ''')
+    
+    # 世界大事记表（扩展）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS world_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            save_id INTEGER,
+            day INTEGER,
+            time_period TEXT, -- 时间段
+            faction_id INTEGER, -- 相关势力
+            theme TEXT, -- 主题
+            event_title TEXT,
+            event_description TEXT,
+            region_id INTEGER, -- 相关地区
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (save_id) REFERENCES saves (id),
+            FOREIGN KEY (faction_id) REFERENCES factions (id),
+            FOREIGN KEY (region_id) REFERENCES map_regions (id)
+        )
+    ''')
+    
+    # 势力大事记表（扩展）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS faction_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            save_id INTEGER,
+            faction_id INTEGER,
+            day INTEGER,
+            time_period TEXT,
+            theme TEXT,
+            event_title TEXT,
+            event_description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (save_id) REFERENCES saves (id),
+            FOREIGN KEY (faction_id) REFERENCES factions (id)
+        )
+    ''')
+    
+    # 人物大事记表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS character_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            save_id INTEGER,
+            character_id INTEGER,
+            day INTEGER,
+            time_period TEXT,
+            theme TEXT,
+            event_title TEXT,
+            event_description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (save_id) REFERENCES saves (id),
+            FOREIGN KEY (character_id) REFERENCES characters (id)
+        )
+    ''')
+    
+    # 地图事件表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS map_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            save_id INTEGER,
+            region_id INTEGER,
+            day INTEGER,
+            event_title TEXT,
+            event_description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (save_id) REFERENCES saves (id),
+            FOREIGN KEY (region_id) REFERENCES map_regions (id)
+        )
+    ''')
+    
+    # 生成记录表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS generation_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            save_id INTEGER,
+            guide_text TEXT, -- 引导文本
+            result_summary TEXT, -- 结果摘要
+            world_refreshed BOOLEAN DEFAULT FALSE, -- 世界刷新
+            factions_refreshed BOOLEAN DEFAULT FALSE, -- 势力刷新
+            characters_refreshed BOOLEAN DEFAULT FALSE, -- 人物刷新
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (save_id) REFERENCES saves (id)
+        )
+    ''')
+    
+    # 小说记录表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS novels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            save_id INTEGER,
+            title TEXT NOT NULL,
+            theme TEXT,
+            style TEXT DEFAULT 'classic',
+            content TEXT,
+            day INTEGER,
+            characters_involved TEXT, -- JSON格式存储相关人物
+            factions_involved TEXT, -- JSON格式存储相关势力
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (save_id) REFERENCES saves (id)
+        )
+    ''')
+    
+    # AI配置表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_configs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            api_key TEXT,
+            base_url TEXT,
+            model TEXT,
+            temperature REAL DEFAULT 0.7,
+            max_tokens INTEGER DEFAULT 2000,
+            is_active BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # 插入默认DeepSeek配置
+    cursor.execute('''
+        INSERT OR IGNORE INTO ai_configs (id, name, api_key, base_url, model, temperature, is_active)
+        VALUES (1, 'DeepSeek', 'XXXX', 'https://api.deepseek.com', 'deepseek-chat', 0.7, 1)
+    ''')
+    
+    # 插入默认世界模版
+    cursor.execute('''
+        INSERT OR IGNORE INTO world_templates (id, name, description, world_background, world_introduction, cultivation_system)
+        VALUES (1, '经典修仙世界', '传统的修仙背景，包含仙门、魔道、散修等势力', 
+                '这是一个以修仙为主题的奇幻世界，天地间灵气充沛，修炼者通过吸收天地灵气来提升境界。世界分为凡人界、修真界等多个层次。',
+                '修真界历史悠久，各大仙门林立，正邪两道争斗不休。凡人羡慕修真者的力量，而修真者追求更高的境界和永生。',
+                '修炼境界分为：练气期、筑基期、金丹期、元婴期、化神期、炼虚期、合体期、大乘期、渡劫期。每个境界又分为初期、中期、后期、圆满四个小境界。')
+    ''')
+    
+    # 插入斗破苍穹世界模版
+    cursor.execute('''
+        INSERT OR IGNORE INTO world_templates (id, name, description, world_background, world_introduction, cultivation_system)
+        VALUES (2, '斗破苍穹世界', '土豆经典玄幻小说背景，斗气大陆的热血传奇', 
+                '斗气大陆，没有花俏的魔法，有的，仅仅是繁衍到巅峰的斗气！在这个世界，斗气就是一切，强者为尊，弱者为奴。这里有着无数的种族和势力，人类、魔兽、古族等各方势力错综复杂。',
+                '斗气大陆广袤无垠，分为中州、西北大陆、黑角域等多个区域。中州是大陆的中心，强者如云，古族林立。各大势力为了争夺资源和地盘，战争不断。这是一个充满机遇与危险的世界，强者可以翻手为云覆手为雨，弱者只能在夹缝中求生存。',
+                '斗气修炼分为：斗者、斗师、大斗师、斗灵、斗王、斗皇、斗宗、斗尊、斗圣、斗帝。每个境界又分为一至九星。斗帝为传说中的至高境界，整个大陆历史上只出现过屈指可数的几位斗帝强者。')
+    ''')
+    
+    # 插入默认模版势力
+    cursor.execute('''
+        INSERT OR IGNORE INTO template_factions (id, template_id, name, ideal, background, description, power_level, headquarters_location)
+        VALUES 
+        (1, 1, '天剑门', '以剑道称雄天下，维护正道', '天剑门成立于三千年前，是修真界最古老的正道门派之一', '以剑法闻名的正道门派，门下弟子皆是剑道高手', 85, '天剑峰'),
+        (2, 1, '万毒教', '称霸修真界，统治所有修炼者', '万毒教是修真界最大的魔道势力，擅长毒术和邪法', '魔道门派，以毒术和邪法著称，与正道为敌', 80, '万毒谷'),
+        (3, 1, '散修联盟', '团结散修，对抗大门派的压迫', '由众多散修自发组成的松散联盟', '散修们为了对抗大门派的压迫而组成的联盟', 60, '自由城'),
+        (4, 1, '丹药阁', '垄断丹药市场，积累巨大财富', '专门炼制和贩卖丹药的商业组织', '中立势力，专注于丹药买卖，与各方都有往来', 70, '丹药城'),
+        (5, 2, '古族联盟', '维护古族血脉纯正，统治斗气大陆', '远古时期就存在的强大种族联盟，拥有最纯正的血脉', '由魂族、古族、炎族等八大古族组成的强大联盟', 95, '中州古族圣地'),
+        (6, 2, '云岚宗', '发扬云岚宗威名，统一西北大陆', '西北大陆最强大的宗门，历史悠久', '西北大陆的霸主级势力，以风属性斗技著称', 75, '云岚山'),
+        (7, 2, '黑角域', '利益至上，强者为尊', '黑角域是一个混乱无序的地方，强者如云', '充满混乱与杀戮的地域，各种邪恶势力聚集', 70, '黑角域中心'),
+        (8, 2, '炼药师公会', '推广炼药术，维护炼药师地位', '大陆最权威的炼药师组织', '超然物外的中立势力，掌握着大陆的丹药资源', 85, '圣丹城'),
+        (9, 2, '魔兽帝国', '建立魔兽统治的世界', '强大魔兽种族建立的庞大帝国', '以太虚古龙族为首的魔兽联盟，实力深不可测', 90, '兽域深处')
+    ''')
+    
+    # 插入默认模版人物
+    cursor.execute('''
+        INSERT OR IGNORE INTO template_characters (id, template_id, template_faction_id, name, personality, age, position, realm, location, goals, experience)
+        VALUES 
+        (1, 1, 1, '剑无极', '正直刚毅，嫉恶如仇', 150, '掌门', '化神期后期', '天剑峰', '维护正道，消灭邪魔', '天剑门第十八代掌门，剑道天才'),
+        (2, 1, 1, '李清风', '温和儒雅，智慧过人', 80, '大长老', '元婴期圆满', '天剑峰', '辅助掌门管理门派，培养后进', '天剑门资深长老，擅长阵法'),
+        (3, 1, 2, '毒龙真人', '阴险狡诈，心狠手辣', 200, '教主', '化神期圆满', '万毒谷', '统一修真界，建立魔道王朝', '万毒教现任教主，毒术登峰造极'),
+        (4, 1, 2, '血手屠夫', '嗜血残暴，杀人如麻', 120, '护法', '元婴期后期', '万毒谷', '为教主效力，杀尽正道', '万毒教四大护法之一，以残忍著称'),
+        (5, 1, 3, '自由行者', '洒脱不羁，崇尚自由', 90, '盟主', '金丹期圆满', '自由城', '保护散修权益，建立公平秩序', '散修出身，靠自己努力达到现在的境界'),
+        (6, 1, 4, '丹圣子', '精明能干，善于经商', 70, '阁主', '元婴期中期', '丹药城', '发展丹药事业，成为修真界首富', '年轻有为的丹药大师，商业天赋极高'),
+        (7, 2, 5, '魂天帝', '冷酷无情，野心勃勃', 1000, '魂族族长', '九星斗圣巅峰', '魂界', '晋升斗帝，统治整个斗气大陆', '魂族最强者，距离斗帝只有一步之遥'),
+        (8, 2, 5, '古元', '睿智稳重，守护族人', 800, '古族族长', '八星斗圣后期', '古界', '保护古族血脉，对抗魂族', '古族现任族长，实力深厚的斗圣强者'),
+        (9, 2, 6, '云韵', '冷若冰霜，内心温柔', 30, '宗主', '斗皇巅峰', '云岚山', '振兴云岚宗，保护门下弟子', '年轻的云岚宗宗主，天赋异禀的风属性斗者'),
+        (10, 2, 6, '云山', '固执己见，实力强大', 150, '太上长老', '斗宗', '云岚山', '让云岚宗重回巅峰', '云岚宗前宗主，实力强悍但性格偏执'),
+        (11, 2, 7, '韩枫', '阴险狡诈，贪婪无度', 45, '黑皇', '斗皇', '黑角域', '称霸黑角域，获得更强力量', '黑角域的强者，心狠手辣的邪恶斗者'),
+        (12, 2, 8, '法犸', '温和慈祥，德高望重', 200, '会长', '六品炼药师', '圣丹城', '培养更多炼药师，推广炼药术', '炼药师公会德高望重的会长'),
+        (13, 2, 9, '烛坤', '桀骜不驯，实力恐怖', 2000, '太虚古龙皇', '九星斗圣', '兽域', '复兴太虚古龙一族', '太虚古龙族族长，被封印多年的绝世强者'),
+        (14, 2, 6, '纳兰嫣然', '高傲自信，天赋卓越', 18, '少宗主', '大斗师', '云岚山', '成为强者，证明自己', '云岚宗年轻一代的佼佼者，纳兰家族天才'),
+        (15, 2, 7, '萧炎', '坚韧不拔，天赋异禀，遭遇挫折后更加努力', 16, '平民', '斗者一星', '乌坦城', '恢复天才之名，报仇雪耻，追求更强的力量', '曾经是乌坦城天才少年，三年前修为突然跌落，被未婚妻纳兰嫣然退婚，与神秘的药老结识，开始了逆袭之路')
+    ''')
+    
+    # 插入模版地区数据
+    cursor.execute('''
+        INSERT OR IGNORE INTO template_regions (id, template_id, name, type, parent_id, template_faction_id, description)
+        VALUES 
+        (1, 1, '天武大陆', '大陆', NULL, NULL, '修真界的主要大陆，灵气充沛'),
+        (2, 1, '东方仙域', '区域', 1, 1, '正道势力聚集的东方区域'),
+        (3, 1, '西方魔域', '区域', 1, 2, '魔道势力盘踞的西方区域'),
+        (4, 1, '中央平原', '平原', 1, 3, '散修聚集的中立区域'),
+        (5, 1, '南方丹域', '区域', 1, 4, '丹药师聚集的炼丹圣地'),
+        (6, 2, '斗气大陆', '大陆', NULL, NULL, '斗气修炼者的主要栖息地'),
+        (7, 2, '中州', '州', 6, 5, '大陆中心，古族林立的核心区域'),
+        (8, 2, '西北大陆', '州', 6, 6, '云岚宗统治的西北区域'),
+        (9, 2, '黑角域', '域', 6, 7, '混乱无序的危险地带'),
+        (10, 2, '圣丹城', '城', 7, 8, '炼药师公会总部所在'),
+        (11, 2, '兽域', '域', 6, 9, '魔兽种族的栖息地'),
+        (12, 2, '云岚山', '山', 8, 6, '云岚宗总部山脉'),
+        (13, 2, '迦南学院', '学院', 8, NULL, '大陆著名的修炼学院'),
+        (14, 2, '乌坦城', '城', 8, NULL, '西北大陆的小城镇')
+    ''')
+
+
+@migration(2, '按save_id/day访问路径的二级索引')
+def _save_day_indexes(cursor):
+    # 几乎所有查询都按save_id过滤并按day/created_at排序
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_world_events_save_day ON world_events (save_id, day DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_faction_events_save_day ON faction_events (save_id, day DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_character_events_save_day ON character_events (save_id, day DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_map_events_save_day ON map_events (save_id, day DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_faction_events_faction ON faction_events (faction_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_character_events_character ON character_events (character_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_factions_save ON factions (save_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_characters_save ON characters (save_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_characters_faction ON characters (faction_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_map_regions_save ON map_regions (save_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_map_regions_parent ON map_regions (parent_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_faction_relationships_save ON faction_relationships (save_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_character_relationships_save ON character_relationships (save_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_novels_save_created ON novels (save_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_generation_logs_save_created ON generation_logs (save_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_messages_chat ON chat_messages (chat_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_template_factions_template ON template_factions (template_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_template_characters_template ON template_characters (template_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_template_regions_template ON template_regions (template_id)')
+
+
+@migration(3, '事件时间线键集分页索引')
+def _event_timeline_indexes(cursor):
+    # 时间线按 (day, created_at, id) 倒序分页，索引覆盖全部排序键后无需临时排序，
+    # 原 (save_id, day) 索引是新索引的前缀，删除以减少写入开销
+    for table in ('world_events', 'faction_events', 'character_events'):
+        cursor.execute(f'DROP INDEX IF EXISTS idx_{table}_save_day')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_timeline '
+                       f'ON {table} (save_id, day DESC, created_at DESC, id DESC)')
+
+
+@migration(4, '存档修订号（ETag/条件GET）')
+def _save_revision(cursor):
+    cursor.execute('ALTER TABLE saves ADD COLUMN revision INTEGER NOT NULL DEFAULT 0')
+
+
+@migration(5, 'LLM提示词结果缓存表')
+def _prompt_cache(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS prompt_cache (
+            key TEXT PRIMARY KEY, -- (配置ID, 模型, 温度, 提示词) 的哈希
+            response TEXT,
+            created_at REAL -- UNIX时间戳，用于TTL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_prompt_cache_created ON prompt_cache (created_at)')
+
+
+@migration(6, '后台任务表')
+def _jobs(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL, -- simulate / novel
+            save_id INTEGER,
+            status TEXT NOT NULL, -- queued / running / succeeded / failed
+            progress REAL DEFAULT 0,
+            message TEXT,
+            params TEXT, -- JSON，服务重启后用于重新执行排队中的任务
+            result TEXT, -- JSON
+            error TEXT,
+            created_at REAL, -- UNIX时间戳
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_save_created ON jobs (save_id, created_at DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+
+
+@migration(7, 'AI配置限流设置')
+def _ai_config_limits(cursor):
+    # NULL表示使用环境变量中的默认值，0表示不限（见 rate_limit.py）
+    cursor.execute('ALTER TABLE ai_configs ADD COLUMN max_concurrency INTEGER')
+    cursor.execute('ALTER TABLE ai_configs ADD COLUMN requests_per_minute INTEGER')
+    cursor.execute('ALTER TABLE ai_configs ADD COLUMN tokens_per_minute INTEGER')
+
+
+# 检索索引覆盖的表：(表名, 类型, 类型编号, 名称列, 正文列)，类型及编号与 retrieval.KIND_CODES 一致
+_SEARCH_SOURCES = (
+    ('characters', 'character', 1, 'name',
+     ('personality', 'position', 'realm', 'location', 'status', 'goals', 'experience')),
+    ('factions', 'faction', 2, 'name', ('ideal', 'background', 'description', 'status', 'headquarters_location')),
+    ('map_regions', 'region', 3, 'name', ('type', 'description')),
+    ('world_events', 'worldevent', 4, 'event_title', ('theme', 'event_description')),
+    ('faction_events', 'factionevent', 5, 'event_title', ('theme', 'event_description')),
+    ('character_events', 'characterevent', 6, 'event_title', ('theme', 'event_description')),
+)
+
+
+@migration(8, '人物/势力/地区/事件全文检索索引')
+def _search_index(cursor):
+    # FTS5自带的trigram分词（按连续三个字符建索引，需要SQLite 3.34+），触发器只用内置SQL函数，
+    # 其它工具打开数据库写入这些表时索引同样会更新（见 retrieval.py）。
+    # trigram匹配的是子串，save_key/kind 以 "." 结尾，避免 s1 匹配到 s12、character 匹配到 characterevent
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(save_key, kind, name, body, "
+                   "tokenize='trigram')")
+    # 批量写入事件时，写入方在事务内插入一行暂停标记，写完后一次性补进索引并删除标记（见 persistence.py）；
+    # 其它连接看不到未提交的标记，照常由触发器维护
+    cursor.execute('CREATE TABLE IF NOT EXISTS search_index_pause (id INTEGER PRIMARY KEY)')
+    for table, kind, code, name_column, body_columns in _SEARCH_SOURCES:
+        def values(row):
+            body = " || ' ' || ".join(f"coalesce({row}.{column}, '')" for column in body_columns)
+            return (f"{row}.id * 8 + {code}, 's' || {row}.save_id || '.', '{kind}.', "
+                    f"coalesce({row}.{name_column}, ''), {body}")
+
+        insert = f'INSERT INTO search_index (rowid, save_key, kind, name, body) VALUES ({values("NEW")});'
+        delete = f'DELETE FROM search_index WHERE rowid = OLD.id * 8 + {code};'
+        watched = ', '.join(('save_id', name_column) + body_columns)
+        paused = ' WHEN NOT EXISTS (SELECT 1 FROM search_index_pause)' if table.endswith('_events') else ''
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS trg_{table}_search_insert AFTER INSERT ON {table}{paused} '
+                       f'BEGIN {insert} END')
+        # 只有被索引的列变化时才更新索引，模拟时频繁更新的年龄等字段不触发
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS trg_{table}_search_update AFTER UPDATE OF {watched} '
+                       f'ON {table} BEGIN {delete} {insert} END')
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS trg_{table}_search_delete AFTER DELETE ON {table} '
+                       f'BEGIN {delete} END')
+        cursor.execute(f'INSERT INTO search_index (rowid, save_key, kind, name, body) '
+                       f'SELECT {values(table)} FROM {table}')
+
+
+def _v9_novel_digest(content, title):
+    """迁移9补记用的小说章节摘录：《标题》: 章节标题 - 正文前100字、..."""
+    try:
+        novel = json.loads(content) if content else {}
+    except ValueError:
+        novel = {}
+    if not isinstance(novel, dict):
+        novel = {}
+    title = novel.get('title') or title or '未命名小说'
+    chapters = novel.get('chapters')
+    if not isinstance(chapters, list) or not chapters:
+        return f'《{title}》'
+    excerpts = []
+    for chapter in chapters:
+        if not isinstance(chapter, dict):
+            continue
+        text = chapter.get('content') or ''
+        excerpts.append(f"{chapter.get('title', '')} - {text[:100] + '...' if len(text) > 100 else text}")
+    return f'《{title}》: ' + '、'.join(excerpts)
+
+
+def _v9_headline(text):
+    """迁移9补记用的梗概行：摘要的第一句话，最多60字"""
+    text = text.strip()
+    match = re.search(r'[。！？!?\n]', text)
+    sentence = (text[:match.start() + 1] if match else text).strip()
+    return sentence[:60] + '...' if len(sentence) > 60 else sentence
+
+
+@migration(9, '剧情记忆（每天摘要和整体梗概）')
+def _story_memory(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS story_days (
+            save_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            summary TEXT, -- 当天的模拟摘要和小说章节摘录
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (save_id, day)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS story_arcs (
+            save_id INTEGER PRIMARY KEY,
+            summary TEXT, -- 每天一行的整体梗概
+            through_day INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 已有的小说补记到剧情记忆中，升级后提示词里仍能看到之前的剧情。
+    # 摘录和梗概规则固定在迁移中（与发布时的 story_memory.py 一致），之后修改 story_memory.py 不影响这里
+    days = {}
+    novels = cursor.execute('SELECT save_id, day, title, content FROM novels ORDER BY save_id, day, id').fetchall()
+    for save_id, day, title, content in novels:
+        key = (save_id, day or 0)
+        text = '\n'.join(([days[key]] if key in days else []) + [_v9_novel_digest(content, title)])
+        days[key] = text if len(text) <= 600 else '...' + text[-597:]
+
+    arcs = {}
+    for (save_id, day), summary in days.items():
+        cursor.execute('INSERT OR REPLACE INTO story_days (save_id, day, summary) VALUES (?, ?, ?)',
+                       (save_id, day, summary))
+        arcs.setdefault(save_id, []).append((day, f'第{day}天：{_v9_headline(summary.lstrip("."))}'))
+    for save_id, lines in arcs.items():
+        # 每天一行，超出1500字时丢弃最早的行
+        while len(lines) > 1 and sum(len(line) + 1 for _, line in lines) > 1500:
+            lines.pop(0)
+        cursor.execute('INSERT OR REPLACE INTO story_arcs (save_id, summary, through_day) VALUES (?, ?, ?)',
+                       (save_id, '\n'.join(line for _, line in lines), lines[-1][0]))
+
+
+@migration(10, '聊天早期对话摘要')
+def _chat_summary(cursor):
+    # summary_through: 已折叠进摘要的最后一条消息ID（见 chat_context.py）
+    cursor.execute('ALTER TABLE chats ADD COLUMN summary TEXT')
+    cursor.execute('ALTER TABLE chats ADD COLUMN summary_through INTEGER NOT NULL DEFAULT 0')
+
+
+@migration(11, 'AI配置版本号（多进程间同步配置修改）')
+def _ai_config_version(cursor):
+    # ai_configs 每次增删改都递增版本号，各进程的客户端缓存发现版本变化后重建（见 llm_clients.py）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_config_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO ai_config_version (id, version) VALUES (1, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_ai_configs_version_{event.lower()} AFTER {event} ON ai_configs
+            BEGIN
+                UPDATE ai_config_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
@@ -0,0 +1,387 @@
+"""批量写库逻辑
+
+- apply_simulation_result: simulate 和 generate-story-novel 两个接口共用的模拟结果写入
+- create_world: 一次性创建存档及整个世界（地区、势力、人物、关系）
+- instantiate_template: 在数据库内直接从世界模版复制出新存档
+- bump_revision / save_revision: 存档修订号，所有写存档数据的路径都要递增（读接口的ETag由它生成）
+
+按表分组后用executemany批量写入，调用方负责提供连接和事务（通常通过 database.run_write 在单写线程中执行）。
+"""
+
+import json
+from contextlib import contextmanager
+from typing import Dict, Any
+
+import story_memory
+
+
+def _event_rows(save_id: int, result: Dict[str, Any]):
+    world_rows = [
+        (save_id, event['day'], event.get('time_period', ''),
+         event.get('faction_id'), event.get('theme', ''),
+         event['title'], event['description'], event.get('region_id'))
+        for event in result.get('world_events', [])
+    ]
+    faction_rows = [
+        (save_id, event.get('faction_id'), event['day'],
+         event.get('time_period', ''), event.get('theme', ''),
+         event['title'], event['description'])
+        for event in result.get('faction_events', [])
+    ]
+    character_rows = [
+        (save_id, event.get('character_id'), event['day'],
+         event.get('time_period', ''), event.get('theme', ''),
+         event['title'], event['description'])
+        for event in result.get('character_events', [])
+    ]
+    return world_rows, faction_rows, character_rows
+
+
+# 事件表 -> 检索索引中的 (类型编号, 类型)，与迁移8的触发器一致（见 retrieval.KIND_CODES）
+_EVENT_INDEX = {
+    'world_events': (4, 'worldevent'),
+    'faction_events': (5, 'factionevent'),
+    'character_events': (6, 'characterevent'),
+}
+
+
+@contextmanager
+def _search_index_paused(cursor, tables):
+    """批量写入事件期间暂停逐行维护检索索引的触发器，写完后一次性补进索引
+
+    触发器逐行写FTS5索引的开销远大于写入本身。暂停标记只在当前事务内存在（退出时删除），
+    其它连接看不到，照常由触发器维护索引。
+    """
+    marks = {table: cursor.execute(f'SELECT coalesce(max(id), 0) FROM {table}').fetchone()[0] for table in tables}
+    cursor.execute('INSERT INTO search_index_pause (id) VALUES (1)')
+    try:
+        yield
+        for table in tables:
+            code, kind = _EVENT_INDEX[table]
+            cursor.execute(f'''
+                INSERT INTO search_index (rowid, save_key, kind, name, body)
+                SELECT id * 8 + {code}, 's' || save_id || '.', '{kind}.', coalesce(event_title, ''),
+                       coalesce(theme, '') || ' ' || coalesce(event_description, '')
+                FROM {table} WHERE id > ?
+            ''', (marks[table],))
+    finally:
+        cursor.execute('DELETE FROM search_index_pause')
+
+
+def apply_simulation_result(conn, save_id: int, result: Dict[str, Any], story_guide: str,
+                            new_day: int, new_time: str):
+    """把一次模拟的结果（事件、势力/人物更新、生成日志、剧情记忆、存档天数）写入数据库
+
+    Args:
+        conn: 数据库连接，由调用方提交事务
+        save_id: 存档ID
+        result: AI返回的模拟结果（simulate_days的返回值或story_progress）
+        story_guide: 故事引导词，记录到生成日志
+        new_day: 推进后的天数
+        new_time: 推进后的时间描述
+    """
+    cursor = conn.cursor()
+
+    # 事件
+    world_rows, faction_rows, character_rows = _event_rows(save_id, result)
+    with _search_index_paused(cursor, ('world_events', 'faction_events', 'character_events')):
+        if world_rows:
+            cursor.executemany('''
+                INSERT INTO world_events (save_id, day, time_period, faction_id, theme, event_title, event_description, region_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', world_rows)
+        if faction_rows:
+            cursor.executemany('''
+                INSERT INTO faction_events (save_id, faction_id, day, time_period, theme, event_title, event_description)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', faction_rows)
+        if character_rows:
+            cursor.executemany('''
+                INSERT INTO character_events (save_id, character_id, day, time_period, theme, event_title, event_description)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', character_rows)
+
+    # 势力更新
+    faction_creates = []
+    faction_updates = []
+    for update in result.get('faction_updates', []):
+        if update.get('action') == 'create':
+            faction_creates.append((
+                save_id, update['name'], update.get('ideal', ''), update.get('background', ''),
+                update.get('description', ''), update.get('status', '活跃'),
+                update.get('power_level', 50), update.get('headquarters_location', '')))
+        elif update.get('action') == 'update' and update.get('faction_id'):
+            faction_updates.append((
+                update.get('status', ''), update.get('power_level', 50),
+                update.get('description', ''), update.get('headquarters_location', ''),
+                update.get('faction_id'), save_id))
+    if faction_creates:
+        cursor.executemany('''
+            INSERT INTO factions (save_id, name, ideal, background, description, status, power_level, headquarters_location)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', faction_creates)
+    if faction_updates:
+        cursor.executemany('''
+            UPDATE factions
+            SET status = ?, power_level = ?, description = ?, headquarters_location = ?
+            WHERE id = ? AND save_id = ?
+        ''', faction_updates)
+
+    # 人物更新
+    character_creates = []
+    character_updates = []
+    for update in result.get('character_updates', []):
+        if update.get('action') == 'create':
+            character_creates.append((
+                save_id, update.get('faction_id'), update['name'], update.get('status', '活跃'),
+                update.get('personality', ''), update.get('birthday', ''), update.get('age', 25),
+                update.get('location', ''), update.get('position', ''), update.get('realm', ''),
+                update.get('lifespan', 100), json.dumps(update.get('equipment', [])),
+                json.dumps(update.get('skills', [])), update.get('experience', ''),
+                update.get('goals', ''), update.get('relationships', '')))
+        elif update.get('action') == 'update' and update.get('character_id'):
+            character_updates.append((
+                update.get('status', ''), update.get('age', 0), update.get('location', ''),
+                update.get('position', ''), update.get('realm', ''), update.get('experience', ''),
+                update.get('goals', ''), update.get('faction_id'),
+                update.get('character_id'), save_id))
+    if character_creates:
+        cursor.executemany('''
+            INSERT INTO characters (save_id, faction_id, name, status, personality, birthday, age,
+                                  location, position, realm, lifespan, equipment, skills, experience, goals, relationships)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', character_creates)
+    if character_updates:
+        cursor.executemany('''
+            UPDATE characters
+            SET status = ?, age = ?, location = ?, position = ?, realm = ?,
+                experience = ?, goals = ?, faction_id = ?
+            WHERE id = ? AND save_id = ?
+        ''', character_updates)
+
+    # 记录生成日志
+    cursor.execute('''
+        INSERT INTO generation_logs (save_id, guide_text, result_summary, world_refreshed, factions_refreshed, characters_refreshed)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (save_id, story_guide, result.get('summary', ''), True, True, True))
+
+    # 当天的剧情摘要，之后的生成从剧情记忆中读取
+    story_memory.record(conn, save_id, new_day, summary=result.get('summary', ''))
+
+    # 更新存档的当前天数和时间，同时递增修订号
+    cursor.execute('''
+        UPDATE saves SET current_day = ?, current_time = ?, revision = revision + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (new_day, new_time, save_id))
+
+
+def bump_revision(conn, save_id: int):
+    """存档下的数据发生变化后递增修订号，与写入放在同一个事务里"""
+    conn.execute('UPDATE saves SET revision = revision + 1 WHERE id = ?', (save_id,))
+
+
+def save_revision(conn, save_id: int):
+    """读取存档修订号，存档不存在时返回None"""
+    row = conn.execute('SELECT revision FROM saves WHERE id = ?', (save_id,)).fetchone()
+    return row[0] if row else None
+
+
+def create_world(conn, data: Dict[str, Any]) -> Dict[str, Any]:
+    """在一个事务内创建存档及其地区、势力、人物和关系
+
+    势力通过名称关联：人物的 faction / faction_name、地区的 faction_name、
+    势力关系的 faction1_name / faction2_name 都在服务端解析为真实ID；
+    地区的 parent_name 解析为父级地区ID，人物关系通过 character1_name / character2_name 关联。
+
+    Returns:
+        Dict: save_id 以及各类数据的写入数量
+    """
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        INSERT INTO saves (name, world_background, world_introduction, cultivation_system, map_data)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (data['name'], data.get('world_background', ''),
+          data.get('world_introduction', ''), data.get('cultivation_system', ''), '{}'))
+    save_id = cursor.lastrowid
+
+    # 势力（需要ID用于后续关联，逐条插入）
+    faction_ids = {}
+    for faction in data.get('factions', []):
+        cursor.execute('''
+            INSERT INTO factions (save_id, name, ideal, background, description, status, power_level, headquarters_location)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (save_id, faction['name'], faction.get('ideal', ''), faction.get('background', ''),
+              faction.get('description', ''), faction.get('status', '活跃'),
+              faction.get('power_level', 50), faction.get('headquarters_location', '')))
+        faction_ids.setdefault(faction['name'], cursor.lastrowid)
+
+    # 地区：先插入，再按parent_name回填父级ID
+    region_ids = {}
+    region_parents = []
+    for region in data.get('regions', []):
+        cursor.execute('''
+            INSERT INTO map_regions (save_id, name, type, parent_id, faction_id, description)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (save_id, region['name'], region.get('type', '区域'), None,
+              faction_ids.get(region.get('faction_name')), region.get('description', '')))
+        region_ids.setdefault(region['name'], cursor.lastrowid)
+        if region.get('parent_name'):
+            region_parents.append((region['parent_name'], cursor.lastrowid))
+    parent_rows = [(region_ids[parent_name], region_id) for parent_name, region_id in region_parents
+                   if parent_name in region_ids and region_ids[parent_name] != region_id]
+    if parent_rows:
+        cursor.executemany('UPDATE map_regions SET parent_id = ? WHERE id = ?', parent_rows)
+
+    # 人物
+    character_rows = []
+    for character in data.get('characters', []):
+        faction_name = character.get('faction') or character.get('faction_name')
+        character_rows.append((
+            save_id, faction_ids.get(faction_name), character['name'], character.get('status', '活跃'),
+            character.get('personality', ''), character.get('birthday', ''), character.get('age', 25),
+            character.get('location', ''), character.get('position', ''), character.get('realm', ''),
+            character.get('lifespan', 100), json.dumps(character.get('equipment', [])),
+            json.dumps(character.get('skills', [])), character.get('experience', ''),
+            character.get('goals', ''), character.get('relationships', '')))
+    if character_rows:
+        cursor.executemany('''
+            INSERT INTO characters (save_id, faction_id, name, status, personality, birthday, age,
+                                  location, position, realm, lifespan, equipment, skills, experience, goals, relationships)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', character_rows)
+
+    # 势力关系
+    faction_relationship_rows = [
+        (save_id, faction_ids[rel['faction1_name']], faction_ids[rel['faction2_name']],
+         rel.get('relationship_type', '中立'), rel.get('description', ''))
+        for rel in data.get('faction_relationships', [])
+        if rel.get('faction1_name') in faction_ids and rel.get('faction2_name') in faction_ids
+    ]
+    if faction_relationship_rows:
+        cursor.executemany('''
+            INSERT INTO faction_relationships (save_id, faction1_id, faction2_id, relationship_type, description)
+            VALUES (?, ?, ?, ?, ?)
+        ''', faction_relationship_rows)
+
+    # 人际关系
+    character_relationship_rows = []
+    if data.get('character_relationships'):
+        character_ids = {}
+        for character_id, name in cursor.execute(
+                'SELECT id, name FROM characters WHERE save_id = ? ORDER BY id', (save_id,)):
+            character_ids.setdefault(name, character_id)
+        character_relationship_rows = [
+            (save_id, character_ids[rel['character1_name']], character_ids[rel['character2_name']],
+             rel.get('relationship_type', '朋友'), rel.get('notes', ''))
+            for rel in data['character_relationships']
+            if rel.get('character1_name') in character_ids and rel.get('character2_name') in character_ids
+        ]
+        if character_relationship_rows:
+            cursor.executemany('''
+                INSERT INTO character_relationships (save_id, character1_id, character2_id, relationship_type, notes)
+                VALUES (?, ?, ?, ?, ?)
+            ''', character_relationship_rows)
+
+    return {
+        'save_id': save_id,
+        'regions': len(data.get('regions', [])),
+        'factions': len(data.get('factions', [])),
+        'characters': len(character_rows),
+        'faction_relationships': len(faction_relationship_rows),
+        'character_relationships': len(character_relationship_rows)
+    }
+
+
+def _next_id(cursor, table: str) -> int:
+    """AUTOINCREMENT表下一个可用ID的基数（新ID从返回值+1开始）"""
+    cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+    row = cursor.fetchone()
+    seq = row[0] if row else 0
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+    return max(seq, cursor.fetchone()[0])
+
+
+def instantiate_template(conn, template_id: int, name: str, overrides: Dict[str, Any] = None):
+    """用INSERT ... SELECT在数据库内从模版创建存档，不经过前端JSON往返
+
+    template_factions / template_regions 的ID通过临时映射表重新编号，
+    人物和地区的 template_faction_id、地区的 parent_id 都按映射表换成新存档中的ID。
+
+    Returns:
+        Dict: save_id 以及各类数据的复制数量；模版不存在时返回None
+    """
+    overrides = overrides or {}
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        INSERT INTO saves (name, world_background, world_introduction, cultivation_system, map_data)
+        SELECT ?, COALESCE(?, world_background), COALESCE(?, world_introduction),
+               COALESCE(?, cultivation_system), '{}'
+        FROM world_templates WHERE id = ?
+    ''', (name, overrides.get('world_background'), overrides.get('world_introduction'),
+          overrides.get('cultivation_system'), template_id))
+    if cursor.rowcount == 0:
+        return None
+    save_id = cursor.lastrowid
+
+    cursor.execute('DROP TABLE IF EXISTS temp.template_faction_map')
+    cursor.execute('DROP TABLE IF EXISTS temp.template_region_map')
+    try:
+        # 势力ID映射：模版势力ID -> 新势力ID
+        cursor.execute('''
+            CREATE TEMP TABLE template_faction_map AS
+            SELECT id AS template_faction_id, ? + ROW_NUMBER() OVER (ORDER BY id) AS faction_id
+            FROM template_factions WHERE template_id = ?
+        ''', (_next_id(cursor, 'factions'), template_id))
+        cursor.execute('''
+            INSERT INTO factions (id, save_id, name, ideal, background, description, status, power_level, headquarters_location)
+            SELECT m.faction_id, ?, tf.name, tf.ideal, tf.background, tf.description, '活跃',
+                   tf.power_level, tf.headquarters_location
+            FROM template_factions tf
+            JOIN template_faction_map m ON m.template_faction_id = tf.id
+            ORDER BY m.faction_id
+        ''', (save_id,))
+        faction_count = cursor.rowcount
+
+        # 地区ID映射：模版地区ID -> 新地区ID，parent_id同样按映射转换
+        cursor.execute('''
+            CREATE TEMP TABLE template_region_map AS
+            SELECT id AS template_region_id, ? + ROW_NUMBER() OVER (ORDER BY id) AS region_id
+            FROM template_regions WHERE template_id = ?
+        ''', (_next_id(cursor, 'map_regions'), template_id))
+        cursor.execute('''
+            INSERT INTO map_regions (id, save_id, name, type, parent_id, faction_id, description)
+            SELECT rm.region_id, ?, tr.name, tr.type, pm.region_id, fm.faction_id, tr.description
+            FROM template_regions tr
+            JOIN template_region_map rm ON rm.template_region_id = tr.id
+            LEFT JOIN template_region_map pm ON pm.template_region_id = tr.parent_id
+            LEFT JOIN template_faction_map fm ON fm.template_faction_id = tr.template_faction_id
+            ORDER BY rm.region_id
+        ''', (save_id,))
+        region_count = cursor.rowcount
+
+        # 人物
+        cursor.execute('''
+            INSERT INTO characters (save_id, faction_id, name, status, personality, birthday, age,
+                                  location, position, realm, lifespan, equipment, skills, experience, goals, relationships)
+            SELECT ?, fm.faction_id, tc.name, '活跃', tc.personality, tc.birthday, tc.age,
+                   tc.location, tc.position, tc.realm, tc.lifespan,
+                   COALESCE(tc.equipment, '[]'), COALESCE(tc.skills, '[]'),
+                   tc.experience, tc.goals, tc.relationships
+            FROM template_characters tc
+            LEFT JOIN template_faction_map fm ON fm.template_faction_id = tc.template_faction_id
+            WHERE tc.template_id = ?
+            ORDER BY tc.id
+        ''', (save_id, template_id))
+        character_count = cursor.rowcount
+    finally:
+        cursor.execute('DROP TABLE IF EXISTS temp.template_faction_map')
+        cursor.execute('DROP TABLE IF EXISTS temp.template_region_map')
+
+    return {
+        'save_id': save_id,
+        'regions': region_count,
+        'factions': faction_count,
+        'characters': character_count
+    }
@@ -0,0 +1,145 @@
+"""
+提示词结果缓存
+
+世界创建界面里反复用同一段背景生成世界/势力/人物时，直接返回上次的结果，省去数秒的LLM调用。
+缓存键为 (配置ID, 模型, 温度, 规范化后的提示词哈希)，分两级：
+- 内存LRU，条目数有上限
+- 可选的SQLite持久层（prompt_cache表），带TTL，服务重启后仍然有效
+
+默认关闭，通过环境变量开启：
+    AI_PROMPT_CACHE=memory|sqlite   缓存级别（默认off）
+    AI_PROMPT_CACHE_SIZE=256        内存条目上限
+    AI_PROMPT_CACHE_TTL=86400       持久层有效期（秒）
+"""
+
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import database
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_prompt(text: str) -> str:
+    """去掉缩进和多余空白，只有排版不同的提示词得到同一个键"""
+    return _WHITESPACE.sub(' ', text or '').strip()
+
+
+class PromptCache:
+    """内存LRU + 可选SQLite持久层的LLM响应缓存，线程安全"""
+
+    # 每写入多少次清理一次过期的持久层条目
+    PRUNE_EVERY = 100
+
+    def __init__(self, mode: str = 'off', max_entries: int = 256, ttl: float = 86400):
+        if mode not in ('off', 'memory', 'sqlite'):
+            raise ValueError(f'未知的缓存模式: {mode}')
+        self.mode = mode
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bypassed = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            mode=os.environ.get('AI_PROMPT_CACHE', 'off'),
+            max_entries=int(os.environ.get('AI_PROMPT_CACHE_SIZE', '256')),
+            ttl=float(os.environ.get('AI_PROMPT_CACHE_TTL', '86400'))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'off'
+
+    @staticmethod
+    def make_key(config_id, model, temperature, messages) -> str:
+        """messages 为 (role, content) 序列"""
+        digest = hashlib.sha256()
+        digest.update(repr((config_id, model, temperature)).encode('utf-8'))
+        for role, content in messages:
+            digest.update(b'\x00' + role.encode('utf-8') + b'\x00')
+            digest.update(normalize_prompt(content).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """命中时返回缓存的响应文本，否则返回None"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return self._entries[key]
+
+        if self.mode == 'sqlite':
+            conn = database.connect()
+            try:
+                row = conn.execute('SELECT response FROM prompt_cache WHERE key = ? AND created_at >= ?',
+                                   (key, time.time() - self.ttl)).fetchone()
+            finally:
+                conn.close()
+            if row is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, row[0])
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, response: str):
+        """写入缓存；持久层通过写队列异步写入，不阻塞请求"""
+        with self._lock:
+            self._remember(key, response)
+            self.stores += 1
+            prune = self.stores % self.PRUNE_EVERY == 0
+
+        if self.mode == 'sqlite':
+            now = time.time()
+
+            def write(conn):
+                conn.execute('INSERT OR REPLACE INTO prompt_cache (key, response, created_at) VALUES (?, ?, ?)',
+                             (key, response, now))
+                if prune:
+                    conn.execute('DELETE FROM prompt_cache WHERE created_at < ?', (now - self.ttl,))
+
+            database.submit_write(write)
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def _remember(self, key, response):
+        self._entries[key] = response
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空内存缓存（持久层按TTL自然过期）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'mode': self.mode,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                'stores': self.stores,
+                'bypassed': self.bypassed
+            }
@@ -0,0 +1,198 @@
+"""
+模拟天数的提示词上下文构建
+
+原来的做法把所有势力、人物、地区用 json.dumps(indent=2) 整个塞进提示词，
+提示词长度（以及延迟和费用）随世界规模线性增长，人物多了以后会超出模型的上下文长度。
+
+build_simulation_context 按token预算构建上下文：
+- 每个实体一行紧凑JSON，不带缩进
+- 按与故事引导、最近事件的相关度给实体打分：名字出现在引导或最近事件中、
+  描述与引导有共同词、全文检索（retrieval.py）排名靠前、所属势力相关度高的排在前面
+- 按分数从高到低放入，直到用完预算；未放入的实体数量写在对应段末尾，
+  并在报告中返回各类实体放入/省略的数量
+
+预算通过环境变量 AI_SIMULATE_PROMPT_TOKENS 配置（整个提示词的token数，默认12000）。
+"""
+
+import os
+import json
+
+import retrieval
+from rate_limit import estimate_tokens
+
+DEFAULT_BUDGET = int(os.environ.get('AI_SIMULATE_PROMPT_TOKENS', '12000'))
+
+# 参与相关度计算的最近事件条数
+RECENT_EVENT_LIMIT = 50
+
+# 一个实体序列化后至少占用的token数
+_MIN_LINE_TOKENS = 16
+# 段末“另有N个未列出”说明占用的token数
+_NOTE_TOKENS = 24
+
+
+_SECTIONS = (
+    ('factions', '势力情况', '势力'),
+    ('characters', '人物情况', '人物'),
+    ('regions', '地区情况', '地区'),
+)
+
+
+def faction_entry(f) -> dict:
+    return {'id': f[0], 'name': f[2], 'status': f[6],
+            'description': f[5] if len(f) > 5 else '',
+            'power_level': f[7] if len(f) > 7 else 50,
+            'headquarters': f[8] if len(f) > 8 else '未知'}
+
+
+def character_entry(c, faction_names: dict) -> dict:
+    return {'id': c[0], 'name': c[3], 'status': c[4],
+            'faction_id': c[2],
+            'faction_name': faction_names.get(c[2]),
+            'personality': c[5] if len(c) > 5 else '',
+            'age': c[7] if len(c) > 7 else 0,
+            'position': c[9] if len(c) > 9 else '',
+            'realm': c[10] if len(c) > 10 else '',
+            'location': c[8] if len(c) > 8 else '未知'}
+
+
+def region_entry(r) -> dict:
+    return {'id': r[0], 'name': r[2], 'type': r[3],
+            'description': r[6] if len(r) > 6 else '',
+            'faction_id': r[5] if len(r) > 5 else None}
+
+
+def _compact(entry) -> str:
+    return json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+
+
+def _score(entry, text, story_guide, guide_terms, recent_text):
+    """名字出现在引导中 +20，每次出现在最近事件中 +5（最多3次），与引导每有一个共同词 +1
+
+    直接点名的实体分数远高于只有共同词的实体，保证它们最先放入。
+    """
+    name = entry.get('name') or ''
+    score = 0.0
+    if name:
+        if name in story_guide:
+            score += 20
+        score += 5 * min(recent_text.count(name), 3)
+    # 引导的检索词很少，逐个在实体文本中查找比切分实体文本快得多
+    score += sum(1 for term in guide_terms if term in text)
+    return score
+
+
+def build_simulation_context(factions, characters, regions, story_guide: str = '', recent_events=(),
+                             budget: int = None, reserved_tokens: int = 0, relevance: dict = None):
+    """按token预算构建势力/人物/地区上下文
+
+    Args:
+        factions/characters/regions: 数据库行
+        recent_events: 最近事件（含 title、description），用于相关度计算
+        budget: 整个提示词的token预算，None使用 DEFAULT_BUDGET
+        reserved_tokens: 提示词中其余部分（系统提示、引导语等）已占用的token数
+        relevance: retrieval.relevance() 的检索结果 {(类型, ID): 0~10}，叠加到实体分数上
+
+    Returns:
+        (context, report)：context 为上下文文本，report 为各类实体放入/省略数量及token用量
+    """
+    budget = DEFAULT_BUDGET if budget is None else budget
+    relevance = relevance or {}
+    story_guide = story_guide or ''
+    guide_terms = retrieval.text_terms(story_guide)
+    recent_text = '\n'.join(f"{e.get('title', '')} {e.get('description', '')}" for e in recent_events or ())
+
+    faction_names = {f[0]: f[2] for f in factions}
+    candidates = []  # (分数, 段, 原始顺序, 实体)
+
+    faction_scores = {}
+    for order, f in enumerate(factions):
+        entry = faction_entry(f)
+        text = f"{entry['name']} {entry['status'] or ''} {entry['description'] or ''}"
+        score = _score(entry, text, story_guide, guide_terms, recent_text)
+        score += relevance.get(('faction', entry['id']), 0)
+        faction_scores[entry['id']] = score
+        # 势力数量少且是人物/地区的归属，同等相关度下优先，实力强的靠前
+        candidates.append((score + 2 + (entry['power_level'] or 0) / 50, 'factions', order, entry))
+
+    for order, c in enumerate(characters):
+        entry = character_entry(c, faction_names)
+        text = f"{entry['name']} {entry['status'] or ''} {entry['personality'] or ''} {entry['position'] or ''} " \
+               f"{entry['realm'] or ''} {entry['location'] or ''}"
+        score = _score(entry, text, story_guide, guide_terms, recent_text)
+        score += relevance.get(('character', entry['id']), 0)
+        score += 0.2 * faction_scores.get(entry['faction_id'], 0)
+        candidates.append((score, 'characters', order, entry))
+
+    for order, r in enumerate(regions):
+        entry = region_entry(r)
+        text = f"{entry['name']} {entry['type'] or ''} {entry['description'] or ''}"
+        score = _score(entry, text, story_guide, guide_terms, recent_text)
+        score += relevance.get(('region', entry['id']), 0)
+        score += 0.2 * faction_scores.get(entry['faction_id'], 0)
+        candidates.append((score, 'regions', order, entry))
+
+    # 分数相同时保持原始顺序
+    candidates.sort(key=lambda item: (-item[0], item[2]))
+
+    headers = {key: f'### {title}（每行一个JSON对象）' for key, title, _ in _SECTIONS}
+    # 每段预留标题和“另有N个未列出”说明的位置
+    available = budget - reserved_tokens - sum(estimate_tokens(h) + _NOTE_TOKENS for h in headers.values())
+    selected = {key: [] for key, _, _ in _SECTIONS}
+    totals = {'factions': len(factions), 'characters': len(characters), 'regions': len(regions)}
+    used = 0
+    for _, section, order, entry in candidates:
+        # 剩余预算连一行最短的实体都放不下时停止，后面的实体不必再序列化
+        if available - used < _MIN_LINE_TOKENS:
+            break
+        line = _compact(entry)
+        cost = estimate_tokens(line) + 1
+        if used + cost > available:
+            continue
+        used += cost
+        selected[section].append((order, line))
+
+    parts = []
+    for key, _, label in _SECTIONS:
+        lines = [line for _, line in sorted(selected[key])]
+        omitted = totals[key] - len(lines)
+        parts.append(headers[key])
+        parts.extend(lines)
+        if omitted:
+            parts.append(f'（另有{omitted}个{label}与本次引导关系较小，未列出）')
+    context = '\n'.join(parts)
+
+    report = {
+        'budget': budget,
+        'reserved_tokens': reserved_tokens,
+        'context_tokens': estimate_tokens(context),
+        'prompt_tokens': reserved_tokens + estimate_tokens(context),
+        'included': {key: len(selected[key]) for key in selected},
+        'omitted': {key: totals[key] - len(selected[key]) for key in selected}
+    }
+    return context, report
+
+
+def previous_day_text(result: dict) -> str:
+    """上一天模拟结果的变化摘要，逐天模拟时放入下一天的提示词，让剧情在相邻两天之间衔接
+
+    只列出摘要、事件标题和发生变化的势力/人物，不重复完整描述（最新状态已在实体上下文中）。
+    """
+    if not result:
+        return ''
+    lines = ['### 上一天的变化']
+    if result.get('new_time'):
+        lines.append(f"时间：{result['new_time']}")
+    if result.get('summary'):
+        lines.append(f"摘要：{result['summary']}")
+    for key, label in (('world_events', '世界事件'), ('faction_events', '势力事件'),
+                       ('character_events', '人物事件')):
+        for event in result.get(key) or []:
+            if event.get('title'):
+                lines.append(f"- {label}：{event['title']}")
+    for key, label in (('faction_updates', '势力'), ('character_updates', '人物')):
+        for update in result.get(key) or []:
+            name = update.get('name') or f"#{update.get('faction_id' if key == 'faction_updates' else 'character_id')}"
+            action = '新出现' if update.get('action') == 'create' else '变化'
+            lines.append(f"- {label}{action}：{name} {update.get('status') or ''}".rstrip())
+    return '\n'.join(lines)
@@ -0,0 +1,346 @@
+"""
+LLM调用限流与重试
+
+很多用户同时模拟/聊天时请求会一起涌向模型服务商，超出配额后返回429，
+引擎捕获异常后退回默认数据，吞吐量反而崩溃。这里按AI配置分别限制：
+- 并发数：同时进行的调用（流式调用持续占用直到结束）
+- 每分钟请求数 / 每分钟token数：令牌桶，token数按提示词长度+max_tokens预估，
+  响应返回实际用量后多退少补
+超出限制的调用排队等待，等待超过上限时抛出 RateLimitTimeout；
+429和5xx错误按带抖动的指数退避重试，服务商返回 Retry-After 时至少等待该时长。
+异步调用（aslot/abefore_retry）与同步调用共用同一份计数，排队时让出事件循环而不是阻塞线程，
+名额释放时跨线程唤醒事件循环中的等待者。
+
+默认值可通过环境变量调整，单个配置可在 ai_configs 中单独设置（NULL表示使用默认值，0表示不限）：
+    AI_MAX_CONCURRENCY=0          每个配置的最大并发数
+    AI_REQUESTS_PER_MINUTE=0      每分钟请求数
+    AI_TOKENS_PER_MINUTE=0        每分钟token数
+    AI_LIMIT_MAX_WAIT=60          排队等待上限（秒）
+    AI_MAX_RETRIES=4              429/5xx最大重试次数
+    AI_RETRY_BASE_DELAY=1         退避基准时长（秒）
+    AI_RETRY_MAX_DELAY=30         单次退避上限（秒）
+"""
+
+import os
+import re
+import time
+import random
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get('AI_MAX_CONCURRENCY', '0'))
+DEFAULT_REQUESTS_PER_MINUTE = int(os.environ.get('AI_REQUESTS_PER_MINUTE', '0'))
+DEFAULT_TOKENS_PER_MINUTE = int(os.environ.get('AI_TOKENS_PER_MINUTE', '0'))
+MAX_WAIT = float(os.environ.get('AI_LIMIT_MAX_WAIT', '60'))
+MAX_RETRIES = int(os.environ.get('AI_MAX_RETRIES', '4'))
+RETRY_BASE_DELAY = float(os.environ.get('AI_RETRY_BASE_DELAY', '1'))
+RETRY_MAX_DELAY = float(os.environ.get('AI_RETRY_MAX_DELAY', '30'))
+
+_CJK = re.compile(r'[\u3000-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+# 网络层错误（未拿到HTTP状态码）也值得重试
+_RETRYABLE_ERRORS = ('APIConnectionError', 'APITimeoutError', 'ConnectError', 'ReadTimeout', 'RemoteProtocolError')
+
+
+class RateLimitTimeout(RuntimeError):
+    """排队等待超过上限"""
+
+
+def estimate_tokens(text: str) -> int:
+    """估算token数：汉字按每字一个token（偏保守），其余字符按4个一个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _status_code(error):
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status
+
+
+def is_retryable(error) -> bool:
+    """429、5xx和网络错误可以重试，其它错误（鉴权失败、参数错误等）直接抛出"""
+    status = _status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in _RETRYABLE_ERRORS
+
+
+def retry_after(error):
+    """读取服务商返回的 Retry-After（秒），没有时返回None"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, error=None) -> float:
+    """第attempt次重试前的等待时长：指数退避上限内随机取值（full jitter）"""
+    delay = random.uniform(RETRY_BASE_DELAY / 2, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    hinted = retry_after(error) if error is not None else None
+    if hinted is not None:
+        delay = max(delay, min(hinted, RETRY_MAX_DELAY))
+    return delay
+
+
+class TokenBucket:
+    """每分钟补充 rate 个令牌的令牌桶，rate为0表示不限"""
+
+    def __init__(self, rate_per_minute: int):
+        self.rate = rate_per_minute
+        self.tokens = float(rate_per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.rate, self.tokens + (now - self._updated) * self.rate / 60)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """取出amount个令牌还需等待的秒数，0表示现在就可以取；调用方需持有锁"""
+        if not self.rate:
+            return 0.0
+        self._refill(time.monotonic())
+        amount = min(amount, self.rate)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.rate
+
+    def take(self, amount: float):
+        if self.rate:
+            self.tokens -= min(amount, self.rate)
+
+    def adjust(self, delta: float):
+        """退还（正数）或补扣（负数）令牌，补扣后允许为负，之后的调用相应多等"""
+        if self.rate:
+            self._refill(time.monotonic())
+            self.tokens = min(self.rate, self.tokens + delta)
+
+
+class ProviderLimiter:
+    """单个AI配置的并发数 + 请求数/token数限流，线程安全"""
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE, max_wait: float = MAX_WAIT):
+        self._cond = threading.Condition()
+        # 异步等待者 {(事件循环, asyncio.Event)}，名额释放时跨线程唤醒
+        self._async_waiters = set()
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.requests = None
+        self.tokens = None
+        self.configure(max_concurrency, requests_per_minute, tokens_per_minute)
+
+    def configure(self, max_concurrency=None, requests_per_minute=None, tokens_per_minute=None):
+        """更新限额（None使用默认值），已在执行的调用不受影响
+
+        客户端每次重建都会调用，令牌桶只在速率变化时替换，否则重建一次就会把本分钟的额度重新填满。
+        """
+        requests_per_minute = DEFAULT_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute
+        tokens_per_minute = DEFAULT_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute
+        with self._cond:
+            self.max_concurrency = DEFAULT_MAX_CONCURRENCY if max_concurrency is None else max_concurrency
+            if self.requests is None or self.requests.rate != requests_per_minute:
+                self.requests = TokenBucket(requests_per_minute)
+            if self.tokens is None or self.tokens.rate != tokens_per_minute:
+                self.tokens = TokenBucket(tokens_per_minute)
+            self._notify()
+
+    def _notify(self):
+        """唤醒所有等待者；调用方需持有锁"""
+        self._cond.notify_all()
+        if not self._async_waiters:
+            return
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        for loop, waiter in self._async_waiters:
+            # 同一个事件循环中直接唤醒，避免跨线程唤醒的额外开销
+            if loop is current:
+                waiter.set()
+            else:
+                loop.call_soon_threadsafe(waiter.set)
+
+    def _wait_until(self, ready, deadline):
+        """等待ready()返回0；ready返回需要等待的秒数。调用方需持有锁"""
+        while True:
+            delay = ready()
+            if delay <= 0:
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.timeouts += 1
+                raise RateLimitTimeout(f'模型调用排队超过{self.max_wait:.0f}秒，请稍后再试')
+            self._cond.wait(min(delay, remaining))
+
+    @contextmanager
+    def slot(self, estimated_tokens: int = 0):
+        """占用一个调用名额，yield一个函数用于上报实际token用量"""
+        started = time.monotonic()
+        deadline = started + self.max_wait
+
+        def ready():
+            # 并发名额和令牌在同一次检查中判断，避免等令牌期间名额被别的调用占走
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                return self.max_wait
+            return max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+
+        with self._cond:
+            self.waiting += 1
+            try:
+                self._wait_until(ready, deadline)
+            finally:
+                self.waiting -= 1
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+            self.in_flight += 1
+            self.calls += 1
+            self.total_wait += time.monotonic() - started
+
+        def report_usage(actual_tokens):
+            if actual_tokens is not None:
+                with self._cond:
+                    self.tokens.adjust(estimated_tokens - actual_tokens)
+
+        try:
+            yield report_usage
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._notify()
+
+    @asynccontextmanager
+    async def aslot(self, estimated_tokens: int = 0):
+        """slot() 的异步版本：等待时让出事件循环，名额释放或令牌补足时继续"""
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+
+        def ready():
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                return self.max_wait
+            return max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+
+        with self._cond:
+            self.waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    delay = ready()
+                    if delay <= 0:
+                        self.requests.take(1)
+                        self.tokens.take(estimated_tokens)
+                        self.in_flight += 1
+                        self.calls += 1
+                        self.total_wait += time.monotonic() - started
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise RateLimitTimeout(f'模型调用排队超过{self.max_wait:.0f}秒，请稍后再试')
+                    # 在锁内登记，检查之后释放的名额也能唤醒这里
+                    waiter[1].clear()
+                    self._async_waiters.add(waiter)
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), min(delay, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with self._cond:
+                        self._async_waiters.discard(waiter)
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+        def report_usage(actual_tokens):
+            if actual_tokens is not None:
+                with self._cond:
+                    self.tokens.adjust(estimated_tokens - actual_tokens)
+
+        try:
+            yield report_usage
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._notify()
+
+    async def abefore_retry(self, attempt: int, error):
+        """before_retry() 的异步版本"""
+        with self._cond:
+            self.retries += 1
+            if _status_code(error) == 429:
+                self.throttled += 1
+        await asyncio.sleep(backoff_delay(attempt, error))
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            with self._cond:
+                delay = self.requests.wait_time(1)
+                if delay <= 0:
+                    self.requests.take(1)
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise RateLimitTimeout(f'模型调用排队超过{self.max_wait:.0f}秒，请稍后再试')
+            await asyncio.sleep(min(delay, remaining))
+
+    def before_retry(self, attempt: int, error):
+        """重试前退避并重新占用一个请求名额（重试同样计入每分钟请求数）"""
+        with self._cond:
+            self.retries += 1
+            if _status_code(error) == 429:
+                self.throttled += 1
+        time.sleep(backoff_delay(attempt, error))
+        deadline = time.monotonic() + self.max_wait
+        with self._cond:
+            self._wait_until(lambda: self.requests.wait_time(1), deadline)
+            self.requests.take(1)
+
+    def call(self, func, estimated_tokens: int = 0, usage=None):
+        """在限流名额内调用func，可重试的错误按退避策略重试
+
+        usage 接收func的返回值并返回实际token数（未知时返回None）。
+        """
+        with self.slot(estimated_tokens) as report_usage:
+            attempt = 0
+            while True:
+                try:
+                    result = func()
+                except Exception as e:
+                    if attempt >= MAX_RETRIES or not is_retryable(e):
+                        raise
+                    self.before_retry(attempt, e)
+                    attempt += 1
+                    continue
+                if usage is not None:
+                    report_usage(usage(result))
+                return result
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'requests_per_minute': self.requests.rate,
+                'tokens_per_minute': self.tokens.rate,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'calls': self.calls,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': round(self.total_wait / self.calls * 1000, 3) if self.calls else 0.0
+            }
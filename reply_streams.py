@@ -0,0 +1,360 @@
+"""
+可续传的流式回复
+
+原来 /api/chat-stream 直接在响应生成器里调用模型，连接一断生成就停了，已生成的内容也丢了，
+移动端网络切换时只能重新提问，整段回复重新计费。这里把生成和推送分开：
+- start() 在后台线程中调用模型，输出按顺序编号（从1开始）缓存在内存中，与HTTP连接无关
+- events() 按SSE协议推送缓存的输出，每个事件带 id；没有新输出时定期发送心跳注释，避免被代理断开
+- 客户端断线后带 Last-Event-ID 重新连接同一个流，从下一个事件继续推送，不会重新调用模型
+- 生成结束后缓存保留一段时间供续传，过期后清理
+- 异步服务（asgi.py）中用 start_async() 在事件循环中生成、aevents() 推送，等待新输出时不占用线程
+- 生成与连接无关，客户端主动停止（切换对话等）时需调用 cancel()，produce 检查 stream.cancelled 后停止调用模型，
+  已生成的部分照常由 on_finish 保存
+
+事件（data 为JSON）：
+    {"type": "start", "stream_id": ...}     流的第一个事件
+    {"type": "delta", "content": ...}       一段输出
+    {"type": "done"} / {"type": "error", "error": ...}   结束（被取消时为 {"type": "done", "cancelled": true}）
+
+环境变量：
+    AI_STREAM_WORKERS=16        同时生成的流数量上限（后台线程数）
+    AI_STREAM_MAX_PENDING=64    排队+生成中的流数量上限
+    AI_ASYNC_STREAM_MAX_PENDING=10000   事件循环中同时生成的流数量上限（异步服务）
+    AI_STREAM_HEARTBEAT=15      心跳间隔（秒）
+    AI_STREAM_RETENTION=300     生成结束后缓存的保留时间（秒）
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+STREAM_WORKERS = int(os.environ.get('AI_STREAM_WORKERS', '16'))
+STREAM_MAX_PENDING = int(os.environ.get('AI_STREAM_MAX_PENDING', '64'))
+ASYNC_MAX_PENDING = int(os.environ.get('AI_ASYNC_STREAM_MAX_PENDING', '10000'))
+HEARTBEAT_SECONDS = float(os.environ.get('AI_STREAM_HEARTBEAT', '15'))
+RETENTION_SECONDS = float(os.environ.get('AI_STREAM_RETENTION', '300'))
+
+# 客户端断线后的重连等待（毫秒），通过SSE的retry字段下发
+RECONNECT_MS = 2000
+
+
+class StreamLimitReached(RuntimeError):
+    """同时进行的流已达上限"""
+
+
+def format_event(payload: dict, event_id: int = None) -> str:
+    """一个SSE事件"""
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f"{head}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def parse_event_id(value) -> int:
+    """Last-Event-ID 请求头（或查询参数），无效时返回0（从头推送）"""
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class ReplyStream:
+    """一次生成的输出缓存，线程安全"""
+
+    def __init__(self, stream_id: str):
+        self.id = stream_id
+        self.events = [{'type': 'start', 'stream_id': stream_id}]
+        self.finished = False
+        self.finished_at = None
+        # 客户端要求停止生成，produce 看到后应尽快返回
+        self.cancelled = False
+        self._cond = threading.Condition()
+        # 异步等待者 {(事件循环, asyncio.Event)}，有新输出时跨线程唤醒
+        self._async_waiters = set()
+
+    def _notify(self):
+        """唤醒所有等待者；调用方需持有锁"""
+        self._cond.notify_all()
+        if not self._async_waiters:
+            return
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        for loop, waiter in self._async_waiters:
+            # 同一个事件循环中直接唤醒，避免跨线程唤醒的额外开销
+            if loop is current:
+                waiter.set()
+            else:
+                loop.call_soon_threadsafe(waiter.set)
+
+    def append(self, content: str):
+        if not content:
+            return
+        with self._cond:
+            self.events.append({'type': 'delta', 'content': content})
+            self._notify()
+
+    def finish(self, error: str = None):
+        with self._cond:
+            if self.finished:
+                return
+            if error:
+                self.events.append({'type': 'error', 'error': error})
+            elif self.cancelled:
+                self.events.append({'type': 'done', 'cancelled': True})
+            else:
+                self.events.append({'type': 'done'})
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    def cancel(self) -> bool:
+        """要求停止生成，已结束或已取消时返回False"""
+        with self._cond:
+            if self.finished or self.cancelled:
+                return False
+            self.cancelled = True
+            return True
+
+    def text(self) -> str:
+        """目前为止的完整输出"""
+        with self._cond:
+            return ''.join(event['content'] for event in self.events if event['type'] == 'delta')
+
+    def wait(self, after: int, timeout: float):
+        """返回编号大于after的事件 [(编号, 事件)]；暂时没有时最多等待timeout秒，超时返回空列表"""
+        with self._cond:
+            if len(self.events) <= after and not self.finished:
+                self._cond.wait(timeout)
+            return [(index + 1, event) for index, event in enumerate(self.events[after:], after)]
+
+    async def await_events(self, after: int, timeout: float):
+        """wait() 的异步版本"""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            if len(self.events) > after or self.finished:
+                return [(index + 1, event) for index, event in enumerate(self.events[after:], after)]
+            self._async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+        with self._cond:
+            return [(index + 1, event) for index, event in enumerate(self.events[after:], after)]
+
+
+class StreamRegistry:
+    """按流ID管理进行中和最近结束的流，生成在固定大小的线程池中执行"""
+
+    def __init__(self, workers: int = STREAM_WORKERS, max_pending: int = STREAM_MAX_PENDING,
+                 retention: float = RETENTION_SECONDS, max_async_pending: int = ASYNC_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_async_pending = max_async_pending
+        self.retention = retention
+        self._streams = {}
+        self._executor = None
+        # 事件循环中生成的任务，保持引用直到结束
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._async_pending = 0
+        self.started = 0
+        self.resumed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def _purge(self, now):
+        """清理过期的已结束流；调用方需持有锁"""
+        expired = [stream_id for stream_id, stream in self._streams.items()
+                   if stream.finished and now - stream.finished_at > self.retention]
+        for stream_id in expired:
+            del self._streams[stream_id]
+
+    def start(self, produce, on_finish=None) -> ReplyStream:
+        """在后台生成，立即返回流
+
+        Args:
+            produce: produce(stream) 调用模型并通过 stream.append() 写入输出
+            on_finish: on_finish(stream, error) 生成结束后调用（无论成败、客户端是否还在），用于保存结果
+        """
+        stream = self._reserve(False)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='reply-stream')
+            executor = self._executor
+        executor.submit(self._run, stream, produce, on_finish)
+        return stream
+
+    def start_async(self, produce, on_finish=None) -> ReplyStream:
+        """start() 的异步版本：在当前事件循环中生成，不占用线程
+
+        Args:
+            produce: async produce(stream)
+            on_finish: async on_finish(stream, error)
+        """
+        stream = self._reserve(True)
+        task = asyncio.get_running_loop().create_task(self._arun(stream, produce, on_finish))
+        with self._lock:
+            self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return stream
+
+    def _reserve(self, in_loop: bool) -> ReplyStream:
+        with self._lock:
+            self._purge(time.monotonic())
+            pending, limit = (self._async_pending, self.max_async_pending) if in_loop else \
+                (self._pending, self.max_pending)
+            if pending >= limit:
+                self.rejected += 1
+                raise StreamLimitReached(f'同时进行的回复已达上限（{limit}），请稍后再试')
+            if in_loop:
+                self._async_pending += 1
+            else:
+                self._pending += 1
+            self.started += 1
+            stream = ReplyStream(uuid.uuid4().hex)
+            self._streams[stream.id] = stream
+            return stream
+
+    def _run(self, stream, produce, on_finish):
+        error = None
+        try:
+            produce(stream)
+        except Exception as e:
+            print(f"流式生成 {stream.id} 出错: {e}")
+            traceback.print_exc()
+            error = str(e)
+            with self._lock:
+                self.failed += 1
+        finally:
+            try:
+                if on_finish is not None:
+                    on_finish(stream, error)
+            except Exception as e:
+                print(f"保存流式生成 {stream.id} 的结果失败: {e}")
+            stream.finish(error)
+            with self._lock:
+                self._pending -= 1
+
+    async def _arun(self, stream, produce, on_finish):
+        error = None
+        try:
+            await produce(stream)
+        except asyncio.CancelledError:
+            error = '服务停止，生成中断'
+            raise
+        except Exception as e:
+            print(f"流式生成 {stream.id} 出错: {e}")
+            traceback.print_exc()
+            error = str(e)
+            with self._lock:
+                self.failed += 1
+        finally:
+            try:
+                if on_finish is not None:
+                    await on_finish(stream, error)
+            except Exception as e:
+                print(f"保存流式生成 {stream.id} 的结果失败: {e}")
+            stream.finish(error)
+            with self._lock:
+                self._async_pending -= 1
+
+    def get(self, stream_id: str, resumed: bool = False):
+        """按ID取流，不存在或已过期时返回None"""
+        with self._lock:
+            self._purge(time.monotonic())
+            stream = self._streams.get(stream_id)
+            if stream is not None and resumed:
+                self.resumed += 1
+            return stream
+
+    def cancel(self, stream_id: str):
+        """客户端主动停止：标记流为已取消，produce 在下一段输出前停止；流不存在或已过期时返回None"""
+        stream = self.get(stream_id)
+        if stream is not None and stream.cancel():
+            with self._lock:
+                self.cancelled += 1
+        return stream
+
+    def shutdown(self, wait: bool = True):
+        """停止接收新的流，wait为True时等待生成中的流结束"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    async def drain(self, timeout: float = None):
+        """等待事件循环中生成的流结束，超时后取消剩余的流"""
+        with self._lock:
+            tasks = set(self._tasks)
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'max_async_pending': self.max_async_pending,
+                'async_pending': self._async_pending,
+                'buffered': len(self._streams),
+                'started': self.started,
+                'resumed': self.resumed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'cancelled': self.cancelled
+            }
+
+
+def events(stream: ReplyStream, last_event_id: int = 0, heartbeat: float = None):
+    """按SSE协议推送流中编号大于last_event_id的事件，直到结束事件；空闲时发送心跳"""
+    heartbeat = HEARTBEAT_SECONDS if heartbeat is None else heartbeat
+    yield f'retry: {RECONNECT_MS}\n\n'
+    after = last_event_id
+    while True:
+        batch = stream.wait(after, heartbeat)
+        if not batch:
+            if stream.finished:
+                # 续传时客户端已收到结束事件
+                return
+            yield ': ping\n\n'
+            continue
+        for event_id, event in batch:
+            yield format_event(event, event_id)
+            after = event_id
+            if event['type'] in ('done', 'error'):
+                return
+
+
+async def aevents(stream: ReplyStream, last_event_id: int = 0, heartbeat: float = None):
+    """events() 的异步版本"""
+    heartbeat = HEARTBEAT_SECONDS if heartbeat is None else heartbeat
+    yield f'retry: {RECONNECT_MS}\n\n'
+    after = last_event_id
+    while True:
+        batch = await stream.await_events(after, heartbeat)
+        if not batch:
+            if stream.finished:
+                return
+            yield ': ping\n\n'
+            continue
+        for event_id, event in batch:
+            yield format_event(event, event_id)
+            after = event_id
+            if event['type'] in ('done', 'error'):
+                return
@@ -0,0 +1,200 @@
+"""
+存档内容检索索引
+
+生成提示词时，需要从整个存档中挑出与故事引导/小说主题最相关的人物、势力、地区和历史事件，
+而不是把整个世界塞进去或随手取前几个。这里基于SQLite FTS5建立全文索引，按BM25排序：
+- search_index 表由迁移创建，基础表上的触发器在每次增删改时同步更新索引（增量，无需重建）
+- FTS5自带的unicode61分词器不切分中文，索引使用trigram分词（按连续三个字符），
+  查询时把文本切成相邻三字的词（"青云门弟子" -> "青云门 云门弟 门弟子"），任一命中即参与BM25排序。
+  触发器只用内置SQL函数，其它工具直接打开数据库写入也能正常维护索引
+- 不足三个字的词无法通过索引检索。人物、势力、地区的名称直接出现在查询中时（两个字的人名很常见），
+  按 instr() 在基础表中查出并排在检索结果之前
+- 索引行的rowid由 (基础表ID, 类型编号) 组成，更新和删除都按rowid定位
+
+用法：
+    retrieval.search(conn, save_id, '青云门弟子下山历练', kinds=('character',), limit=8)
+"""
+
+import re
+
+# 类型 -> rowid中的类型编号（rowid = 基础表ID * 8 + 编号），与迁移中的触发器保持一致
+KIND_CODES = {
+    'character': 1,
+    'faction': 2,
+    'region': 3,
+    'worldevent': 4,
+    'factionevent': 5,
+    'characterevent': 6,
+}
+_CODE_KINDS = {code: kind for kind, code in KIND_CODES.items()}
+
+EVENT_KINDS = ('worldevent', 'factionevent', 'characterevent')
+
+# 事件类型 -> (表名, 时间线中的类型名)
+_EVENT_TABLES = {
+    'worldevent': ('world_events', 'world'),
+    'factionevent': ('faction_events', 'faction'),
+    'characterevent': ('character_events', 'character'),
+}
+
+# 按名称直接匹配的类型 -> (表名, 名称列)
+_NAME_TABLES = {
+    'character': ('characters', 'name'),
+    'faction': ('factions', 'name'),
+    'region': ('map_regions', 'name'),
+}
+
+# 一次查询最多使用的检索词数量
+MAX_QUERY_TERMS = 64
+
+_CJK_RUN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]+')
+_WORD = re.compile(r'[A-Za-z0-9]+')
+
+
+def _split(text):
+    """汉字按相邻两字切分，字母数字按单词（转小写）"""
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            yield run
+        else:
+            for i in range(len(run) - 1):
+                yield run[i:i + 2]
+    for word in _WORD.findall(text):
+        yield word.lower()
+
+
+def text_terms(text: str) -> set:
+    """文本的检索词集合"""
+    return set(_split(text)) if text else set()
+
+
+def query_terms(text: str) -> list:
+    """查询用的检索词：汉字按相邻三字切分，字母数字按单词（转小写），不足三个字符的丢弃"""
+    terms = set()
+    for run in _CJK_RUN.findall(text or ''):
+        terms.update(run[i:i + 3] for i in range(len(run) - 2))
+    terms.update(word for word in _WORD.findall((text or '').lower()) if len(word) >= 3)
+    return sorted(terms)
+
+
+def _match_expression(save_id, query, kinds):
+    terms = query_terms(query)[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    # trigram按子串匹配，save_key/kind 写入时以 "." 结尾（见迁移8），查询时带上才不会误配
+    expression = f'save_key:"s{int(save_id)}."'
+    if kinds:
+        expression += ' AND kind:(' + ' OR '.join(f'"{kind}."' for kind in kinds) + ')'
+    return expression + ' AND {name body}:(' + ' OR '.join(f'"{term}"' for term in terms) + ')'
+
+
+def _name_hits(conn, save_id, query, kinds, limit):
+    """名称出现在query中的实体 [(类型, ID, 名称长度)]，名称长的在前"""
+    hits = []
+    for kind in kinds or KIND_CODES:
+        if kind not in _NAME_TABLES:
+            continue
+        table, column = _NAME_TABLES[kind]
+        hits.extend((kind, ref_id, length) for ref_id, length in conn.execute(f'''
+            SELECT id, length({column}) FROM {table}
+            WHERE save_id = ? AND length({column}) >= 2 AND instr(?, {column}) > 0
+        ''', (save_id, query)))
+    hits.sort(key=lambda hit: -hit[2])
+    return hits[:limit]
+
+
+def search(conn, save_id: int, query: str, kinds=None, limit: int = 10):
+    """检索存档内与query最相关的条目
+
+    Args:
+        kinds: 限定的类型（KIND_CODES中的键），None表示全部
+        limit: 最多返回条数
+
+    Returns:
+        List: [(类型, 基础表ID, 相关度)]，相关度越大越相关；名称出现在query中的实体排在最前
+    """
+    names = _name_hits(conn, save_id, query, kinds, limit) if query else []
+    expression = _match_expression(save_id, query, kinds)
+    rows = []
+    if expression is not None:
+        # 名称命中的权重是描述的3倍；save_key/kind只用于过滤，不参与打分
+        rows = conn.execute('''
+            SELECT rowid, bm25(search_index, 0.0, 0.0, 3.0, 1.0) AS rank
+            FROM search_index WHERE search_index MATCH ? ORDER BY rank LIMIT ?
+        ''', (expression, limit)).fetchall()
+    results = [(_CODE_KINDS[rowid % 8], rowid // 8, -rank) for rowid, rank in rows]
+    if not names:
+        return results
+    # 名称命中的相关度高于所有检索结果，名称越长越靠前
+    top = max((score for _, _, score in results), default=0.0)
+    named = {(kind, ref_id) for kind, ref_id, _ in names}
+    return ([(kind, ref_id, top + length) for kind, ref_id, length in names] +
+            [result for result in results if result[:2] not in named])[:limit]
+
+
+def rank_ids(conn, save_id: int, query: str, kind: str, limit: int):
+    """按相关度返回某一类型的ID列表"""
+    return [ref_id for _, ref_id, _ in search(conn, save_id, query, (kind,), limit)]
+
+
+def pick(items, ranked_ids, limit: int, key='id'):
+    """从items中选出limit个：先按检索结果的顺序，不足时按原顺序补齐
+
+    items 为字典列表时key是字段名，为数据库行时key是列下标。
+    """
+    by_id = {item[key]: item for item in items}
+    chosen = [by_id[ref_id] for ref_id in ranked_ids if ref_id in by_id][:limit]
+    if len(chosen) < limit:
+        seen = {item[key] for item in chosen}
+        chosen += [item for item in items if item[key] not in seen][:limit - len(chosen)]
+    return chosen
+
+
+def relevance(conn, save_id: int, query: str, limit: int = 200) -> dict:
+    """{(类型, ID): 0~10的相关度}，用于与其它排序依据叠加"""
+    results = search(conn, save_id, query, ('character', 'faction', 'region'), limit)
+    if not results:
+        return {}
+    best = max(score for _, _, score in results) or 1.0
+    return {(kind, ref_id): 10 * score / best for kind, ref_id, score in results}
+
+
+def prompt_events(conn, save_id: int, query: str, recent: int = 5, relevant: int = 5):
+    """提示词中的历史事件：与query最相关的至多 relevant 条，其余用最近的事件补足 recent + relevant 条，
+    按天数倒序。没有相关事件时与原先“最近10条事件”相同。
+
+    Returns:
+        List: [(类型, 天数, 时间段, 标题, 描述)]，与原先“最近10条事件”查询的行格式相同
+    """
+    total = recent + relevant
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT 'world' as type, id, day, time_period, event_title, event_description, created_at FROM world_events
+        WHERE save_id = ?
+        UNION ALL
+        SELECT 'faction' as type, id, day, time_period, event_title, event_description, created_at FROM faction_events
+        WHERE save_id = ?
+        UNION ALL
+        SELECT 'character' as type, id, day, time_period, event_title, event_description, created_at
+        FROM character_events WHERE save_id = ?
+        ORDER BY day DESC, created_at DESC
+        LIMIT ?
+    ''', (save_id, save_id, save_id, total))
+    latest = {(row[0], row[1]): row for row in cursor.fetchall()}
+
+    rows = {}
+    for kind, ref_id, _ in search(conn, save_id, query, EVENT_KINDS, relevant):
+        table, event_type = _EVENT_TABLES[kind]
+        row = latest.get((event_type, ref_id)) or cursor.execute(f'''
+            SELECT '{event_type}' as type, id, day, time_period, event_title, event_description, created_at
+            FROM {table} WHERE id = ?
+        ''', (ref_id,)).fetchone()
+        if row:
+            rows[(event_type, ref_id)] = row
+    for key, row in latest.items():
+        if len(rows) >= total:
+            break
+        rows.setdefault(key, row)
+
+    ordered = sorted(rows.values(), key=lambda row: (row[2] or 0, row[6] or ''), reverse=True)
+    return [(row[0], row[2], row[3], row[4], row[5] or '') for row in ordered]
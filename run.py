@@ -7,7 +7,6 @@ AI沙盒游戏启动脚本
 
 import os
 import sys
-import signal
 import socket
 from contextlib import closing
 
@@ -29,15 +28,8 @@ def find_free_port(start_port=5099, max_attempts=10):
             return port
     return None
 
-def signal_handler(sig, frame):
-    """处理中断信号"""
-    print('\n正在关闭应用...')
-    sys.exit(0)
-
 if __name__ == '__main__':
-    # 注册信号处理器
-    signal.signal(signal.SIGINT, signal_handler)
-    
+    # Ctrl+C 由服务器处理：停止接收新连接，等待进行中的请求结束后退出
     print("=" * 50)
     print("AI沙盒游戏启动器")
     print("=" * 50)
@@ -55,28 +47,16 @@ if __name__ == '__main__':
         print(f"✅ 端口{port}可用")
         print("🚀 正在启动应用...")
         
-        # 导入并启动应用
-        from app import app, init_db
-        
-        # 初始化数据库
-        print("📄 初始化数据库...")
-        init_db()
+        # 生产服务器（uvicorn），启动前完成数据库迁移并加载应用，见 serve.py
+        import serve
         
-        print("🌐 DeepSeek API已配置")
         print(f"🔗 本地访问: http://localhost:{port}")
         print(f"🔗 网络访问: http://0.0.0.0:{port}")
+        print(f"⚙️  工作进程: {serve.WORKERS}  线程: {serve.THREADS}（GAME_WORKERS / GAME_WSGI_THREADS）")
         print("=" * 50)
-        print("按 Ctrl+C 停止服务器")
+        print("按 Ctrl+C 停止服务器（会等待生成中的回复和后台任务结束）")
         
-        # 启动Flask应用
-        app.run(
-            debug=True,
-            host='0.0.0.0',
-            port=port,
-            threaded=True,
-            use_reloader=False,  # 禁用自动重载
-            use_debugger=True
-        )
+        serve.serve(host='0.0.0.0', port=port)
         
     except KeyboardInterrupt:
         print("\n👋 应用已停止")
@@ -0,0 +1,306 @@
+"""
+分段加载存档
+
+/api/saves/<id>/load 的数据按段（section）拆分，每段一个查询，客户端通过
+?include=save,factions,characters 只取需要的部分：
+- 事件列表按 (day, created_at, id) 键集分页，每段返回各自的 next_cursor
+- 人物默认只返回列表展示用的摘要字段，完整字段通过单个人物接口按需加载
+
+不带 include 参数时返回全部数据，与原接口完全一致。
+"""
+
+import json
+
+import timeline
+
+SECTIONS = (
+    'save', 'regions', 'factions', 'faction_relationships', 'characters',
+    'character_relationships', 'world_events', 'faction_events', 'character_events', 'generation_logs'
+)
+
+# 事件段 -> 时间线中的事件类型（复用时间线的游标格式）
+EVENT_SECTIONS = {
+    'world_events': 'world',
+    'faction_events': 'faction',
+    'character_events': 'character',
+}
+
+# 人物列表展示所需字段，其余（装备、技能、经历等）按需加载
+CHARACTER_SUMMARY_FIELDS = (
+    'id', 'faction_id', 'name', 'status', 'personality', 'age', 'location', 'position', 'realm', 'goals',
+    'faction_name'
+)
+
+_CHARACTER_SQL = '''
+    SELECT c.*, f.name as faction_name
+    FROM characters c
+    LEFT JOIN factions f ON c.faction_id = f.id
+    WHERE c.save_id = ?
+'''
+
+_EVENT_SQL = {
+    'world_events': '''
+        SELECT we.*, f.name as faction_name, mr.name as region_name
+        FROM world_events we
+        LEFT JOIN factions f ON we.faction_id = f.id
+        LEFT JOIN map_regions mr ON we.region_id = mr.id
+        WHERE we.save_id = ?{cursor_clause} ORDER BY we.day DESC{order_tail}
+    ''',
+    'faction_events': '''
+        SELECT fe.*, f.name as faction_name
+        FROM faction_events fe
+        JOIN factions f ON fe.faction_id = f.id
+        WHERE fe.save_id = ?{cursor_clause} ORDER BY fe.day DESC{order_tail}
+    ''',
+    'character_events': '''
+        SELECT ce.*, c.name as character_name
+        FROM character_events ce
+        JOIN characters c ON ce.character_id = c.id
+        WHERE ce.save_id = ?{cursor_clause} ORDER BY ce.day DESC{order_tail}
+    ''',
+}
+
+_EVENT_ALIAS = {'world_events': 'we', 'faction_events': 'fe', 'character_events': 'ce'}
+
+# 各事件表中 day、created_at 的列位置，用于生成分页游标
+_EVENT_KEY_COLUMNS = {'world_events': (2, 9), 'faction_events': (3, 8), 'character_events': (3, 8)}
+
+
+def parse_include(include: str = None):
+    """解析include参数，为空时返回全部段"""
+    if not include:
+        return list(SECTIONS)
+    selected = [s.strip() for s in include.split(',') if s.strip()]
+    unknown = [s for s in selected if s not in SECTIONS]
+    if unknown:
+        raise ValueError(f"未知的数据段: {', '.join(unknown)}")
+    return [s for s in SECTIONS if s in selected]
+
+
+def _character_dict(c):
+    return {
+        'id': c[0],
+        'faction_id': c[2],
+        'name': c[3],
+        'status': c[4],
+        'personality': c[5],
+        'birthday': c[6],
+        'age': c[7],
+        'location': c[8],
+        'position': c[9],
+        'realm': c[10],
+        'lifespan': c[11],
+        'equipment': json.loads(c[12]) if c[12] else [],
+        'skills': json.loads(c[13]) if c[13] else [],
+        'experience': c[14],
+        'goals': c[15],
+        'relationships': c[16],
+        'faction_name': c[18] if len(c) > 18 else None
+    }
+
+
+def _event_dict(section, e):
+    if section == 'world_events':
+        return {
+            'id': e[0],
+            'day': e[2],
+            'time_period': e[3],
+            'faction_id': e[4],
+            'theme': e[5],
+            'title': e[6],
+            'description': e[7],
+            'region_id': e[8],
+            'faction_name': e[10] if len(e) > 10 else None,
+            'region_name': e[11] if len(e) > 11 else None
+        }
+    if section == 'faction_events':
+        return {
+            'id': e[0],
+            'faction_id': e[2],
+            'day': e[3],
+            'time_period': e[4],
+            'theme': e[5],
+            'title': e[6],
+            'description': e[7],
+            'faction_name': e[9] if len(e) > 9 else None
+        }
+    return {
+        'id': e[0],
+        'character_id': e[2],
+        'day': e[3],
+        'time_period': e[4],
+        'theme': e[5],
+        'title': e[6],
+        'description': e[7],
+        'character_name': e[9] if len(e) > 9 else None
+    }
+
+
+def _load_events(cursor, save_id, section, limit=None, page_cursor=None):
+    """读取一段事件；limit为None时不分页（原接口行为）"""
+    if limit is None:
+        cursor.execute(_EVENT_SQL[section].format(cursor_clause='', order_tail=''), (save_id,))
+        return [_event_dict(section, e) for e in cursor.fetchall()], None
+
+    alias = _EVENT_ALIAS[section]
+    params = [save_id]
+    cursor_clause = ''
+    if page_cursor:
+        day, created_at, event_id, _ = timeline.decode_cursor(page_cursor)
+        cursor_clause = f' AND ({alias}.day, {alias}.created_at, {alias}.id) < (?, ?, ?)'
+        params += [day, created_at, event_id]
+    order_tail = f', {alias}.created_at DESC, {alias}.id DESC LIMIT ?'
+    params.append(limit + 1)
+
+    cursor.execute(_EVENT_SQL[section].format(cursor_clause=cursor_clause, order_tail=order_tail), params)
+    rows = cursor.fetchall()
+    events = [_event_dict(section, e) for e in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        day_col, created_col = _EVENT_KEY_COLUMNS[section]
+        next_cursor = timeline.encode_cursor({'day': last[day_col], 'created_at': last[created_col],
+                                              'id': last[0], 'type': EVENT_SECTIONS[section]})
+    return events, next_cursor
+
+
+def load_character(conn, save_id: int, character_id: int):
+    """读取单个人物的完整信息，不存在时返回None"""
+    cursor = conn.cursor()
+    cursor.execute(_CHARACTER_SQL + ' AND c.id = ?', (save_id, character_id))
+    row = cursor.fetchone()
+    return _character_dict(row) if row else None
+
+
+def load_save_sections(conn, save_id: int, include=None, character_detail: bool = True,
+                       events_limit: int = None, event_cursors: dict = None):
+    """按段读取存档数据
+
+    Args:
+        include: 需要的段列表，None表示全部
+        character_detail: False时人物只返回 CHARACTER_SUMMARY_FIELDS
+        events_limit: 每个事件段的条数，None表示不分页
+        event_cursors: {段名: 上一页返回的游标}
+
+    Returns:
+        Dict: 各段数据，分页的事件段额外带 <段名>_next_cursor；存档不存在时返回None
+    """
+    include = include or list(SECTIONS)
+    event_cursors = event_cursors or {}
+    cursor = conn.cursor()
+
+    cursor.execute('SELECT * FROM saves WHERE id = ?', (save_id,))
+    save = cursor.fetchone()
+    if not save:
+        return None
+
+    data = {}
+    if 'save' in include:
+        data['save'] = {
+            'id': save[0],
+            'name': save[1],
+            'world_background': save[4],
+            'world_introduction': save[5],
+            'cultivation_system': save[6],
+            'map_data': json.loads(save[7]) if save[7] else {},
+            'current_day': save[8],
+            'current_time': save[9]
+        }
+
+    if 'regions' in include:
+        cursor.execute('SELECT * FROM map_regions WHERE save_id = ?', (save_id,))
+        data['regions'] = [{
+            'id': r[0],
+            'name': r[2],
+            'type': r[3],
+            'parent_id': r[4],
+            'faction_id': r[5],
+            'description': r[6]
+        } for r in cursor.fetchall()]
+
+    if 'factions' in include:
+        cursor.execute('SELECT * FROM factions WHERE save_id = ?', (save_id,))
+        data['factions'] = [{
+            'id': f[0],
+            'name': f[2],
+            'ideal': f[3],
+            'background': f[4],
+            'description': f[5],
+            'status': f[6],
+            'power_level': f[7],
+            'headquarters_location': f[8]
+        } for f in cursor.fetchall()]
+
+    if 'faction_relationships' in include:
+        cursor.execute('''
+            SELECT fr.*, f1.name as faction1_name, f2.name as faction2_name
+            FROM faction_relationships fr
+            JOIN factions f1 ON fr.faction1_id = f1.id
+            JOIN factions f2 ON fr.faction2_id = f2.id
+            WHERE fr.save_id = ?
+        ''', (save_id,))
+        data['faction_relationships'] = [{
+            'id': fr[0],
+            'faction1_id': fr[2],
+            'faction2_id': fr[3],
+            'relationship_type': fr[4],
+            'description': fr[5],
+            'faction1_name': fr[6],
+            'faction2_name': fr[7]
+        } for fr in cursor.fetchall()]
+
+    if 'characters' in include:
+        if character_detail:
+            cursor.execute(_CHARACTER_SQL, (save_id,))
+            data['characters'] = [_character_dict(c) for c in cursor.fetchall()]
+        else:
+            # 摘要模式不读取装备/技能等大字段，也省去JSON解码
+            cursor.execute('''
+                SELECT c.id, c.faction_id, c.name, c.status, c.personality, c.age, c.location,
+                       c.position, c.realm, c.goals, f.name as faction_name
+                FROM characters c
+                LEFT JOIN factions f ON c.faction_id = f.id
+                WHERE c.save_id = ?
+            ''', (save_id,))
+            data['characters'] = [dict(zip(CHARACTER_SUMMARY_FIELDS, c)) for c in cursor.fetchall()]
+
+    if 'character_relationships' in include:
+        cursor.execute('''
+            SELECT cr.*, c1.name as character1_name, c2.name as character2_name
+            FROM character_relationships cr
+            JOIN characters c1 ON cr.character1_id = c1.id
+            JOIN characters c2 ON cr.character2_id = c2.id
+            WHERE cr.save_id = ?
+        ''', (save_id,))
+        data['character_relationships'] = [{
+            'id': cr[0],
+            'character1_id': cr[2],
+            'character2_id': cr[3],
+            'relationship_type': cr[4],
+            'notes': cr[5],
+            'character1_name': cr[6],
+            'character2_name': cr[7]
+        } for cr in cursor.fetchall()]
+
+    for section in EVENT_SECTIONS:
+        if section in include:
+            events, next_cursor = _load_events(cursor, save_id, section, events_limit, event_cursors.get(section))
+            data[section] = events
+            if events_limit is not None:
+                data[f'{section}_next_cursor'] = next_cursor
+
+    if 'generation_logs' in include:
+        cursor.execute('''
+            SELECT * FROM generation_logs WHERE save_id = ? ORDER BY created_at DESC LIMIT 10
+        ''', (save_id,))
+        data['generation_logs'] = [{
+            'id': g[0],
+            'guide_text': g[2],
+            'result_summary': g[3],
+            'world_refreshed': bool(g[4]),
+            'factions_refreshed': bool(g[5]),
+            'characters_refreshed': bool(g[6]),
+            'created_at': g[7]
+        } for g in cursor.fetchall()]
+
+    return data
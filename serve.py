@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+生产环境启动入口
+
+run.py / start.py 原来用 app.run(debug=True) 启动Werkzeug开发服务器：单进程、每个连接一个线程，
+调试器还允许在浏览器中执行代码，不适合多人使用。这里用 uvicorn 运行 asgi.py：
+- 流式接口在事件循环中处理，其余Flask接口在固定大小的线程池中执行（--threads）
+- --workers 大于1时启动多个工作进程共享同一个端口，利用多核
+- 启动前在主进程中完成数据库迁移和后台任务恢复，再加载应用和AI引擎（建立LLM客户端），
+  工作进程只做版本检查，不会重复恢复任务，第一个请求也不再承担这些开销
+- 收到 Ctrl+C / SIGTERM 后停止接收新连接，等待生成中的回复和执行中的后台任务结束、
+  排队中的写入写完后再退出
+
+多个工作进程时，聊天回复的续传缓存在各自进程内，断线重连落到其它进程时无法续传
+（回复仍会在原进程中生成完并保存），需要续传的部署可使用单进程或在反向代理上按客户端固定进程。
+AI配置的修改通过 ai_config_version 表的版本号同步，其它工作进程最迟在 AI_CONFIG_SYNC_INTERVAL 秒后
+按新配置重建客户端。
+
+用法：
+    python serve.py                          # 0.0.0.0:5099，1个工作进程
+    python serve.py --workers 4 --threads 32
+    python serve.py --dev                    # Flask开发服务器（带调试器，仅本地调试）
+    python serve.py --bench                  # 与开发服务器对比主要读接口的吞吐量（临时数据库）
+
+环境变量：
+    GAME_HOST=0.0.0.0          监听地址
+    GAME_PORT=5099             端口
+    GAME_WORKERS=1             工作进程数
+    GAME_WSGI_THREADS=32       每个进程执行Flask接口的线程数
+    GAME_DRAIN_TIMEOUT=30      停止服务时等待进行中的请求和回复的时长（秒）
+"""
+
+import os
+import sys
+import argparse
+
+# 禁用Flask自动加载.env文件
+os.environ['FLASK_SKIP_DOTENV'] = '1'
+
+HOST = os.environ.get('GAME_HOST', '0.0.0.0')
+PORT = int(os.environ.get('GAME_PORT', '5099'))
+WORKERS = int(os.environ.get('GAME_WORKERS', '1'))
+THREADS = int(os.environ.get('GAME_WSGI_THREADS', '32'))
+DRAIN_TIMEOUT = float(os.environ.get('GAME_DRAIN_TIMEOUT', '30'))
+
+
+def preload():
+    """在主进程中完成迁移和后台任务恢复，并加载应用和AI引擎，返回 app 模块"""
+    import app as flask_module
+
+    flask_module.init_db()
+    # 工作进程（asgi.py 的 lifespan）只做版本检查，不再恢复任务
+    os.environ['GAME_RECOVER_JOBS'] = '0'
+    return flask_module
+
+
+def serve(host: str = HOST, port: int = PORT, workers: int = WORKERS, threads: int = THREADS,
+          drain_timeout: float = DRAIN_TIMEOUT, log_level: str = 'info'):
+    """启动服务，阻塞到服务停止"""
+    import uvicorn
+
+    # 工作进程导入 asgi.py 时读取
+    os.environ['GAME_WSGI_THREADS'] = str(threads)
+    os.environ['GAME_DRAIN_TIMEOUT'] = str(drain_timeout)
+    flask_module = preload()
+
+    options = dict(host=host, port=port, log_level=log_level, timeout_graceful_shutdown=drain_timeout)
+    if workers <= 1:
+        # 单进程：直接使用已加载的应用，停止时由 lifespan 等待回复和任务结束
+        import asgi
+        uvicorn.run(asgi.app, **options)
+        return
+
+    # 多进程：工作进程各自导入应用；主进程中恢复的任务在主进程执行，停止时同样等待结束
+    try:
+        uvicorn.run('asgi:app', workers=workers, **options)
+    finally:
+        flask_module.shutdown_services()
+
+
+def serve_dev(host: str = HOST, port: int = PORT):
+    """Flask开发服务器（带调试器和每个连接一个线程），仅用于本地调试"""
+    from app import app, init_db
+
+    init_db()
+    app.run(debug=True, host=host, port=port, threaded=True, use_reloader=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI沙盒游戏服务')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=WORKERS, help='工作进程数')
+    parser.add_argument('--threads', type=int, default=THREADS, help='每个进程执行Flask接口的线程数')
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT,
+                        help='停止服务时等待进行中的请求和回复的时长（秒）')
+    parser.add_argument('--log-level', default='info')
+    parser.add_argument('--dev', action='store_true', help='使用Flask开发服务器（带调试器）')
+    parser.add_argument('--bench', action='store_true', help='与开发服务器对比主要读接口的吞吐量后退出')
+    parser.add_argument('--bench-duration', type=float, default=10, help='每个服务的压测时长（秒）')
+    parser.add_argument('--bench-concurrency', type=int, default=16, help='并发连接数')
+    args = parser.parse_args()
+
+    if args.bench:
+        import benchmark
+        benchmark.bench_serve(argparse.Namespace(duration=args.bench_duration, concurrency=args.bench_concurrency,
+                                                 workers=args.workers, threads=args.threads, servers='dev,serve'))
+    elif args.dev:
+        serve_dev(args.host, args.port)
+    else:
+        serve(args.host, args.port, args.workers, args.threads, args.drain_timeout, args.log_level)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -245,19 +245,9 @@ function togglePanelSection(sectionName) {
     }
 }
 
-// 事件筛选功能
+// 事件筛选功能（按类型由服务端过滤，重新加载第一页）
 function filterEvents() {
-    const filter = document.getElementById('events-filter').value;
-    const eventItems = document.querySelectorAll('#world-events .event-item');
-    
-    eventItems.forEach(item => {
-        const eventType = item.dataset.eventType || 'world';
-        if (filter === 'all' || eventType === filter) {
-            item.style.display = 'block';
-        } else {
-            item.style.display = 'none';
-        }
-    });
+    loadWorldEvents();
 }
 
 // 按天筛选事件
@@ -465,6 +455,7 @@ function resetGameSetup() {
     gameState.regions = [];
     gameState.selectedBackground = null;
     gameState.selectedTemplate = null;
+    gameState.templateSnapshot = null;
     
     document.getElementById('save-name').value = '';
     document.getElementById('world-background').value = '';
@@ -622,6 +613,7 @@ async function loadTemplate() {
                 name: region.name || '',
                 type: region.type || '',
                 parent_id: region.parent_id || null,
+                parent_name: (templateData.regions.find(r => r.id === region.parent_id) || {}).name || null,
                 faction_name: region.faction_name || '',
                 description: region.description || ''
             }));
@@ -638,6 +630,9 @@ async function loadTemplate() {
         updateCharactersDisplay();
         updateRegionsDisplay();
         
+        // 记录模版原始数据，开始游戏时若未修改则直接由服务端从模版复制
+        gameState.templateSnapshot = templateWorldSnapshot();
+        
         console.log('模版加载完成，地区数据已更新:', gameState.regions);
         alert(`成功加载模版"${templateData.name}"！\n- 地区：${gameState.regions.length}个\n- 势力：${gameState.factions.length}个\n- 人物：${gameState.characters.length}个`);
     } catch (error) {
@@ -718,8 +713,8 @@ async function createTemplate(templateData) {
     }
 }
 
-// AI生成相关函数 - 修改为生成完整世界
-async function generateCompleteWorld() {
+// AI生成相关函数 - 修改为生成完整世界（reroll为true时忽略服务端缓存重新生成）
+async function generateCompleteWorld(reroll = false) {
     const background = document.getElementById('world-background').value;
     if (!background.trim()) {
         alert('请先输入世界背景！');
@@ -734,7 +729,7 @@ async function generateCompleteWorld() {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ background })
+            body: JSON.stringify({ background, reroll })
         });
         
         const data = await response.json();
@@ -964,6 +959,39 @@ function showAddCharacterForm() {
 // 加载提示
 function showLoading(show) {
     document.getElementById('loading').classList.toggle('active', show);
+    if (!show) {
+        setLoadingMessage('AI正在思考中...');
+    }
+}
+
+function setLoadingMessage(message) {
+    const element = document.getElementById('loading-message');
+    if (element) {
+        element.textContent = message;
+    }
+}
+
+// 轮询后台任务直到结束，成功时返回任务结果，失败时抛出错误
+const JOB_POLL_INTERVAL = 1500;
+
+async function waitForJob(jobId, onProgress) {
+    while (true) {
+        const response = await fetch(`/api/jobs/${jobId}`);
+        const job = await response.json();
+        if (!response.ok) {
+            throw new Error(job.error || `HTTP ${response.status}`);
+        }
+        if (job.status === 'succeeded') {
+            return job.result;
+        }
+        if (job.status === 'failed') {
+            throw new Error(job.error || '任务执行失败');
+        }
+        if (onProgress) {
+            onProgress(job);
+        }
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+    }
 }
 
 // 存档相关函数
@@ -997,11 +1025,17 @@ async function loadSavesList() {
     }
 }
 
+// 进入游戏时需要的存档数据段（事件由世界大事记面板分页加载，人物详情按需加载）
+const GAME_LOAD_SECTIONS = 'save,regions,factions,faction_relationships,characters,character_relationships,generation_logs';
+
+// 模拟后刷新只需要会变化的数据段
+const SIMULATE_REFRESH_SECTIONS = 'save,factions,characters,generation_logs';
+
 async function loadGame(saveId) {
     showLoading(true);
     
     try {
-        const response = await fetch(`/api/saves/${saveId}/load`);
+        const response = await fetch(`/api/saves/${saveId}/load?include=${GAME_LOAD_SECTIONS}`);
         const data = await response.json();
         
         if (data.error) {
@@ -1029,6 +1063,25 @@ async function loadGame(saveId) {
     }
 }
 
+// 按段刷新当前存档数据并更新界面
+async function refreshSaveSections(include) {
+    if (!gameState.currentSave) return;
+    
+    try {
+        const response = await fetch(`/api/saves/${gameState.currentSave.id}/load?include=${include}`);
+        const data = await response.json();
+        
+        if (data.error) {
+            console.error('刷新存档数据失败:', data.error);
+            return;
+        }
+        
+        updateGameUI(data);
+    } catch (error) {
+        console.error('刷新存档数据错误:', error);
+    }
+}
+
 async function startGame() {
     const saveName = document.getElementById('save-name').value;
     const worldBackground = document.getElementById('world-background').value;
@@ -1048,102 +1101,77 @@ async function startGame() {
     showLoading(true);
     
     try {
-        // 创建存档
-        const response = await fetch('/api/saves', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                name: saveName,
-                world_background: worldBackground,
-                world_introduction: worldIntroduction,
-                cultivation_system: cultivationSystem
-            })
-        });
-        
-        const saveData = await response.json();
-        
-        if (!saveData.success) {
-            alert('创建存档失败！');
-            return;
-        }
-        
-        const saveId = saveData.save_id;
-        
-        // 保存AI生成的地图区域
-        if (gameState.regions && gameState.regions.length > 0) {
-            for (const region of gameState.regions) {
-                await fetch(`/api/saves/${saveId}/regions`, {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify({
-                        name: region.name,
-                        type: region.type,
-                        description: region.description,
-                        parent_id: null // 暂时不处理父级关系
-                    })
-                });
-            }
-        }
-        
-        // 保存势力
-        for (const faction of gameState.factions) {
-            await fetch(`/api/saves/${saveId}/factions`, {
+        // 模版内容未修改时，由服务端直接在数据库内复制模版，无需上传势力/人物/地区
+        const template = gameState.selectedTemplate;
+        const response = template && gameState.templateSnapshot === templateWorldSnapshot()
+            ? await fetch(`/api/templates/${template.id}/instantiate`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify({
-                    name: faction.name,
-                    ideal: faction.ideal || '',
-                    background: faction.background || '',
-                    description: faction.description || '',
-                    status: faction.status || '活跃',
-                    power_level: faction.power_level || 50,
-                    headquarters_location: faction.headquarters_location || ''
+                    name: saveName,
+                    world_background: worldBackground,
+                    world_introduction: worldIntroduction,
+                    cultivation_system: cultivationSystem
                 })
-            });
-        }
-        
-        // 保存人物
-        for (const character of gameState.characters) {
-            // 找到对应的势力ID
-            let factionId = null;
-            if (character.faction) {
-                const factionIndex = gameState.factions.findIndex(f => f.name === character.faction);
-                if (factionIndex !== -1) {
-                    factionId = factionIndex + 1; // 假设数据库ID从1开始
-                }
-            }
-            
-            await fetch(`/api/saves/${saveId}/characters`, {
+            })
+            // 创建存档及完整世界（服务端在一个事务内写入，并按名称解析势力ID）
+            : await fetch('/api/saves/world', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify({
-                    name: character.name,
-                    faction_id: factionId,
-                    status: character.status || '活跃',
-                    personality: character.personality || '',
-                    birthday: character.birthday || '',
-                    age: character.age || 25,
-                    location: character.location || '',
-                    position: character.position || '',
-                    realm: character.realm || '',
-                    lifespan: character.lifespan || 100,
-                    equipment: character.equipment || [],
-                    skills: character.skills || [],
-                    experience: character.experience || '',
-                    goals: character.goals || '',
-                    relationships: character.relationships || ''
+                    name: saveName,
+                    world_background: worldBackground,
+                    world_introduction: worldIntroduction,
+                    cultivation_system: cultivationSystem,
+                    regions: (gameState.regions || []).map(region => ({
+                        name: region.name,
+                        type: region.type,
+                        description: region.description,
+                        faction_name: region.faction_name || null,
+                        parent_name: region.parent_name || null
+                    })),
+                    factions: gameState.factions.map(faction => ({
+                        name: faction.name,
+                        ideal: faction.ideal || '',
+                        background: faction.background || '',
+                        description: faction.description || '',
+                        status: faction.status || '活跃',
+                        power_level: faction.power_level || 50,
+                        headquarters_location: faction.headquarters_location || ''
+                    })),
+                    characters: gameState.characters.map(character => ({
+                        name: character.name,
+                        faction: character.faction || null,
+                        status: character.status || '活跃',
+                        personality: character.personality || '',
+                        birthday: character.birthday || '',
+                        age: character.age || 25,
+                        location: character.location || '',
+                        position: character.position || '',
+                        realm: character.realm || '',
+                        lifespan: character.lifespan || 100,
+                        equipment: character.equipment || [],
+                        skills: character.skills || [],
+                        experience: character.experience || '',
+                        goals: character.goals || '',
+                        relationships: character.relationships || ''
+                    }))
                 })
             });
+        
+        const saveData = await response.json();
+        
+        if (!saveData.success) {
+            alert('创建存档失败！' + (saveData.error ? '\n' + saveData.error : ''));
+            return;
         }
         
+        const saveId = saveData.save_id;
+        
         // 加载游戏
         await loadGame(saveId);
     } catch (error) {
@@ -1153,6 +1181,11 @@ async function startGame() {
     }
 }
 
+// 当前新游戏设置中的世界数据签名，用于判断模版是否被修改过
+function templateWorldSnapshot() {
+    return JSON.stringify([gameState.factions, gameState.characters, gameState.regions]);
+}
+
 // 游戏界面相关函数
 function initializeGameScreen(saveData) {
     console.log('初始化游戏界面，数据:', saveData);
@@ -1546,7 +1579,20 @@ function showFactionDetails(faction) {
     document.body.appendChild(modal);
 }
 
-function showCharacterDetails(character) {
+async function showCharacterDetails(character) {
+    // 人物列表只包含摘要字段，首次查看时加载完整信息并缓存到人物对象上
+    if (character.id && character.equipment === undefined && gameState.currentSave) {
+        try {
+            const response = await fetch(`/api/saves/${gameState.currentSave.id}/characters/${character.id}`);
+            const detail = await response.json();
+            if (!detail.error) {
+                Object.assign(character, detail);
+            }
+        } catch (error) {
+            console.error('加载人物详情失败:', error);
+        }
+    }
+    
     // 显示人物详情模态框
     const modal = document.createElement('div');
     modal.className = 'modal active';
@@ -1693,6 +1739,53 @@ function closeModalAndRemove(modalId) {
     }
 }
 
+// 逐天模拟：服务端每模拟完一天推送一次，写库完成后刷新受影响的数据段，返回各天摘要
+async function streamSimulation(requestData) {
+    const response = await fetch(`/api/saves/${gameState.currentSave.id}/simulate-stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(requestData)
+    });
+    
+    if (!response.ok) {
+        const error = await response.json().catch(() => ({}));
+        throw new Error(error.error || `HTTP ${response.status}`);
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    const summaries = [];
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop(); // 保留不完整的行
+        
+        for (const line of lines) {
+            if (!line.startsWith('data: ')) continue;
+            const event = JSON.parse(line.substring(6));
+            
+            if (event.type === 'error') {
+                throw new Error(event.error);
+            } else if (event.type === 'day') {
+                summaries.push(`第${event.day}天：${event.summary || ''}`);
+                const next = event.index + 1 < event.total ? '正在推演下一天' : '正在保存';
+                setLoadingMessage(`已完成第${event.day}天（${event.index + 1}/${event.total}），${next}`);
+            } else if (event.type === 'day_saved') {
+                await refreshSaveSections(SIMULATE_REFRESH_SECTIONS);
+            }
+        }
+    }
+    
+    return { summary: summaries.join('\n\n') };
+}
+
 async function simulateDays() {
     try {
         // 检查当前是否有加载的存档
@@ -1709,10 +1802,11 @@ async function simulateDays() {
         const storyGuide = document.getElementById('story-guide').value || '';
         const modelId = document.getElementById('story-model-id').value;
         
-        // 构建请求数据
+        // 构建请求数据（提交后台任务，不占用服务器工作线程）
         const requestData = {
             days: days,
-            story_guide: storyGuide
+            story_guide: storyGuide,
+            async: true
         };
         
         // 如果有指定模型ID，添加到请求数据中
@@ -1720,25 +1814,47 @@ async function simulateDays() {
             requestData.model_config_id = parseInt(modelId);
         }
         
-        // 发送API请求
-        const response = await fetch(`/api/saves/${gameState.currentSave.id}/simulate`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify(requestData)
-        });
-        
-        const data = await response.json();
-        
-        if (data.error) {
-            alert('模拟天数失败: ' + data.error);
-            showLoading(false);
-            return;
+        let data;
+        if (days > 1) {
+            // 多天逐天模拟，每天的结果生成后立即显示
+            try {
+                data = await streamSimulation(requestData);
+            } catch (error) {
+                alert('模拟天数失败: ' + error.message);
+                return;
+            }
+        } else {
+            // 发送API请求
+            const response = await fetch(`/api/saves/${gameState.currentSave.id}/simulate`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify(requestData)
+            });
+            
+            const job = await response.json();
+            
+            if (job.error) {
+                alert('模拟天数失败: ' + job.error);
+                showLoading(false);
+                return;
+            }
+            
+            // 等待任务完成，期间显示进度
+            try {
+                data = await waitForJob(job.job_id, (status) => {
+                    setLoadingMessage(`${status.message || '排队中'}（${Math.round(status.progress * 100)}%）`);
+                });
+            } catch (error) {
+                alert('模拟天数失败: ' + error.message);
+                return;
+            }
         }
         
-        // 更新游戏UI
-        await loadGame(gameState.currentSave.id);
+        // 更新游戏UI（只刷新模拟会改变的数据段）
+        await refreshSaveSections(SIMULATE_REFRESH_SECTIONS);
+        loadWorldEvents();
         
         // 显示摘要
         if (data.summary) {
@@ -2390,12 +2506,6 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
-    // 事件过滤器
-    const eventsFilter = document.getElementById('events-filter');
-    if (eventsFilter) {
-        eventsFilter.addEventListener('change', filterEvents);
-    }
-    
     // 势力表单提交 - 使用事件委托
     document.addEventListener('submit', function(e) {
         if (e.target.id === 'faction-form') {
@@ -2557,7 +2667,7 @@ async function loadGenerationLogs() {
     if (!gameState.currentSave) return;
     
     try {
-        const response = await fetch(`/api/saves/${gameState.currentSave.id}/load`);
+        const response = await fetch(`/api/saves/${gameState.currentSave.id}/load?include=generation_logs`);
         const data = await response.json();
         
         if (data.generation_logs) {
@@ -3026,36 +3136,96 @@ function saveNovelToFile(novelId, title) {
     URL.revokeObjectURL(url);
 }
 
-// 加载世界事件
+// 世界事件时间线分页状态
+const eventsTimeline = {
+    cursor: null,
+    hasMore: false,
+    loading: false,
+    requestId: 0,
+    pageSize: 50
+};
+
+// 加载世界事件（重新从第一页开始）
 async function loadWorldEvents() {
     if (!gameState.currentSave) {
         return;
     }
     
+    eventsTimeline.cursor = null;
+    eventsTimeline.hasMore = false;
+    initWorldEventsScroll();
+    await loadWorldEventsPage(true);
+}
+
+// 加载下一页世界事件
+async function loadMoreWorldEvents() {
+    if (!gameState.currentSave || !eventsTimeline.hasMore || eventsTimeline.loading) {
+        return;
+    }
+    await loadWorldEventsPage(false);
+}
+
+async function loadWorldEventsPage(reset) {
+    const requestId = ++eventsTimeline.requestId;
+    eventsTimeline.loading = true;
+    
     try {
-        const response = await fetch(`/api/saves/${gameState.currentSave.id}/events`);
+        const params = new URLSearchParams({ limit: eventsTimeline.pageSize });
+        const filter = document.getElementById('events-filter');
+        if (filter && filter.value !== 'all') {
+            params.set('types', filter.value);
+        }
+        if (!reset && eventsTimeline.cursor) {
+            params.set('cursor', eventsTimeline.cursor);
+        }
+        
+        const response = await fetch(`/api/saves/${gameState.currentSave.id}/timeline?${params}`);
         if (!response.ok) {
             throw new Error(`HTTP ${response.status}: ${response.statusText}`);
         }
         const data = await response.json();
         
+        // 筛选条件变化或存档切换后，旧请求的结果直接丢弃
+        if (requestId !== eventsTimeline.requestId) {
+            return;
+        }
+        
         if (data.error) {
             console.error('加载世界事件失败:', data.error);
             return;
         }
         
-        updateWorldEventsDisplay(data.events || []);
+        eventsTimeline.cursor = data.next_cursor;
+        eventsTimeline.hasMore = data.has_more;
+        updateWorldEventsDisplay(data.events || [], !reset);
     } catch (error) {
         console.error('加载世界事件错误:', error);
+    } finally {
+        if (requestId === eventsTimeline.requestId) {
+            eventsTimeline.loading = false;
+        }
     }
 }
 
-// 更新世界事件显示
-function updateWorldEventsDisplay(events) {
+// 事件列表滚动到底部附近时自动加载下一页
+function initWorldEventsScroll() {
+    const container = document.getElementById('world-events');
+    if (!container || container.dataset.pagingBound) return;
+    
+    container.dataset.pagingBound = 'true';
+    container.addEventListener('scroll', () => {
+        if (container.scrollTop + container.clientHeight >= container.scrollHeight - 100) {
+            loadMoreWorldEvents();
+        }
+    });
+}
+
+// 更新世界事件显示，append为true时追加到现有列表末尾
+function updateWorldEventsDisplay(events, append = false) {
     const container = document.getElementById('world-events');
     if (!container) return;
     
-    if (events.length === 0) {
+    if (!append && events.length === 0) {
         container.innerHTML = `
             <div style="text-align: center; color: rgba(255,255,255,0.6); padding: 40px;">
                 还没有世界事件记录
@@ -3064,7 +3234,7 @@ function updateWorldEventsDisplay(events) {
         return;
     }
     
-    container.innerHTML = events.map(event => `
+    const html = events.map(event => `
         <div class="event-item" data-event-type="${event.type || 'world'}">
             <div class="event-header">
                 <span class="event-day">第${event.day}天</span>
@@ -3075,6 +3245,19 @@ function updateWorldEventsDisplay(events) {
             </div>
         </div>
     `).join('');
+    
+    if (append) {
+        container.insertAdjacentHTML('beforeend', html);
+    } else {
+        container.innerHTML = html;
+        container.scrollTop = 0;
+    }
+    
+    // 按天筛选仍在前端进行，新加载的页面同样需要应用
+    const dayFilter = document.getElementById('day-filter-input');
+    if (dayFilter && dayFilter.value) {
+        filterEventsByDay();
+    }
 }
 
 // 获取事件类型名称
@@ -3251,7 +3434,8 @@ let chatState = {
     chats: [],
     messages: {},
     isTyping: false,
-    streamController: null
+    streamController: null,
+    streamId: null
 };
 
 // 显示AI对话界面
@@ -3732,12 +3916,22 @@ function updateChatHistoryList() {
     });
 }
 
+// 通知服务端停止生成：生成与连接无关，只断开连接模型仍会继续输出
+function cancelChatStream() {
+    const streamId = chatState.streamId;
+    chatState.streamId = null;
+    if (!streamId) return;
+    fetch(`/api/chat-stream/${streamId}/cancel`, { method: 'POST' })
+        .catch(error => console.warn('停止生成失败:', error));
+}
+
 // 切换到指定对话
 function switchChat(chatId) {
     console.log('切换到对话:', chatId);
     try {
         // 如果正在输出中，取消之前的请求
         if (chatState.isTyping && chatState.streamController) {
+            cancelChatStream();
             chatState.streamController.abort();
             chatState.isTyping = false;
         }
@@ -3950,6 +4144,10 @@ function displayChatMessages(messages) {
     scrollToBottom();
 }
 
+// 聊天回复连接中断时的最大重连次数和重连间隔（毫秒，逐次递增）
+const CHAT_STREAM_MAX_RETRIES = 5;
+const CHAT_STREAM_RETRY_DELAY = 1000;
+
 // 发送消息
 function sendChatMessage() {
     if (!chatState.currentChatId) {
@@ -4069,20 +4267,15 @@ function sendChatMessage() {
     }
     chatState.messages[chatState.currentChatId].push(userMessage);
     
-    // 保存用户消息到服务器
-    saveMessageToServer(chatState.currentChatId, userMessage);
-    
     // 滚动到底部
     scrollToBottom();
     
     // 显示"AI正在输入"指示器
     showTypingIndicator();
     
-    // 准备上下文消息
-    const contextMessages = prepareContextMessages(contextCount);
-    
     // 创建用于取消请求的控制器
     chatState.streamController = new AbortController();
+    chatState.streamId = null;
     const signal = chatState.streamController.signal;
     
     // 发送请求到服务器
@@ -4096,7 +4289,7 @@ function sendChatMessage() {
             message: message,
             model_id: aiModel,
             system_prompt: systemPrompt,
-            context_messages: contextMessages
+            context_count: parseInt(contextCount)
         }),
         signal: signal
     })
@@ -4112,11 +4305,18 @@ function sendChatMessage() {
         return response.body;
     })
     .then(stream => {
-        // 创建流读取器
-        const reader = stream.getReader();
-        const decoder = new TextDecoder();
+        // 创建流读取器（服务端按SSE协议推送，每个事件带编号）
+        let reader = stream.getReader();
+        let decoder = new TextDecoder();
+        let buffer = '';
         let responseText = '';
         
+        // 断线续传：记录流ID和最后收到的事件编号
+        let streamId = null;
+        let lastEventId = 0;
+        let finished = false;
+        let retries = 0;
+        
         // 创建AI消息对象
         const aiMessage = {
             role: 'assistant',
@@ -4128,109 +4328,163 @@ function sendChatMessage() {
         removeTypingIndicator();
         const messageElement = addMessageToUI(aiMessage);
         
-        // 处理流
-        function processStream() {
-            return reader.read().then(({ done, value }) => {
-                if (done) {
-                    chatState.isTyping = false;
-                    
-                    // 确保响应文本有效
-                    if (!responseText || responseText.trim() === '') {
-                        console.warn('流响应为空或无效');
-                        responseText = '(无响应内容)';
-                    }
-                    
-                    // 更新状态
-                    aiMessage.content = responseText;
-                    console.log('处理完成，AI消息:', aiMessage);
-                    
-                    // 添加到聊天历史
-                    if (!chatState.messages[chatState.currentChatId]) {
-                        chatState.messages[chatState.currentChatId] = [];
-                    }
-                    chatState.messages[chatState.currentChatId].push(aiMessage);
-                    
-                    // 保存消息到服务器
-                    saveMessageToServer(chatState.currentChatId, aiMessage);
-                    
-                    // 保存当前设置，以便在updateChatTitle后恢复
-                    let systemPrompt = null;
-                    let contextCount = null;
-                    
-                    // 如果存在全局设置变量，使用它们
-                    if (window.currentChatSystemPrompt !== undefined) {
-                        systemPrompt = window.currentChatSystemPrompt;
-                    }
-                    
-                    if (window.currentChatContextCount !== undefined) {
-                        contextCount = window.currentChatContextCount;
-                    }
-                    
-                    // 如果全局变量不存在，尝试从当前对话获取
-                    if (systemPrompt === null || contextCount === null) {
+        // 回复完成
+        function finishReply() {
+            chatState.isTyping = false;
+            chatState.streamId = null;
+            
+            // 确保响应文本有效
+            if (!responseText || responseText.trim() === '') {
+                console.warn('流响应为空或无效');
+                responseText = '(无响应内容)';
+            }
+            
+            // 更新状态
+            aiMessage.content = responseText;
+            console.log('处理完成，AI消息:', aiMessage);
+            
+            // 添加到聊天历史
+            if (!chatState.messages[chatState.currentChatId]) {
+                chatState.messages[chatState.currentChatId] = [];
+            }
+            chatState.messages[chatState.currentChatId].push(aiMessage);
+            
+            // 用户消息和AI回复由服务端在输出结束后保存
+            
+            // 保存当前设置，以便在updateChatTitle后恢复
+            let systemPrompt = null;
+            let contextCount = null;
+            
+            // 如果存在全局设置变量，使用它们
+            if (window.currentChatSystemPrompt !== undefined) {
+                systemPrompt = window.currentChatSystemPrompt;
+            }
+            
+            if (window.currentChatContextCount !== undefined) {
+                contextCount = window.currentChatContextCount;
+            }
+            
+            // 如果全局变量不存在，尝试从当前对话获取
+            if (systemPrompt === null || contextCount === null) {
+                const currentChat = chatState.chats.find(c => c.id === chatState.currentChatId);
+                if (currentChat) {
+                    if (systemPrompt === null) systemPrompt = currentChat.system_prompt;
+                    if (contextCount === null) contextCount = currentChat.context_count;
+                }
+            }
+            
+            console.log('保存的设置：', { system_prompt: systemPrompt, context_count: contextCount });
+            
+            // 更新对话标题（如果是第一条消息）
+            if (chatState.messages[chatState.currentChatId].length === 2) {
+                updateChatTitle();
+                
+                // 恢复原始设置
+                if (systemPrompt !== null || contextCount !== null) {
+                    setTimeout(() => {
                         const currentChat = chatState.chats.find(c => c.id === chatState.currentChatId);
                         if (currentChat) {
-                            if (systemPrompt === null) systemPrompt = currentChat.system_prompt;
-                            if (contextCount === null) contextCount = currentChat.context_count;
+                            if (systemPrompt !== null) currentChat.system_prompt = systemPrompt;
+                            if (contextCount !== null) currentChat.context_count = contextCount;
+                            
+                            console.log('恢复原始设置：', { 
+                                system_prompt: currentChat.system_prompt, 
+                                context_count: currentChat.context_count 
+                            });
+                            
+                            // 将恢复的设置保存到服务器
+                            updateChatSettings(currentChat.system_prompt, currentChat.context_count);
                         }
+                    }, 300);
+                }
+            }
+        }
+        
+        // 处理一个事件
+        function handleEvent(event) {
+            if (event.type === 'start') {
+                streamId = event.stream_id;
+                chatState.streamId = streamId;
+            } else if (event.type === 'delta') {
+                responseText += event.content;
+                
+                // 更新UI
+                const contentElement = messageElement.querySelector('.message-content');
+                if (contentElement) {
+                    // 将换行符转换为<br>以正确显示
+                    contentElement.innerHTML = responseText.replace(/\n/g, '<br>');
+                }
+                
+                // 滚动到底部
+                scrollToBottom();
+            } else if (event.type === 'error') {
+                throw new Error(event.error);
+            } else if (event.type === 'done') {
+                finished = true;
+            }
+        }
+        
+        // 连接中断时带 Last-Event-ID 重新连接同一次生成，从断点继续，服务端不会重新调用模型
+        function reconnect(error) {
+            if (!streamId || retries >= CHAT_STREAM_MAX_RETRIES) {
+                throw error || new Error('连接已断开');
+            }
+            retries++;
+            console.warn(`回复连接中断，第${retries}次重连`, error);
+            return new Promise(resolve => setTimeout(resolve, CHAT_STREAM_RETRY_DELAY * retries))
+                .then(() => fetch(`/api/chat-stream/${streamId}`, {
+                    headers: { 'Last-Event-ID': String(lastEventId) },
+                    signal: signal
+                }))
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`重新连接失败（HTTP ${response.status}）`);
                     }
-                    
-                    console.log('保存的设置：', { system_prompt: systemPrompt, context_count: contextCount });
-                    
-                    // 更新对话标题（如果是第一条消息）
-                    if (chatState.messages[chatState.currentChatId].length === 2) {
-                        updateChatTitle();
-                        
-                        // 恢复原始设置
-                        if (systemPrompt !== null || contextCount !== null) {
-                            setTimeout(() => {
-                                const currentChat = chatState.chats.find(c => c.id === chatState.currentChatId);
-                                if (currentChat) {
-                                    if (systemPrompt !== null) currentChat.system_prompt = systemPrompt;
-                                    if (contextCount !== null) currentChat.context_count = contextCount;
-                                    
-                                    console.log('恢复原始设置：', { 
-                                        system_prompt: currentChat.system_prompt, 
-                                        context_count: currentChat.context_count 
-                                    });
-                                    
-                                    // 将恢复的设置保存到服务器
-                                    updateChatSettings(currentChat.system_prompt, currentChat.context_count);
-                                }
-                            }, 300);
-                        }
+                    reader = response.body.getReader();
+                    decoder = new TextDecoder();
+                    buffer = '';
+                    return processStream();
+                });
+        }
+        
+        // 处理流
+        function processStream() {
+            return reader.read().then(({ done, value }) => {
+                if (done) {
+                    if (finished) {
+                        finishReply();
+                        return;
                     }
-                    
-                    return;
+                    return reconnect();
                 }
                 
-                // 解码并添加新的内容
-                const chunk = decoder.decode(value, { stream: true });
-                console.log('收到流数据块:', chunk);
-                
-                if (chunk) {
-                    // 将特殊标记\n转换回真正的换行符
-                    const processedChunk = chunk.replace(/\\n/g, '\n');
-                    responseText += processedChunk;
-                    
-                    // 更新UI
-                    const contentElement = messageElement.querySelector('.message-content');
-                    if (contentElement) {
-                        // 将换行符转换为<br>以正确显示
-                        const formattedText = responseText.replace(/\n/g, '<br>');
-                        contentElement.innerHTML = formattedText;
-                        // 触发重绘
-                        contentElement.style.display = 'none';
-                        contentElement.offsetHeight; // 强制重排
-                        contentElement.style.display = '';
+                // 按空行切分事件，保留不完整的部分；心跳和retry行没有data，直接跳过
+                buffer += decoder.decode(value, { stream: true });
+                const blocks = buffer.split('\n\n');
+                buffer = blocks.pop();
+                for (const block of blocks) {
+                    let eventId = null;
+                    let data = null;
+                    for (const line of block.split('\n')) {
+                        if (line.startsWith('id: ')) {
+                            eventId = parseInt(line.substring(4));
+                        } else if (line.startsWith('data: ')) {
+                            data = line.substring(6);
+                        }
+                    }
+                    if (data === null) continue;
+                    handleEvent(JSON.parse(data));
+                    if (eventId !== null) {
+                        lastEventId = eventId;
+                        retries = 0;
                     }
-                    
-                    // 滚动到底部
-                    scrollToBottom();
                 }
                 
                 // 继续处理流
                 return processStream();
+            }, error => {
+                if (error.name === 'AbortError') throw error;
+                return reconnect(error);
             });
         }
         
@@ -4259,31 +4513,6 @@ function sendChatMessage() {
     });
 }
 
-// 准备上下文消息
-function prepareContextMessages(contextCount) {
-    if (!chatState.currentChatId || !chatState.messages[chatState.currentChatId]) {
-        return [];
-    }
-    
-    const messages = chatState.messages[chatState.currentChatId];
-    
-    // 不包括当前用户消息
-    const previousMessages = messages.slice(0, -1);
-    
-    // 根据上下文条数选择要发送的消息
-    if (contextCount === '0') {
-        return [];
-    } else if (contextCount === '-1') {
-        return previousMessages;
-    } else {
-        const count = parseInt(contextCount);
-        // 按对话轮次计算，一轮是用户+AI的一组消息
-        const rounds = Math.floor(count);
-        const messageCount = rounds * 2;
-        return previousMessages.slice(-messageCount);
-    }
-}
-
 // 向UI添加消息
 function addMessageToUI(message) {
     const messagesContainer = document.getElementById('chat-messages');
@@ -4453,51 +4682,6 @@ function updateChatSettings(systemPrompt, contextCount) {
     });
 }
 
-// 保存消息到服务器
-function saveMessageToServer(chatId, message) {
-    console.log('保存消息到服务器:', chatId, message);
-    
-    // 检查必要参数
-    if (!message || !message.role || message.content === undefined) {
-        console.error('保存消息时缺少必要参数:', message);
-        return;
-    }
-    
-    // 确保content不为null，API可能不接受null值
-    const content = message.content || '';
-    
-    fetch(`/api/chats/${chatId}/messages`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-            role: message.role,
-            content: content,
-            timestamp: message.timestamp || new Date().toISOString()
-        })
-    })
-    .then(response => {
-        if (!response.ok) {
-            console.error('保存消息失败，状态码:', response.status);
-            return response.json().then(data => {
-                throw new Error(data.error || '未知错误');
-            });
-        }
-        return response.json();
-    })
-    .then(data => {
-        if (!data.success) {
-            console.error('保存消息失败:', data.error);
-        } else {
-            console.log('消息保存成功');
-        }
-    })
-    .catch(error => {
-        console.error('保存消息时出错:', error);
-    });
-}
-
 // 更新对话标题
 function updateChatTitle() {
     if (!chatState.currentChatId) return;
@@ -0,0 +1,136 @@
+"""
+滚动剧情记忆
+
+原来生成小说/推进故事时，每次都查询最近两部小说，json.loads 整段正文后截取每章前100字作为“概要”，
+只能看到最近两次生成的内容，更早的剧情全部丢失，而且每次请求都要解码完整的小说。
+
+这里在每次生成写库时（与写入放在同一个事务里）增量维护两层摘要：
+- story_days: 每天一条摘要，由当天的模拟摘要和小说章节摘录合并而成，超出长度时保留最新的部分
+- story_arcs: 每个存档一条整体梗概，每天一行“第N天：要点”，超出长度时丢弃最早的行
+构建提示词时只读这两张表：整体梗概（不含最近几天）加上最近几天的摘要。
+
+环境变量：
+    AI_STORY_DAY_CHARS=600     每天摘要的最大字数
+    AI_STORY_ARC_CHARS=1500    整体梗概的最大字数
+"""
+
+import os
+import re
+import json
+
+DAY_SUMMARY_CHARS = int(os.environ.get('AI_STORY_DAY_CHARS', '600'))
+ARC_CHARS = int(os.environ.get('AI_STORY_ARC_CHARS', '1500'))
+
+# 提示词中给出详细摘要的最近天数
+PROMPT_DAYS = 3
+# 每章摘录的字数，与原先的小说概要一致
+EXCERPT_CHARS = 100
+# 整体梗概中每天要点的字数
+HEADLINE_CHARS = 60
+
+_SENTENCE_END = re.compile(r'[。！？!?\n]')
+_ARC_LINE = re.compile(r'^第(-?\d+)天：')
+
+
+def novel_digest(novel, title: str = '') -> str:
+    """小说的章节摘录：《标题》: 章节标题 - 正文前100字、..."""
+    if isinstance(novel, str):
+        try:
+            novel = json.loads(novel) if novel else {}
+        except ValueError:
+            novel = {}
+    if not isinstance(novel, dict):
+        novel = {}
+    title = novel.get('title') or title or '未命名小说'
+    chapters = novel.get('chapters')
+    if not isinstance(chapters, list) or not chapters:
+        return f'《{title}》'
+    excerpts = []
+    for chapter in chapters:
+        if not isinstance(chapter, dict):
+            continue
+        content = chapter.get('content') or ''
+        excerpt = content[:EXCERPT_CHARS] + '...' if len(content) > EXCERPT_CHARS else content
+        excerpts.append(f"{chapter.get('title', '')} - {excerpt}")
+    return f'《{title}》: ' + '、'.join(excerpts)
+
+
+def _headline(text: str) -> str:
+    """摘要的第一句话，作为整体梗概中的一行"""
+    text = text.strip()
+    match = _SENTENCE_END.search(text)
+    sentence = text[:match.start() + 1] if match else text
+    sentence = sentence.strip()
+    return sentence[:HEADLINE_CHARS] + '...' if len(sentence) > HEADLINE_CHARS else sentence
+
+
+def _trim_day(text: str) -> str:
+    """超出长度时保留最新写入的部分"""
+    if len(text) <= DAY_SUMMARY_CHARS:
+        return text
+    return '...' + text[-(DAY_SUMMARY_CHARS - 3):]
+
+
+def _arc_lines(arc: str):
+    """[(天数, 行)]"""
+    lines = []
+    for line in (arc or '').split('\n'):
+        match = _ARC_LINE.match(line)
+        if match:
+            lines.append((int(match.group(1)), line))
+    return lines
+
+
+def record(conn, save_id: int, day: int, summary: str = '', novel=None):
+    """记录一次生成的结果：合并到当天摘要，并更新整体梗概中当天的一行
+
+    Args:
+        conn: 数据库连接，由调用方提交事务（通常与生成结果的写入在同一个事务里）
+        summary: 模拟摘要（story_progress/simulate_days 返回的 summary）
+        novel: 生成的小说（dict或JSON文本），记录章节摘录
+    """
+    parts = []
+    if summary:
+        parts.append(summary.strip())
+    if novel:
+        parts.append(novel_digest(novel))
+    if not parts:
+        return
+
+    cursor = conn.cursor()
+    row = cursor.execute('SELECT summary FROM story_days WHERE save_id = ? AND day = ?', (save_id, day)).fetchone()
+    day_summary = _trim_day('\n'.join(([row[0]] if row and row[0] else []) + parts))
+    cursor.execute('''
+        INSERT INTO story_days (save_id, day, summary, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (save_id, day) DO UPDATE SET summary = excluded.summary, updated_at = excluded.updated_at
+    ''', (save_id, day, day_summary))
+
+    # 整体梗概中每天一行，取当天第一段摘要的第一句话
+    row = cursor.execute('SELECT summary FROM story_arcs WHERE save_id = ?', (save_id,)).fetchone()
+    lines = [item for item in _arc_lines(row[0] if row else '') if item[0] != day]
+    lines.append((day, f'第{day}天：{_headline(day_summary.lstrip("."))}'))
+    lines.sort(key=lambda item: item[0])
+    while len(lines) > 1 and sum(len(line) + 1 for _, line in lines) > ARC_CHARS:
+        lines.pop(0)
+    cursor.execute('''
+        INSERT INTO story_arcs (save_id, summary, through_day, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (save_id) DO UPDATE SET summary = excluded.summary, through_day = excluded.through_day,
+            updated_at = excluded.updated_at
+    ''', (save_id, '\n'.join(line for _, line in lines), lines[-1][0]))
+
+
+def prompt_memory(conn, save_id: int, days: int = PROMPT_DAYS) -> str:
+    """提示词中的剧情记忆：更早剧情的梗概 + 最近几天的摘要，没有记录时返回空字符串"""
+    recent = conn.execute('''
+        SELECT day, summary FROM story_days WHERE save_id = ? ORDER BY day DESC LIMIT ?
+    ''', (save_id, days)).fetchall()
+    arc = conn.execute('SELECT summary FROM story_arcs WHERE save_id = ?', (save_id,)).fetchone()
+
+    recent_days = {day for day, _ in recent}
+    earlier = [line for day, line in _arc_lines(arc[0] if arc else '') if day not in recent_days]
+    parts = []
+    if earlier:
+        parts.append('### 此前的剧情梗概\n' + '\n'.join(earlier))
+    if recent:
+        parts.append('### 最近几天的剧情\n' + '\n'.join(f'- 第{day}天：{summary}' for day, summary in reversed(recent)))
+    return '\n\n'.join(parts)
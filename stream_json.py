@@ -0,0 +1,256 @@
+"""
+增量（推送式）JSON解析器
+
+流式生成小说时，模型输出是一段逐块到达的JSON。旧的做法每收到一块就从头查找
+"novel"/"title"/"content" 并重新扫描整段文本，总开销随输出长度平方增长，
+而且只认识 \\n \\" \\\\ 三种转义、只支持第一章。
+
+StreamingJSONParser 每个字符只处理一次：
+- feed(chunk) 返回这一块产生的事件列表，事件为 (kind, path, value)：
+    ('chunk', path, text)    字符串值增长了一段（已解码），每次feed每个字符串最多一条
+    ('string', path, value)  字符串值结束
+    ('end', path, value)     对象或数组结束
+  path 为键名/下标组成的元组，如 ('novel', 'chapters', 0, 'content')
+- 支持全部JSON转义，包括跨块的 \\uXXXX 和代理对
+- 边解析边构建结果，根对象结束时 value 就是完整数据，不需要再 json.loads 一遍
+- 跳过第一个 { 或 [ 之前的内容（如 ```json 代码块标记），根值结束后忽略剩余内容
+"""
+
+import re
+import json
+
+# 字符串中不需要特殊处理的连续片段，整段复制
+_STRING_RUN = re.compile(r'[^"\\]+')
+_VALUE_START = re.compile(r'[\[{]')
+_WHITESPACE = ' \t\r\n'
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+# 数字和 true/false/null 中可能出现的字符
+_LITERAL_CHARS = frozenset('0123456789+-.eEtrufalsn')
+
+
+class JSONStreamError(ValueError):
+    """输入不是合法的JSON"""
+
+
+class StreamingJSONParser:
+    """推送式JSON解析器，见模块说明"""
+
+    def __init__(self):
+        self.value = None
+        self.done = False
+        self._state = 'start'
+        # 打开中的容器：[容器, 路径, 当前键]
+        self._stack = []
+        self._events = []
+        self._literal = []
+        self._string_parts = []
+        self._string_chunk = []
+        self._string_path = None
+        self._string_is_key = False
+        self._unicode = ''
+        self._high_surrogate = None
+
+    def feed(self, text: str):
+        """处理一块输入，返回这一块产生的事件列表"""
+        i = 0
+        n = len(text)
+        while i < n:
+            state = self._state
+
+            if state == 'string':
+                match = _STRING_RUN.match(text, i)
+                if match:
+                    self._append_text(match.group())
+                    i = match.end()
+                    continue
+                i += 1
+                if text[i - 1] == '"':
+                    self._end_string()
+                else:
+                    self._state = 'escape'
+                continue
+
+            c = text[i]
+            if state == 'escape':
+                i += 1
+                if c == 'u':
+                    self._unicode = ''
+                    self._state = 'unicode'
+                elif c in _ESCAPES:
+                    self._append_text(_ESCAPES[c])
+                    self._state = 'string'
+                else:
+                    raise JSONStreamError(f'无效的转义字符: \\{c}')
+                continue
+
+            if state == 'unicode':
+                part = text[i:i + 4 - len(self._unicode)]
+                self._unicode += part
+                i += len(part)
+                if len(self._unicode) == 4:
+                    try:
+                        code = int(self._unicode, 16)
+                    except ValueError:
+                        raise JSONStreamError(f'无效的转义字符: \\u{self._unicode}')
+                    self._append_code(code)
+                    self._state = 'string'
+                continue
+
+            if state == 'literal':
+                if c in _LITERAL_CHARS:
+                    self._literal.append(c)
+                    i += 1
+                else:
+                    # 分隔符留给下一轮处理
+                    self._end_literal()
+                continue
+
+            if state == 'done':
+                break
+
+            if state == 'start':
+                match = _VALUE_START.search(text, i)
+                if match is None:
+                    break
+                i = match.start()
+                self._state = 'value'
+                continue
+
+            if c in _WHITESPACE:
+                i += 1
+                continue
+            i += 1
+
+            if state in ('value', 'value_or_end'):
+                if c == ']' and state == 'value_or_end':
+                    self._close()
+                elif c == '{':
+                    self._open({})
+                    self._state = 'key_or_end'
+                elif c == '[':
+                    self._open([])
+                    self._state = 'value_or_end'
+                elif c == '"':
+                    self._begin_string(is_key=False)
+                elif c in _LITERAL_CHARS:
+                    self._literal = [c]
+                    self._state = 'literal'
+                else:
+                    raise JSONStreamError(f'意外的字符: {c!r}')
+            elif state in ('key', 'key_or_end'):
+                if c == '"':
+                    self._begin_string(is_key=True)
+                elif c == '}' and state == 'key_or_end':
+                    self._close()
+                else:
+                    raise JSONStreamError(f'意外的字符: {c!r}')
+            elif state == 'colon':
+                if c != ':':
+                    raise JSONStreamError(f'意外的字符: {c!r}')
+                self._state = 'value'
+            else:  # after_value
+                container = self._stack[-1][0]
+                if c == ',':
+                    self._state = 'key' if isinstance(container, dict) else 'value'
+                elif c == ('}' if isinstance(container, dict) else ']'):
+                    self._close()
+                else:
+                    raise JSONStreamError(f'意外的字符: {c!r}')
+
+        # 本块结束时把字符串值已解码的部分作为一条事件发出
+        if self._state in ('string', 'escape', 'unicode'):
+            self._flush_chunk()
+
+        events = self._events
+        self._events = []
+        return events
+
+    def _child_path(self):
+        container, path, key = self._stack[-1]
+        return path + ((key,) if isinstance(container, dict) else (len(container),))
+
+    def _attach(self, value):
+        """把完成（或刚打开）的值挂到父容器上"""
+        if not self._stack:
+            self.value = value
+            return
+        frame = self._stack[-1]
+        if isinstance(frame[0], dict):
+            frame[0][frame[2]] = value
+        else:
+            frame[0].append(value)
+
+    def _after_value(self):
+        if self._stack:
+            self._state = 'after_value'
+        else:
+            self._state = 'done'
+            self.done = True
+
+    def _open(self, container):
+        path = self._child_path() if self._stack else ()
+        # 先挂到父容器上，解析过程中 value 就能看到部分结果
+        self._attach(container)
+        self._stack.append([container, path, None])
+
+    def _close(self):
+        container, path, _ = self._stack.pop()
+        self._events.append(('end', path, container))
+        self._after_value()
+
+    def _begin_string(self, is_key):
+        self._string_is_key = is_key
+        self._string_parts = []
+        self._string_chunk = []
+        self._string_path = None if is_key else self._child_path()
+        self._high_surrogate = None
+        self._state = 'string'
+
+    def _append_text(self, text):
+        if self._high_surrogate is not None:
+            # 高代理项后面没有跟低代理项，按原样保留（与json.loads一致）
+            text = chr(self._high_surrogate) + text
+            self._high_surrogate = None
+        self._string_parts.append(text)
+        if not self._string_is_key:
+            self._string_chunk.append(text)
+
+    def _append_code(self, code):
+        if 0xD800 <= code < 0xDC00:
+            if self._high_surrogate is not None:
+                self._append_text('')
+            self._high_surrogate = code
+        elif 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+            high = self._high_surrogate
+            self._high_surrogate = None
+            self._append_text(chr(0x10000 + ((high - 0xD800) << 10) + (code - 0xDC00)))
+        else:
+            self._append_text(chr(code))
+
+    def _flush_chunk(self):
+        if self._string_chunk:
+            self._events.append(('chunk', self._string_path, ''.join(self._string_chunk)))
+            self._string_chunk = []
+
+    def _end_string(self):
+        if self._high_surrogate is not None:
+            self._append_text('')
+        value = ''.join(self._string_parts)
+        self._string_parts = []
+        if self._string_is_key:
+            self._stack[-1][2] = value
+            self._state = 'colon'
+            return
+        self._flush_chunk()
+        self._events.append(('string', self._string_path, value))
+        self._attach(value)
+        self._after_value()
+
+    def _end_literal(self):
+        token = ''.join(self._literal)
+        try:
+            value = json.loads(token)
+        except ValueError:
+            raise JSONStreamError(f'无效的值: {token}')
+        self._attach(value)
+        self._after_value()
@@ -0,0 +1,507 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本地模拟LLM（离线压测）
+
+AIEngine 的性能测试原来都要连真实的DeepSeek接口，结果受密钥额度和服务商限流影响，
+调用失败时 AIEngine 还会退回 _generate_default_events / _generate_default_story_and_novel，
+测到的其实是默认数据。这里的模拟模型按提示词返回字段齐全的JSON：
+- 按提示词中给出的JSON格式判断请求类型：生成世界/势力/人物、分阶段生成世界（提纲、势力人物、地区详情）、
+  模拟天数、故事推进+小说、小说；其余请求（聊天）返回一段文本
+- 人物/势力ID取自提示词中的实体行（见 prompt_context.py），模拟结果写库时能命中已有数据
+- 同样的提示词得到同样的结果（按提示词哈希和 seed 生成），便于复现
+- 可配置首字延迟、输出速度、每块字数和出错比例
+
+两种用法，都通过 ai_configs.base_url 选择：
+- 独立服务（OpenAI兼容接口，支持流式）：python stub_llm.py --port 5098，base_url 填 http://127.0.0.1:5098/v1
+- 进程内模型（不经过HTTP）：base_url 填 stub://local，参数写在查询串中，
+  如 stub://local?latency=0.5&token_rate=50&error_rate=0.05
+
+参数（命令行参数和 stub:// 查询串同名，环境变量为 AI_STUB_ 加大写参数名，如 AI_STUB_LATENCY）：
+    latency=0.2          首字延迟（秒）
+    token_rate=0         输出速度（token/秒），0表示不限
+    chunk_size=8         流式输出每块的字数
+    error_rate=0         请求失败的比例（0~1）
+    error_status=500     失败时的HTTP状态码（429可用来测试限流退避）
+    chat_chars=200       聊天回复的字数
+    novel_chars=1500     小说正文的字数
+    seed=0               随机种子
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import asyncio
+import argparse
+import threading
+from typing import Any, List
+from urllib.parse import urlsplit, parse_qsl
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from rate_limit import estimate_tokens
+
+URL_SCHEME = 'stub://'
+
+_PARAMS = {
+    'latency': (float, 0.2),
+    'token_rate': (float, 0.0),
+    'chunk_size': (int, 8),
+    'error_rate': (float, 0.0),
+    'error_status': (int, 500),
+    'chat_chars': (int, 200),
+    'novel_chars': (int, 1500),
+    'seed': (int, 0),
+}
+
+
+class StubError(RuntimeError):
+    """模拟的服务端错误；带 status_code，限流器按429/5xx处理（见 rate_limit.is_retryable）"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f'模拟的服务端错误（HTTP {status_code}）')
+        self.status_code = status_code
+
+
+class StubSettings:
+    """模拟模型的参数，线程安全"""
+
+    def __init__(self, **params):
+        unknown = set(params) - set(_PARAMS)
+        if unknown:
+            raise ValueError(f"未知的参数: {', '.join(sorted(unknown))}")
+        for name, (kind, default) in _PARAMS.items():
+            setattr(self, name, kind(params.get(name, default)))
+        self.chunk_size = max(self.chunk_size, 1)
+        # 是否出错按 seed 决定的序列抽取，同样的请求顺序得到同样的出错位置
+        self._errors = random.Random(self.seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls, **overrides):
+        params = {name: os.environ[f'AI_STUB_{name.upper()}'] for name in _PARAMS
+                  if f'AI_STUB_{name.upper()}' in os.environ}
+        params.update(overrides)
+        return cls(**params)
+
+    @classmethod
+    def from_url(cls, url: str):
+        """stub://local?latency=0.5&token_rate=50，未写的参数取环境变量或默认值"""
+        return cls.from_env(**dict(parse_qsl(urlsplit(url).query)))
+
+    def next_failure(self):
+        """本次请求应返回的错误状态码，不出错时返回None"""
+        with self._lock:
+            self.requests += 1
+            if self.error_rate and self._errors.random() < self.error_rate:
+                self.failures += 1
+                return self.error_status
+        return None
+
+    def chunks(self, text: str):
+        """流式输出的分块：[(文本块, 输出前等待的秒数)]，第一块包含首字延迟"""
+        pieces = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or ['']
+        return [(piece, (self.latency if i == 0 else 0) + self.generation_time(piece))
+                for i, piece in enumerate(pieces)]
+
+    def generation_time(self, text: str) -> float:
+        return estimate_tokens(text) / self.token_rate if self.token_rate else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            params = {name: getattr(self, name) for name in _PARAMS}
+            return {**params, 'requests': self.requests, 'failures': self.failures}
+
+
+# ---- 按提示词生成结果 ----
+
+_SURNAMES = '李王张林萧叶苏陆沈顾秦韩楚白云'
+_GIVEN = '云风清玄尘霜墨遥澜羽青岚宁川若寒'
+_FACTION_PREFIXES = ['青云', '天剑', '玄武', '紫霄', '太虚', '落霞', '万兽', '丹鼎', '幽冥', '听雨']
+_FACTION_SUFFIXES = '宗门阁谷宫派'
+_REGION_NAMES = ['青州', '云梦泽', '天元城', '落日山脉', '东海', '北原', '赤霞谷', '寒江城', '南疆', '望仙岭']
+_REGION_TYPES = ['州', '泽', '城', '山脉', '海域', '平原', '谷', '城', '州', '山']
+_REALMS = ['练气期', '筑基期', '金丹期', '元婴期', '化神期']
+_POSITIONS = ['宗主', '长老', '护法', '内门弟子', '外门弟子', '执事']
+_TIME_PERIODS = ['清晨', '上午', '中午', '下午', '傍晚', '夜晚']
+_THEMES = ['修炼突破', '势力冲突', '秘境探索', '机缘巧合', '恩怨情仇', '宗门大比']
+_PHRASES = ['灵气在山谷间翻涌', '剑光划破夜空', '长老们在大殿中低声商议', '弟子们议论纷纷',
+            '远处传来钟声', '一道身影掠过山门', '古老的阵法微微发亮', '众人神色凝重',
+            '秘境的入口悄然开启', '一封密信送到了宗主手中', '雷云在天边聚集', '丹炉中药香四溢']
+
+_SECTION_HEADERS = (('### 势力情况', 'factions'), ('### 人物情况', 'characters'), ('### 地区情况', 'regions'))
+
+
+def _message_pairs(messages):
+    """(角色, 内容) 列表；messages 可以是OpenAI格式的字典或LangChain消息"""
+    pairs = []
+    for message in messages:
+        if isinstance(message, dict):
+            pairs.append((message.get('role', 'user'), str(message.get('content') or '')))
+        else:
+            pairs.append((getattr(message, 'type', 'human'), str(getattr(message, 'content', message))))
+    return pairs
+
+
+def _name(rng) -> str:
+    return rng.choice(_SURNAMES) + ''.join(rng.choice(_GIVEN) for _ in range(rng.randint(1, 2)))
+
+
+def _text(rng, chars: int) -> str:
+    """chars字的描述文本（按字数截断）"""
+    parts = []
+    length = 0
+    while length < chars:
+        phrase = rng.choice(_PHRASES) + rng.choice('，。')
+        parts.append(phrase)
+        length += len(phrase)
+    return ''.join(parts)[:max(chars, 1)]
+
+
+def _entities(prompt: str) -> dict:
+    """提示词中按行列出的势力/人物/地区（每行一个JSON对象，见 prompt_context.py）"""
+    entities = {key: [] for _, key in _SECTION_HEADERS}
+    current = None
+    for line in prompt.split('\n'):
+        line = line.strip()
+        if line.startswith('###'):
+            current = next((key for header, key in _SECTION_HEADERS if line.startswith(header)), None)
+        elif current and line.startswith('{'):
+            try:
+                entity = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entity, dict) and entity.get('id') is not None:
+                entities[current].append(entity)
+    return entities
+
+
+def _number(pattern: str, prompt: str, default: int) -> int:
+    match = re.search(pattern, prompt)
+    return int(match.group(1)) if match else default
+
+
+def _world_outline(rng):
+    regions = [{'name': _REGION_NAMES[i], 'type': _REGION_TYPES[i]} for i in rng.sample(range(10), 4)]
+    factions = [_faction(rng, prefix) for prefix in rng.sample(_FACTION_PREFIXES, rng.randint(4, 5))]
+    return {
+        'enhanced_background': _text(rng, 300),
+        'world_introduction': _text(rng, 300),
+        'cultivation_system': '境界分为' + '、'.join(_REALMS) + '。' + _text(rng, 100),
+        'regions': regions,
+        'factions': factions
+    }
+
+
+def _faction(rng, prefix=None):
+    return {
+        'name': (prefix or rng.choice(_FACTION_PREFIXES)) + rng.choice(_FACTION_SUFFIXES),
+        'ideal': _text(rng, 20),
+        'background': _text(rng, 120),
+        'description': _text(rng, 120),
+        'status': '活跃',
+        'power_level': rng.randint(30, 95),
+        'headquarters_location': rng.choice(_REGION_NAMES),
+        'relationships': _text(rng, 40)
+    }
+
+
+def _character(rng, faction_name):
+    return {
+        'name': _name(rng),
+        'faction': faction_name,
+        'faction_name': faction_name,
+        'status': '活跃',
+        'personality': _text(rng, 30),
+        'birthday': f'{rng.randint(1, 12)}月{rng.randint(1, 28)}日',
+        'age': rng.randint(16, 300),
+        'location': rng.choice(_REGION_NAMES),
+        'position': rng.choice(_POSITIONS),
+        'realm': rng.choice(_REALMS),
+        'lifespan': rng.choice([100, 150, 300, 500]),
+        'equipment': ['长剑', '储物袋'],
+        'skills': ['御剑术', '护体真诀'],
+        'experience': _text(rng, 120),
+        'goals': _text(rng, 30),
+        'relationships': _text(rng, 30)
+    }
+
+
+def _world(rng, prompt):
+    outline = _world_outline(rng)
+    names = [region['name'] for region in outline['regions']]
+    return {
+        'world_introduction': outline['world_introduction'],
+        'enhanced_background': outline['enhanced_background'],
+        'cultivation_system': outline['cultivation_system'],
+        'geography': _text(rng, 100),
+        'culture': _text(rng, 100),
+        'history': [_text(rng, 30) for _ in range(3)],
+        'map_regions': [{'name': name, 'type': region['type'], 'description': _text(rng, 60),
+                         'parent_name': names[0] if i else None}
+                        for i, (name, region) in enumerate(zip(names, outline['regions']))],
+        'summary': '生成了世界设定'
+    }
+
+
+def _simulation(rng, prompt, days=None):
+    current_day = _number(r'当前天数：第(\d+)天', prompt, 0)
+    days = days or _number(r'生成接下来(\d+)天', prompt, 1)
+    entities = _entities(prompt)
+    factions = entities['factions']
+    characters = entities['characters']
+    result = {'world_events': [], 'faction_events': [], 'character_events': [],
+              'faction_updates': [], 'character_updates': []}
+    for day in range(current_day + 1, current_day + days + 1):
+        for _ in range(2):
+            result['world_events'].append({
+                'day': day, 'time_period': rng.choice(_TIME_PERIODS), 'faction_id': None,
+                'theme': rng.choice(_THEMES), 'title': _text(rng, 8),
+                'description': _text(rng, 150), 'region_id': None, 'location': rng.choice(_REGION_NAMES)
+            })
+        for faction in rng.sample(factions, min(2, len(factions))) or [None]:
+            result['faction_events'].append({
+                'faction_id': faction and faction['id'], 'day': day, 'time_period': rng.choice(_TIME_PERIODS),
+                'theme': rng.choice(_THEMES), 'title': _text(rng, 8), 'description': _text(rng, 120)
+            })
+        for character in rng.sample(characters, min(3, len(characters))) or [None]:
+            result['character_events'].append({
+                'character_id': character and character['id'], 'day': day,
+                'time_period': rng.choice(_TIME_PERIODS), 'theme': rng.choice(_THEMES),
+                'title': _text(rng, 8), 'description': _text(rng, 120)
+            })
+    if factions:
+        faction = rng.choice(factions)
+        result['faction_updates'].append({
+            'faction_id': faction['id'], 'name': faction.get('name'), 'status': _text(rng, 12),
+            'power_level': rng.randint(30, 95), 'description': _text(rng, 60),
+            'headquarters_location': faction.get('headquarters') or rng.choice(_REGION_NAMES),
+            'action': 'update', 'change_reason': _text(rng, 20)
+        })
+    for character in rng.sample(characters, min(2, len(characters))):
+        result['character_updates'].append({
+            'character_id': character['id'], 'name': character.get('name'),
+            'faction_id': character.get('faction_id'), 'status': _text(rng, 12),
+            'age': (character.get('age') or 20) + days, 'location': rng.choice(_REGION_NAMES),
+            'position': character.get('position') or rng.choice(_POSITIONS), 'realm': rng.choice(_REALMS),
+            'experience': _text(rng, 60), 'goals': _text(rng, 20), 'action': 'update',
+            'change_reason': _text(rng, 20)
+        })
+    faction = rng.choice(factions) if factions else None
+    created = _character(rng, faction and faction.get('name'))
+    created.update({'action': 'create', 'faction_id': faction and faction['id'],
+                    'appearance': _text(rng, 30), 'change_reason': _text(rng, 20)})
+    result['character_updates'].append(created)
+    result['new_time'] = f'第{current_day + days}天，{rng.choice(_TIME_PERIODS)}'
+    result['summary'] = _text(rng, 200)
+    return result
+
+
+def _novel(rng, chars, chapters=3):
+    per_chapter = max(chars // chapters, 20)
+    return {
+        'title': _text(rng, 8),
+        'chapters': [{'title': f'第{i + 1}章：{_text(rng, 6)}',
+                      'content': '\n'.join(_text(rng, 100) for _ in range(max(per_chapter // 100, 1)))}
+                     for i in range(chapters)]
+    }
+
+
+def _story_and_novel(rng, prompt, settings):
+    parts = {'story_progress': _simulation(rng, prompt, days=1), 'novel': _novel(rng, settings.novel_chars, 1)}
+    # 按提示词中给出的顺序输出（流式接口要求小说在前）
+    order = sorted(parts, key=lambda key: prompt.find(f'"{key}"'))
+    return {key: parts[key] for key in order}
+
+
+def reply_text(messages, settings: StubSettings) -> str:
+    """按提示词生成回复文本"""
+    prompt = '\n'.join(content for _, content in _message_pairs(messages))
+    rng = random.Random(zlib.crc32(prompt.encode('utf-8')) ^ settings.seed)
+
+    if '"story_progress"' in prompt and '"novel"' in prompt:
+        result = _story_and_novel(rng, prompt, settings)
+    elif '"world_events"' in prompt:
+        result = _simulation(rng, prompt)
+    elif '"chapters"' in prompt:
+        result = _novel(rng, settings.novel_chars)
+    elif '"map_regions"' in prompt:
+        result = _world(rng, prompt)
+    elif '"enhanced_background"' in prompt and '"factions"' in prompt:
+        result = _world_outline(rng)
+    elif '"characters"' in prompt:
+        # 分阶段生成世界：为一个势力生成人物
+        match = re.search(r'请为势力“(.*?)”', prompt)
+        faction_name = match.group(1) if match else None
+        result = {'characters': [_character(rng, faction_name) for _ in range(rng.randint(2, 3))]}
+    elif '"regions"' in prompt:
+        # 分阶段生成世界：补全地区描述，名称和类型保持不变
+        listed = prompt[prompt.find('请为以下地区补充'):]
+        regions = re.findall(r'^- (.+?)（(.*?)）$', listed, re.M)
+        result = {'regions': [{'name': name, 'type': kind, 'description': _text(rng, 80)}
+                              for name, kind in regions]}
+    elif '"faction_name"' in prompt:
+        match = re.search(r'可用势力：(\[.*?\])\n', prompt)
+        try:
+            names = [faction.get('name') for faction in json.loads(match.group(1))] if match else []
+        except ValueError:
+            names = []
+        result = [_character(rng, name) for name in names or [None] for _ in range(2)]
+    elif '"ideal"' in prompt:
+        result = [_faction(rng, prefix) for prefix in rng.sample(_FACTION_PREFIXES, rng.randint(3, 5))]
+    else:
+        return _text(rng, settings.chat_chars)
+    return json.dumps(result, ensure_ascii=False)
+
+
+# ---- 进程内模型 ----
+
+class StubChatModel(BaseChatModel):
+    """进程内的模拟聊天模型，invoke/stream/astream 与 ChatOpenAI 用法相同"""
+
+    settings: Any = None
+    model_name: str = 'stub'
+
+    @classmethod
+    def from_url(cls, url: str, model_name: str = None):
+        return cls(settings=StubSettings.from_url(url), model_name=model_name or 'stub')
+
+    @property
+    def _llm_type(self) -> str:
+        return 'stub'
+
+    def _settings(self) -> StubSettings:
+        if self.settings is None:
+            self.settings = StubSettings.from_env()
+        return self.settings
+
+    def _reply(self, messages):
+        settings = self._settings()
+        status = settings.next_failure()
+        if status is not None:
+            raise StubError(status)
+        return settings, reply_text(messages, settings)
+
+    @staticmethod
+    def _usage(messages, text):
+        prompt_tokens = sum(estimate_tokens(content) for _, content in _message_pairs(messages))
+        completion_tokens = estimate_tokens(text)
+        return {'input_tokens': prompt_tokens, 'output_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens}
+
+    def _generate(self, messages: List, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        settings, text = self._reply(messages)
+        time.sleep(settings.latency + settings.generation_time(text))
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        settings, text = self._reply(messages)
+        await asyncio.sleep(settings.latency + settings.generation_time(text))
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List, stop=None, run_manager=None, **kwargs):
+        settings, text = self._reply(messages)
+        for piece, delay in settings.chunks(text):
+            time.sleep(delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _astream(self, messages: List, stop=None, run_manager=None, **kwargs):
+        settings, text = self._reply(messages)
+        for piece, delay in settings.chunks(text):
+            await asyncio.sleep(delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+
+# ---- OpenAI兼容服务 ----
+
+def create_app(settings: StubSettings = None):
+    """OpenAI兼容的模拟服务（Starlette应用）：POST /v1/chat/completions（含流式）、GET /v1/models"""
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    settings = settings or StubSettings.from_env()
+
+    def chunk_event(model, delta, finish_reason=None, usage=None):
+        payload = {'id': 'stub', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                   'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}] if usage is None else []}
+        if usage is not None:
+            payload['usage'] = usage
+        return 'data: ' + json.dumps(payload, ensure_ascii=False) + '\n\n'
+
+    async def completions(request):
+        body = await request.json()
+        status = settings.next_failure()
+        if status is not None:
+            return JSONResponse({'error': {'message': f'模拟的服务端错误（HTTP {status}）', 'type': 'stub_error'}},
+                                status_code=status, headers={'Retry-After': '1'} if status == 429 else None)
+
+        messages = body.get('messages') or []
+        model = body.get('model') or 'stub'
+        text = reply_text(messages, settings)
+        prompt_tokens = sum(estimate_tokens(content) for _, content in _message_pairs(messages))
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': estimate_tokens(text),
+                 'total_tokens': prompt_tokens + estimate_tokens(text)}
+
+        if body.get('stream'):
+            include_usage = (body.get('stream_options') or {}).get('include_usage')
+
+            async def generate():
+                for i, (piece, delay) in enumerate(settings.chunks(text)):
+                    await asyncio.sleep(delay)
+                    yield chunk_event(model, {'role': 'assistant', 'content': piece} if i == 0 else {'content': piece})
+                yield chunk_event(model, {}, 'stop')
+                if include_usage:
+                    yield chunk_event(model, {}, usage=usage)
+                yield 'data: [DONE]\n\n'
+
+            return StreamingResponse(generate(), media_type='text/event-stream')
+
+        await asyncio.sleep(settings.latency + settings.generation_time(text))
+        return JSONResponse({
+            'id': 'stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': usage
+        })
+
+    async def models(request):
+        return JSONResponse({'object': 'list', 'data': [{'id': 'stub', 'object': 'model', 'owned_by': 'stub'}]})
+
+    async def stats(request):
+        return JSONResponse(settings.stats())
+
+    return Starlette(routes=[
+        Route('/v1/chat/completions', completions, methods=['POST']),
+        Route('/v1/models', models, methods=['GET']),
+        Route('/stats', stats, methods=['GET']),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟LLM服务（OpenAI兼容接口）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5098)
+    for name, (kind, default) in _PARAMS.items():
+        env = os.environ.get(f'AI_STUB_{name.upper()}')
+        parser.add_argument(f"--{name.replace('_', '-')}", type=kind, default=kind(env) if env else default)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    settings = StubSettings(**{name: getattr(args, name) for name in _PARAMS})
+    print(f"模拟LLM服务: http://{args.host}:{args.port}/v1  参数: {settings.stats()}")
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+统一事件时间线查询
+
+把世界/势力/人物三类事件合并为一条时间线，按 (day, created_at, id, type) 倒序排列，
+使用键集分页（keyset pagination）：客户端带上一页返回的游标继续读取，
+每个分支都沿 (save_id, day, created_at, id) 索引顺序读取，归并到 limit+1 行即停止，
+翻到多深的页面都不需要 OFFSET 扫描或在内存中排序整个列表。
+"""
+
+import json
+import base64
+
+# 事件类型 -> 表名；排序的最后一级按类型名倒序：world > faction > character
+EVENT_TABLES = {
+    'world': 'world_events',
+    'faction': 'faction_events',
+    'character': 'character_events',
+}
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+_BRANCH_SQL = '''
+    SELECT id, day, time_period, theme, event_title, event_description, '{type}' AS type, created_at
+    FROM {table}
+    WHERE save_id = ?{cursor_clause}'''
+
+
+def encode_cursor(event: dict) -> str:
+    """把一条事件的排序键编码为不透明的分页游标"""
+    key = [event['day'], event['created_at'], event['id'], event['type']]
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str):
+    """解析分页游标，格式不正确时抛出ValueError"""
+    try:
+        day, created_at, event_id, event_type = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('无效的分页游标')
+    if event_type not in EVENT_TABLES:
+        raise ValueError('无效的分页游标')
+    return day, created_at, event_id, event_type
+
+
+def parse_types(types: str = None):
+    """解析逗号分隔的类型过滤参数，为空时返回全部类型"""
+    if not types:
+        return list(EVENT_TABLES)
+    selected = [t.strip() for t in types.split(',') if t.strip()]
+    unknown = [t for t in selected if t not in EVENT_TABLES]
+    if unknown:
+        raise ValueError(f"未知的事件类型: {', '.join(unknown)}")
+    return [t for t in EVENT_TABLES if t in selected]
+
+
+def build_timeline_query(save_id: int, types=None, cursor=None, limit: int = DEFAULT_LIMIT):
+    """构造时间线查询，返回 (sql, params)
+
+    各分支按索引顺序输出，UNION ALL 以归并方式合并，取满 limit 行即停止读取。
+    cursor 为 decode_cursor 的结果。
+    """
+    types = types or list(EVENT_TABLES)
+    branches = []
+    params = []
+    for event_type in types:
+        cursor_clause = ''
+        branch_params = [save_id]
+        if cursor is not None:
+            day, created_at, event_id, cursor_type = cursor
+            # 排序键相同时按类型名倒序，类型名小于游标类型的分支可以包含与游标相等的行
+            op = '<=' if event_type < cursor_type else '<'
+            cursor_clause = f' AND (day, created_at, id) {op} (?, ?, ?)'
+            branch_params += [day, created_at, event_id]
+        branches.append(_BRANCH_SQL.format(type=event_type, table=EVENT_TABLES[event_type],
+                                           cursor_clause=cursor_clause))
+        params += branch_params
+
+    sql = '\n    UNION ALL'.join(branches) + '''
+    ORDER BY day DESC, created_at DESC, id DESC, type DESC
+    LIMIT ?'''
+    params.append(limit)
+    return sql, params
+
+
+def fetch_timeline(conn, save_id: int, types=None, cursor: str = None, limit: int = DEFAULT_LIMIT):
+    """读取一页时间线事件
+
+    Returns:
+        Dict: events 为本页事件，next_cursor 为下一页游标（没有更多时为None）
+    """
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    decoded = decode_cursor(cursor) if cursor else None
+    # 多取一行用来判断是否还有下一页
+    sql, params = build_timeline_query(save_id, types, decoded, limit + 1)
+    rows = conn.execute(sql, params).fetchall()
+
+    events = [{
+        'id': row[0],
+        'day': row[1],
+        'time_period': row[2] or '',
+        'theme': row[3] or '',
+        'title': row[4] or '',
+        'description': row[5] or '',
+        'type': row[6],
+        'created_at': row[7]
+    } for row in rows[:limit]]
+
+    has_more = len(rows) > limit
+    return {
+        'events': events,
+        'next_cursor': encode_cursor(events[-1]) if has_more else None,
+        'has_more': has_more
+    }